@@ -0,0 +1,378 @@
+"""
+End-to-end throughput benchmark for the bulk testing pipeline.
+
+Runs submit -> poll -> parse -> pivot -> export against mock_runpod_server.py
+for each transcript count and prompt mode, plus microbenchmarks for
+extract_jsons_from_response and count_tokens and a cold-start measurement
+(module import and first render of the app in a fresh interpreter).
+
+Usage:
+    python benchmark.py                          # 100/1k/10k, single + multi prompt
+    python benchmark.py --sizes 100,1000 --modes multi
+    python benchmark.py --save-baseline          # store results as the new baseline
+
+Each scenario runs in its own subprocess so peak RSS is measured per scenario.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import timeit
+from typing import Any, Dict, List, Optional
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Metrics where a larger value is better; everything else is lower-is-better
+HIGHER_IS_BETTER = {'jobs_per_sec'}
+
+SAMPLE_TURNS = [
+    "Agent: Thank you for calling, my name is Sarah. How can I help you today?",
+    "Customer: Hi, my package hasn't arrived and it's been a week.",
+    "Agent: I completely understand your frustration. Can you give me your order number?",
+    "Customer: Sure, it's 12345.",
+    "Agent: Thank you. The package was delayed by weather and should arrive in two business days.",
+    "Customer: Okay, thanks for checking.",
+    "Agent: You're welcome. Is there anything else I can help you with today?",
+]
+
+
+# Synthetic inputs
+def make_transcripts(size: int, turns_per_transcript: int = 40):
+    """Build a transcripts DataFrame shaped like the Bulk Testing upload"""
+    import pandas as pd
+
+    rows = []
+    for i in range(size):
+        turns = [SAMPLE_TURNS[(i + t) % len(SAMPLE_TURNS)] for t in range(turns_per_transcript)]
+        rows.append({'interactionid': f"INT-{i:06d}", 'transcript': "\n".join(turns)})
+    return pd.DataFrame(rows)
+
+
+def make_prompts_info(mode: str, questions: int) -> Dict[str, Any]:
+    """Build st.session_state.bulk_test_prompts for single- or multi-prompt mode"""
+    if mode == 'single':
+        return {'single': True, 'prompt': "Question 1: Did the agent greet the customer professionally?\nRATING OPTIONS:\nYes / No / N/A"}
+
+    prompts_dict = {}
+    prompts_with_numbers = {}
+    for n in range(1, questions + 1):
+        question = f"Benchmark question {n}: did the agent meet criterion {n}?"
+        prompt = f"Evaluate criterion {n}. Rating options: Yes / No / N/A. Quote evidence from the transcript."
+        prompts_dict[question] = prompt
+        prompts_with_numbers[question] = {'prompt': prompt, 'question_number': n}
+    return {'single': False, 'prompts': prompts_dict, 'prompts_with_numbers': prompts_with_numbers}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of floats"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB (None where unsupported)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# End-to-end scenario (runs inside a subprocess)
+def run_scenario(mode: str, size: int, args) -> Dict[str, Any]:
+    from mock_runpod_server import start_mock_server
+
+    server, base_url = start_mock_server(workers=args.workers, exec_time=args.exec_time, queue_delay=args.queue_delay)
+    os.environ['RUNPOD_BASE_URL'] = base_url
+    import streamlit_app as app
+
+    df = make_transcripts(size)
+    prompts_info = make_prompts_info(mode, args.questions)
+
+    # Record per-job submit times by wrapping the module-level submit_job used by submit_bulk_jobs
+    submitted_at = {}
+    original_submit_job = app.submit_job
+
+    def timed_submit_job(*a, **kw):
+        job_id = original_submit_job(*a, **kw)
+        if job_id:
+            submitted_at[job_id] = time.perf_counter()
+        return job_id
+
+    app.submit_job = timed_submit_job
+
+    stages = {}
+    start = time.perf_counter()
+    structured = dict(app.DEFAULT_STRUCTURED_OUTPUT) if args.structured else None
+    if args.webhooks:
+        app.start_webhook_receiver(port=0)
+    app.configure_transport(args.compress)
+    app.configure_scheduler(args.priority_scheduling, args.reserved_share)
+    jobs = app.submit_bulk_jobs(df, prompts_info, args.max_tokens, 0.4, structured=structured)
+    stages['submit_s'] = time.perf_counter() - start
+
+    # Poll until every job reaches a terminal state
+    poll_start = time.perf_counter()
+    bulk_results = {}
+    latencies = []
+    failed = 0
+    parse_s = 0.0
+    status_calls = 0
+    pending = list(jobs)
+    while pending:
+        still_pending = []
+        completed = []
+        for job_info in pending:
+            status = app.check_job_status(job_info['job_id'])
+            status_calls += 1
+            state = status.get('status')
+            if state == 'COMPLETED':
+                latencies.append(time.perf_counter() - submitted_at[job_info['job_id']])
+                completed.append((job_info, status))
+            elif state in ('FAILED', 'CANCELLED', 'TIMED_OUT', 'ERROR'):
+                failed += 1
+            else:
+                still_pending.append(job_info)
+        # Parse each polling pass's completions together, as the app does
+        parse_start = time.perf_counter()
+        app.process_bulk_job_statuses(completed, bulk_results)
+        parse_s += time.perf_counter() - parse_start
+        pending = still_pending
+        if pending:
+            time.sleep(args.poll_interval)
+    stages['poll_s'] = time.perf_counter() - poll_start - parse_s
+    stages['parse_s'] = parse_s
+
+    t = time.perf_counter()
+    results_df = app.build_bulk_results_df(bulk_results)
+    stages['build_df_s'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    rating_df = app.pivot_bulk_results(results_df, 'rating')
+    stages['pivot_s'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    excel_bytes = app.export_bulk_results_excel(results_df, rating_df, df)
+    stages['export_s'] = time.perf_counter() - t
+
+    total = time.perf_counter() - start
+    transport = app.transport_totals()
+    if args.webhooks:
+        # Shut the receiver down with the mock server that was posting to it
+        app.stop_webhook_receiver()
+    server.shutdown()
+
+    return {
+        'scenario': f"{mode}-{size}",
+        'jobs': len(jobs),
+        'failed': failed,
+        'results': len(bulk_results),
+        'status_calls': status_calls,
+        'jobs_per_sec': len(jobs) / total if total else 0.0,
+        'p50_latency_s': percentile(latencies, 50),
+        'p99_latency_s': percentile(latencies, 99),
+        'total_s': total,
+        'excel_bytes': len(excel_bytes),
+        'upload_mb': transport['request_bytes_sent'] / 1e6,
+        'upload_json_mb': transport['request_bytes_json'] / 1e6,
+        'peak_rss_mb': peak_rss_mb(),
+        **stages,
+    }
+
+
+# Microbenchmarks
+def run_microbenchmarks(args) -> Dict[str, Any]:
+    import streamlit_app as app
+    from mock_runpod_server import synthesize_output
+
+    results = {}
+
+    questions = "\n".join(f"Question {n}: criterion {n}?" for n in range(1, args.questions + 1))
+    short_output = synthesize_output(questions)
+    # Long reasoning block (~30k tokens at ~4 chars per token) ahead of the JSON answers
+    long_output = "<think>\n" + ("Considering the agent's wording in turn 12 against the guideline. " * 1800) + "\n</think>\n" + short_output.split('</think>')[-1]
+
+    for name, text in (('extract_jsons_short', short_output), ('extract_jsons_30k_reasoning', long_output)):
+        runs = args.micro_repeat
+        seconds = timeit.timeit(lambda: app.extract_jsons_from_response(text), number=runs)
+        results[f"{name}_ms"] = seconds / runs * 1000
+
+    transcript = make_transcripts(1, turns_per_transcript=400)['transcript'][0]
+    try:
+        import tiktoken
+        tiktoken.encoding_for_model("gpt-4")
+    except Exception as e:
+        results['count_tokens_ms'] = None
+        results['count_tokens_note'] = f"skipped: tiktoken encoding unavailable ({type(e).__name__})"
+    else:
+        runs = args.micro_repeat
+        seconds = timeit.timeit(lambda: app.count_tokens(transcript), number=runs)
+        results['count_tokens_ms'] = seconds / runs * 1000
+
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+# Cold start (runs inside a subprocess): time from a fresh interpreter to the first rendered page
+HEAVY_MODULES = ('pandas', 'numpy', 'pyarrow', 'tiktoken', 'openpyxl')
+
+def run_coldstart(args) -> Dict[str, Any]:
+    from mock_runpod_server import start_mock_server
+    from streamlit.testing.v1 import AppTest
+
+    server, base_url = start_mock_server(workers=args.workers, health_latency=args.health_latency)
+    os.environ['RUNPOD_BASE_URL'] = base_url
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+
+    start = time.perf_counter()
+    at = AppTest.from_file(app_path, default_timeout=120).run()
+    first_render = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f"First render failed: {at.exception[0].value}")
+
+    start = time.perf_counter()
+    at.run()
+    rerun = time.perf_counter() - start
+    return {
+        'first_render_s': first_render,
+        'rerun_s': rerun,
+        'health_latency_s': args.health_latency,
+        'heavy_modules_loaded': ",".join(m for m in HEAVY_MODULES if m in sys.modules) or "none",
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+# Baseline comparison
+def compare_to_baseline(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """Print a comparison table and return the list of regressions beyond tolerance"""
+    regressions = []
+    print(f"\n{'scenario':<22}{'metric':<34}{'baseline':>12}{'current':>12}{'change':>10}")
+    for scenario, metrics in current.items():
+        base_metrics = baseline.get(scenario)
+        if not base_metrics:
+            continue
+        for metric, value in metrics.items():
+            base_value = base_metrics.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(base_value, (int, float)) or not base_value:
+                continue
+            if metric in ('jobs', 'results', 'excel_bytes', 'status_calls', 'failed', 'health_latency_s', 'upload_json_mb'):
+                continue
+            change = (value - base_value) / base_value
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = "  <-- regression" if worse > tolerance else ""
+            if flag:
+                regressions.append(f"{scenario}.{metric}")
+            print(f"{scenario:<22}{metric:<34}{base_value:>12.4f}{value:>12.4f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def print_results(results: Dict[str, Dict[str, Any]]):
+    for scenario, metrics in results.items():
+        print(f"\n== {scenario} ==")
+        for metric, value in metrics.items():
+            if isinstance(value, float):
+                print(f"  {metric:<32}{value:,.4f}")
+            else:
+                print(f"  {metric:<32}{value}")
+
+
+def run_in_subprocess(argv: List[str]) -> Dict[str, Any]:
+    """Run one scenario in a fresh interpreter and parse its JSON result"""
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__)] + argv,
+                               capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        raise RuntimeError(f"Scenario {argv} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk pipeline throughput benchmark")
+    parser.add_argument('--sizes', default='100,1000,10000', help="Comma-separated transcript counts")
+    parser.add_argument('--modes', default='single,multi', help="Comma-separated prompt modes (single, multi)")
+    parser.add_argument('--questions', type=int, default=10, help="Questions per multi-prompt job")
+    parser.add_argument('--workers', type=int, default=32, help="Mock server worker count")
+    parser.add_argument('--exec-time', default='fixed:0.005', help="Mock execution time distribution")
+    parser.add_argument('--queue-delay', default='fixed:0', help="Mock queue delay distribution")
+    parser.add_argument('--max-tokens', type=int, default=32768)
+    parser.add_argument('--poll-interval', type=float, default=0.05, help="Seconds between polling passes")
+    parser.add_argument('--structured', action='store_true', help="Submit with guided JSON decoding")
+    parser.add_argument('--webhooks', action='store_true', help="Receive completions by webhook instead of polling")
+    parser.add_argument('--compress', action='store_true', help="Gzip request bodies")
+    parser.add_argument('--priority-scheduling', action='store_true', help="Hold bulk jobs in the local priority queue")
+    parser.add_argument('--reserved-share', type=float, default=0.25, help="Endpoint share kept free for interactive jobs with --priority-scheduling")
+    parser.add_argument('--micro-repeat', type=int, default=20, help="Iterations per microbenchmark")
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-e2e', action='store_true')
+    parser.add_argument('--skip-coldstart', action='store_true')
+    parser.add_argument('--health-latency', type=float, default=0.5, help="Seconds the mock's /health takes in the cold-start run")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="Write these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed regression before failing (fraction)")
+    parser.add_argument('--scenario', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: run a single scenario and print its JSON result
+    if args.scenario:
+        if args.scenario == 'micro':
+            result = run_microbenchmarks(args)
+        elif args.scenario == 'coldstart':
+            result = run_coldstart(args)
+        else:
+            mode, size = args.scenario.split(':')
+            result = run_scenario(mode, int(size), args)
+        print(json.dumps(result))
+        return
+
+    passthrough = [
+        '--questions', str(args.questions), '--workers', str(args.workers),
+        '--exec-time', args.exec_time, '--queue-delay', args.queue_delay,
+        '--max-tokens', str(args.max_tokens), '--poll-interval', str(args.poll_interval),
+        '--micro-repeat', str(args.micro_repeat), '--health-latency', str(args.health_latency),
+        '--reserved-share', str(args.reserved_share),
+    ]
+    for flag in ('structured', 'webhooks', 'compress', 'priority_scheduling'):
+        if getattr(args, flag):
+            passthrough.append('--' + flag.replace('_', '-'))
+
+    results = {}
+    if not args.skip_e2e:
+        for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+            for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+                print(f"Running {mode}-prompt pipeline with {size} transcripts...", flush=True)
+                result = run_in_subprocess(['--scenario', f"{mode}:{size}"] + passthrough)
+                results[result.pop('scenario')] = result
+    if not args.skip_micro:
+        print("Running microbenchmarks...", flush=True)
+        results['micro'] = run_in_subprocess(['--scenario', 'micro'] + passthrough)
+    if not args.skip_coldstart:
+        print("Measuring cold start...", flush=True)
+        results['coldstart'] = run_in_subprocess(['--scenario', 'coldstart'] + passthrough)
+
+    print_results(results)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline.get('results', {}), args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
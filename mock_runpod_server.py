@@ -0,0 +1,617 @@
+"""
+Local stand-in for the RunPod v2 serverless API.
+
+Serves the same routes the app talks to (/run, /runsync, /status/{id},
+/stream/{id}, /cancel/{id}, /health) under /v2/{endpoint_id}/ so throughput
+and resilience work can be done on a laptop with no network.
+
+Usage:
+    python mock_runpod_server.py --port 8000 --workers 4 --exec-time uniform:2,6
+
+Then point the app at it:
+    RUNPOD_BASE_URL=http://localhost:8000/v2 streamlit run streamlit_app.py
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+DEFAULT_RATING_OPTIONS = ["Yes", "No", "N/A"]
+
+
+# Timing distributions
+def parse_distribution(spec: str) -> Callable[[], float]:
+    """Parse a distribution spec such as 'fixed:2', 'uniform:1,3', 'normal:2,0.5',
+    'lognormal:0.5,0.4' or 'exp:2' into a sampler returning seconds"""
+    name, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v.strip()] if params else []
+    name = name.strip().lower()
+
+    if name == 'fixed':
+        return lambda: values[0] if values else 0.0
+    if name == 'uniform':
+        low, high = values
+        return lambda: random.uniform(low, high)
+    if name == 'normal':
+        mu, sigma = values
+        return lambda: max(0.0, random.gauss(mu, sigma))
+    if name == 'lognormal':
+        mu, sigma = values
+        return lambda: random.lognormvariate(mu, sigma)
+    if name == 'exp':
+        mean = values[0]
+        return lambda: random.expovariate(1.0 / mean) if mean > 0 else 0.0
+    raise ValueError(f"Unknown distribution '{spec}'")
+
+
+# Rough token estimate (the mock avoids tiktoken so it starts instantly)
+def estimate_tokens(text: str) -> int:
+    """Approximate token count at ~4 characters per token"""
+    return max(1, len(text) // 4)
+
+
+def prompt_digest(prompt: str) -> str:
+    """Stable short hash of a prompt, used to match recorded outputs"""
+    return hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+
+
+# Synthesized model output
+SAMPLE_DISAGREEMENT = 0.3
+
+
+def sample_rating(options: List[str], seed: int, index: int, sample: int) -> str:
+    """Rating for one question; extra samples (n > 1) sometimes disagree with the first"""
+    rating = options[(seed + index) % len(options)]
+    if sample and random.Random(seed + 1000 * sample + index).random() < SAMPLE_DISAGREEMENT:
+        rating = options[(seed + index + sample) % len(options)]
+    return rating
+
+
+def synthesize_output(prompt: str, sample: int = 0) -> str:
+    """Build a reasoning block plus one JSON answer per question found in the prompt"""
+    # Drop chat-template markers such as '< | User | >' so each section starts on its own line
+    prompt = re.sub(r'<\s*\|[^>]*\|\s*>', '\n', prompt)
+    questions = re.findall(r'^Question\s+(\S+?):\s*(.+)$', prompt, re.MULTILINE)
+    if not questions:
+        questions = [('1', 'The question being evaluated')]
+
+    options = DEFAULT_RATING_OPTIONS
+    options_match = re.search(r'RATING OPTIONS:\s*\n(.+)', prompt)
+    if options_match:
+        parsed = [o.strip() for o in re.split(r'[/|,]', options_match.group(1)) if o.strip()]
+        if len(parsed) > 1:
+            options = parsed
+
+    seed = int(prompt_digest(prompt)[:8], 16)
+    answers = []
+    for i, (number, question) in enumerate(questions):
+        rating = sample_rating(options, seed, i, sample)
+        answers.append(json.dumps({
+            'question': question.strip(),
+            'rating': rating,
+            'explanation': f"Mock evaluation for question {number}: the transcript supports '{rating}'."
+        }, indent=2))
+
+    reasoning = "Reviewing the transcript turn by turn against each question. " * 8
+    return f"<think>\n{reasoning.strip()}\n</think>\n\n" + "\n".join(answers)
+
+
+def synthesize_structured_output(prompt: str, schema: Dict[str, Any], sample: int = 0) -> str:
+    """Build a short reasoning block plus JSON that conforms to a guided-decoding schema"""
+    if schema.get('type') == 'array':
+        items = schema.get('prefixItems') or (schema.get('items') or {}).get('anyOf') or [schema.get('items') or {}]
+    else:
+        items = [schema]
+    questions = re.findall(r'^Question\s+\S+?:\s*(.+)$', re.sub(r'<\s*\|[^>]*\|\s*>', '\n', prompt), re.MULTILINE)
+    seed = int(prompt_digest(prompt)[:8], 16)
+
+    answers = []
+    for i, item in enumerate(items):
+        properties = item.get('properties', {})
+        question = (properties.get('question', {}).get('enum')
+                    or [questions[i] if i < len(questions) else 'The question being evaluated'])[0]
+        options = properties.get('rating', {}).get('enum') or DEFAULT_RATING_OPTIONS
+        rating = sample_rating(options, seed, i, sample)
+        explanation = f"Mock evaluation: the transcript supports '{rating}'."
+        answers.append({'question': question, 'rating': rating,
+                        'explanation': explanation[:properties.get('explanation', {}).get('maxLength', len(explanation))]})
+
+    body = answers[0] if schema.get('type') != 'array' else answers
+    return "<think>\nChecking the transcript against the rating options.\n</think>\n\n" + json.dumps(body)
+
+
+class MockRunPod:
+    """In-memory job queue with a simulated worker pool"""
+
+    def __init__(self, workers: int = 4, queue_delay: str = 'fixed:0', exec_time: str = 'uniform:1,3',
+                 seconds_per_1k_tokens: float = 0.0, failure_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, canned_output: Optional[str] = None,
+                 replay: Optional[List[Dict[str, Any]]] = None, record_path: Optional[str] = None,
+                 upstream: Optional[str] = None, upstream_api_key: Optional[str] = None,
+                 runsync_timeout: float = 90.0, webhook_drop_rate: float = 0.0, health_latency: float = 0.0,
+                 accept_gzip: bool = True):
+        self.queue_delay = parse_distribution(queue_delay)
+        self.exec_time = parse_distribution(exec_time)
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.canned_output = canned_output
+        self.replay = replay or []
+        self.replay_by_prompt = {r['prompt_sha1']: r for r in self.replay if r.get('prompt_sha1')}
+        self.record_path = record_path
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.upstream_api_key = upstream_api_key
+        self.runsync_timeout = runsync_timeout
+        self.webhook_drop_rate = webhook_drop_rate
+        self.health_latency = health_latency
+        self.accept_gzip = accept_gzip
+
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.pending: List[str] = []
+        self.counters = {'completed': 0, 'failed': 0, 'retried': 0, 'webhooks_sent': 0, 'webhooks_dropped': 0,
+                         'request_bytes': 0, 'request_bytes_decoded': 0}
+        self.running = 0
+        self.worker_count = workers
+        self._replay_index = 0
+        self._stopped = False
+
+        if not self.upstream:
+            for _ in range(workers):
+                threading.Thread(target=self._worker_loop, daemon=True).start()
+
+    # Job lifecycle
+    def submit(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a job and return the /run response body"""
+        if self.upstream:
+            return self._proxy_submit(payload)
+
+        job_input = payload.get('input', {})
+        prompt = job_input.get('prompt', '')
+        job_id = f"mock-{uuid.uuid4()}"
+        job = {
+            'id': job_id,
+            'status': 'IN_QUEUE',
+            'input': job_input,
+            'submitted_at': time.time(),
+            'eligible_at': time.time() + self.queue_delay(),
+            'input_tokens': estimate_tokens(prompt),
+            'cancel_event': threading.Event(),
+            'webhook': payload.get('webhook'),
+        }
+        with self.cond:
+            self.jobs[job_id] = job
+            self.pending.append(job_id)
+            self.cond.notify()
+        return {'id': job_id, 'status': 'IN_QUEUE'}
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a queued or running job"""
+        if self.upstream:
+            return self._proxy_cancel(job_id)
+
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] in ('IN_QUEUE', 'IN_PROGRESS'):
+                job['status'] = 'CANCELLED'
+                job['cancel_event'].set()
+                if job_id in self.pending:
+                    self.pending.remove(job_id)
+            return {'id': job_id, 'status': job['status']}
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a RunPod-shaped status response"""
+        if self.upstream:
+            return self._proxy_status(job_id)
+
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            response = {'id': job_id, 'status': job['status']}
+            for key in ('delayTime', 'executionTime', 'output', 'error'):
+                if key in job:
+                    response[key] = job[key]
+            return response
+
+    def health(self) -> Dict[str, Any]:
+        """Return a RunPod-shaped /health response"""
+        if self.upstream:
+            return self._proxy_health()
+
+        if self.health_latency:
+            time.sleep(self.health_latency)
+        with self.lock:
+            in_queue = sum(1 for j in self.jobs.values() if j['status'] == 'IN_QUEUE')
+            in_progress = sum(1 for j in self.jobs.values() if j['status'] == 'IN_PROGRESS')
+            return {
+                'jobs': {
+                    'completed': self.counters['completed'],
+                    'failed': self.counters['failed'],
+                    'inProgress': in_progress,
+                    'inQueue': in_queue,
+                    'retried': self.counters['retried'],
+                },
+                'workers': {
+                    'idle': max(0, self.worker_count - self.running),
+                    'running': self.running,
+                },
+            }
+
+    def wait_for(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Block until a job reaches a terminal state or the timeout expires"""
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                job = self.jobs.get(job_id)
+                if job is None or job['status'] in ('COMPLETED', 'FAILED', 'CANCELLED'):
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+        return self.status(job_id)
+
+    def should_rate_limit(self) -> bool:
+        return self.rate_limit_rate > 0 and random.random() < self.rate_limit_rate
+
+    def stop(self):
+        with self.cond:
+            self._stopped = True
+            self.cond.notify_all()
+
+    # Simulated workers
+    def _next_job(self) -> Optional[Dict[str, Any]]:
+        with self.cond:
+            while not self._stopped:
+                now = time.time()
+                ready = [jid for jid in self.pending if self.jobs[jid]['eligible_at'] <= now]
+                if ready:
+                    job_id = ready[0]
+                    self.pending.remove(job_id)
+                    job = self.jobs[job_id]
+                    job['status'] = 'IN_PROGRESS'
+                    job['started_at'] = now
+                    job['delayTime'] = int((now - job['submitted_at']) * 1000)
+                    self.running += 1
+                    return job
+                next_eligible = min((self.jobs[jid]['eligible_at'] for jid in self.pending), default=None)
+                self.cond.wait(None if next_eligible is None else max(0.0, next_eligible - now))
+        return None
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            duration = self.exec_time() + self.seconds_per_1k_tokens * job['input_tokens'] / 1000
+            cancelled = job['cancel_event'].wait(duration)
+
+            with self.cond:
+                self.running -= 1
+                job['executionTime'] = int((time.time() - job['started_at']) * 1000)
+                if cancelled or job['status'] == 'CANCELLED':
+                    job['status'] = 'CANCELLED'
+                elif self.failure_rate > 0 and random.random() < self.failure_rate:
+                    job['status'] = 'FAILED'
+                    job['error'] = 'Injected failure from mock server'
+                    self.counters['failed'] += 1
+                else:
+                    job['output'] = self._build_output(job)
+                    job['status'] = 'COMPLETED'
+                    self.counters['completed'] += 1
+                self.cond.notify_all()
+
+            if job['webhook'] and job['status'] in ('COMPLETED', 'FAILED'):
+                threading.Thread(target=self._deliver_webhook, args=(job['id'],), daemon=True).start()
+
+    def _deliver_webhook(self, job_id: str, attempts: int = 3):
+        """POST the final status to the job's webhook URL, retrying like RunPod does"""
+        if self.webhook_drop_rate > 0 and random.random() < self.webhook_drop_rate:
+            with self.lock:
+                self.counters['webhooks_dropped'] += 1
+            return
+        body = self.status(job_id)
+        url = self.jobs[job_id]['webhook']
+        for attempt in range(attempts):
+            try:
+                if requests.post(url, json=body, timeout=10).status_code == 200:
+                    with self.lock:
+                        self.counters['webhooks_sent'] += 1
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5 * (attempt + 1))
+
+    def _build_output(self, job: Dict[str, Any]) -> List[Dict[str, Any]]:
+        prompt = job['input'].get('prompt', '')
+        sampling_params = job['input'].get('sampling_params', {})
+
+        if self.replay:
+            recorded = self.replay_by_prompt.get(prompt_digest(prompt))
+            if recorded is None:
+                recorded = self.replay[self._replay_index % len(self.replay)]
+                self._replay_index += 1
+            return recorded['output']
+
+        schema = sampling_params.get('guided_json') or sampling_params.get('guided_decoding', {}).get('json')
+        max_tokens = sampling_params.get('max_tokens')
+        # n > 1 returns several independent completions of the same prompt
+        choices = []
+        for sample in range(max(1, int(sampling_params.get('n') or 1))):
+            if self.canned_output is not None:
+                text = self.canned_output
+            elif schema:
+                text = synthesize_structured_output(prompt, schema, sample)
+            else:
+                text = synthesize_output(prompt, sample)
+
+            # Stop sequences end the generation and are not included in the output
+            for stop in sampling_params.get('stop') or []:
+                if stop in text:
+                    text = text[:text.index(stop)]
+
+            # Honour max_tokens so truncation behaves like the real endpoint
+            finish_reason = 'stop'
+            if max_tokens and estimate_tokens(text) > max_tokens:
+                text = text[:max_tokens * 4]
+                finish_reason = 'length'
+            choices.append({'tokens': [text], 'finish_reason': finish_reason})
+
+        return [{
+            'choices': choices,
+            'usage': {'input': job['input_tokens'],
+                      'output': sum(estimate_tokens(choice['tokens'][0]) for choice in choices)},
+        }]
+
+    # Record mode: forward to a real endpoint and save completed outputs
+    def _upstream_headers(self) -> Dict[str, str]:
+        return {'Authorization': f"Bearer {self.upstream_api_key}", 'Content-Type': 'application/json'}
+
+    def _proxy_submit(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = requests.post(f"{self.upstream}/run", headers=self._upstream_headers(), json=payload)
+        body = response.json()
+        with self.lock:
+            self.jobs[body['id']] = {'id': body['id'], 'status': body.get('status', 'IN_QUEUE'),
+                                     'prompt': payload.get('input', {}).get('prompt', ''), 'recorded': False}
+        return body
+
+    def _proxy_status(self, job_id: str) -> Dict[str, Any]:
+        response = requests.get(f"{self.upstream}/status/{job_id}", headers=self._upstream_headers())
+        body = response.json()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and body.get('status') == 'COMPLETED' and not job['recorded']:
+                job['recorded'] = True
+                with open(self.record_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({
+                        'prompt_sha1': prompt_digest(job['prompt']),
+                        'delayTime': body.get('delayTime'),
+                        'executionTime': body.get('executionTime'),
+                        'output': body.get('output'),
+                    }) + "\n")
+        return body
+
+    def _proxy_cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        response = requests.post(f"{self.upstream}/cancel/{job_id}", headers=self._upstream_headers())
+        if response.status_code == 404:
+            return None
+        body = response.json()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and body.get('status'):
+                job['status'] = body['status']
+        return body
+
+    def _proxy_health(self) -> Dict[str, Any]:
+        return requests.get(f"{self.upstream}/health", headers=self._upstream_headers()).json()
+
+
+class UnsupportedEncoding(Exception):
+    """Request body uses a Content-Encoding the mock doesn't accept"""
+
+
+def make_handler(mock: MockRunPod, api_key: Optional[str] = None):
+    """Build a request handler class bound to a MockRunPod instance"""
+
+    class RunPodHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes; without TCP_NODELAY a client reusing
+        # keep-alive connections waits ~40ms per response on delayed ACKs
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass  # Keep load tests quiet
+
+        def _send_json(self, code: int, body: Dict[str, Any], extra_headers: Optional[Dict[str, str]] = None):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (extra_headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_json(self) -> Dict[str, Any]:
+            length = int(self.headers.get('Content-Length', 0))
+            raw = self.rfile.read(length) if length else b''
+            encoding = self.headers.get('Content-Encoding', 'identity').lower()
+            if encoding == 'gzip' and mock.accept_gzip:
+                body = gzip.decompress(raw)
+            elif encoding == 'identity':
+                body = raw
+            else:
+                raise UnsupportedEncoding(encoding)
+            with mock.lock:
+                mock.counters['request_bytes'] += len(raw)
+                mock.counters['request_bytes_decoded'] += len(body)
+            return json.loads(body.decode('utf-8')) if body else {}
+
+        def _route(self):
+            # Paths look like /v2/{endpoint_id}/{action}[/{job_id}]
+            parts = [p for p in self.path.split('?')[0].split('/') if p]
+            if len(parts) < 3 or parts[0] != 'v2':
+                return None, None
+            return parts[2], (parts[3] if len(parts) > 3 else None)
+
+        def _authorized(self) -> bool:
+            if api_key is None:
+                return True
+            return self.headers.get('Authorization') == f"Bearer {api_key}"
+
+        def _rate_limited(self) -> bool:
+            if mock.should_rate_limit():
+                self._send_json(429, {'error': 'Too Many Requests (injected by mock server)'}, {'Retry-After': '1'})
+                return True
+            return False
+
+        def do_POST(self):
+            action, job_id = self._route()
+            if not self._authorized():
+                self._send_json(401, {'error': 'Unauthorized'})
+                return
+            try:
+                payload = self._read_json()
+            except UnsupportedEncoding as e:
+                self._send_json(415, {'error': f"Unsupported Content-Encoding: {e}"})
+                return
+            except (ValueError, OSError, EOFError):
+                self._send_json(400, {'error': 'Invalid JSON body'})
+                return
+
+            if action in ('run', 'runsync'):
+                if self._rate_limited():
+                    return
+                body = mock.submit(payload)
+                if action == 'runsync':
+                    body = mock.wait_for(body['id'], mock.runsync_timeout)
+                self._send_json(200, body)
+            elif action == 'cancel' and job_id:
+                body = mock.cancel(job_id)
+                if body is None:
+                    self._send_json(404, {'error': f"Job {job_id} not found"})
+                else:
+                    self._send_json(200, body)
+            else:
+                self._send_json(404, {'error': f"Unknown route {self.path}"})
+
+        def do_GET(self):
+            action, job_id = self._route()
+            if not self._authorized():
+                self._send_json(401, {'error': 'Unauthorized'})
+                return
+
+            if action == 'health':
+                self._send_json(200, mock.health())
+            elif action in ('status', 'stream') and job_id:
+                if self._rate_limited():
+                    return
+                body = mock.status(job_id)
+                if body is None:
+                    self._send_json(404, {'error': f"Job {job_id} not found"})
+                    return
+                if action == 'stream':
+                    stream = []
+                    if body.get('status') == 'COMPLETED':
+                        stream = [{'output': {'text': body['output'][0]['choices'][0]['tokens'][0]}}]
+                    body = {'status': body['status'], 'stream': stream}
+                self._send_json(200, body)
+            else:
+                self._send_json(404, {'error': f"Unknown route {self.path}"})
+
+    return RunPodHandler
+
+
+def load_replay_file(path: str) -> List[Dict[str, Any]]:
+    """Load recorded outputs written by --record (one JSON object per line)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def start_mock_server(host: str = '127.0.0.1', port: int = 0, api_key: Optional[str] = None, **options):
+    """Start the mock server in a background thread and return (server, base_url)"""
+    mock = MockRunPod(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(mock, api_key))
+    server.daemon_threads = True
+    server.mock = mock
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v2"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the RunPod v2 serverless API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--api-key', default=None, help="Require this bearer token (default: accept any)")
+    parser.add_argument('--workers', type=int, default=4, help="Simulated worker count")
+    parser.add_argument('--queue-delay', default='fixed:0', help="Queue delay distribution in seconds")
+    parser.add_argument('--exec-time', default='uniform:1,3', help="Execution time distribution in seconds")
+    parser.add_argument('--seconds-per-1k-tokens', type=float, default=0.0,
+                        help="Extra execution seconds per 1k input tokens")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Probability a job ends FAILED")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Probability a request returns 429")
+    parser.add_argument('--canned-output', default=None, help="File whose text is returned for every job")
+    parser.add_argument('--replay', default=None, help="JSONL of recorded outputs to replay")
+    parser.add_argument('--record', default=None, help="Proxy to --upstream and append outputs to this JSONL")
+    parser.add_argument('--upstream', default=None, help="Real endpoint URL for record mode, e.g. https://api.runpod.ai/v2/<id>")
+    parser.add_argument('--upstream-api-key', default=None)
+    parser.add_argument('--runsync-timeout', type=float, default=90.0)
+    parser.add_argument('--webhook-drop-rate', type=float, default=0.0, help="Probability a completion webhook is not sent")
+    parser.add_argument('--health-latency', type=float, default=0.0, help="Seconds each /health request takes")
+    parser.add_argument('--no-gzip', action='store_true', help="Answer gzip-encoded request bodies with 415, like an endpoint without compression support")
+    args = parser.parse_args()
+
+    if args.record and not args.upstream:
+        parser.error("--record requires --upstream")
+
+    canned_output = None
+    if args.canned_output:
+        with open(args.canned_output, 'r', encoding='utf-8') as f:
+            canned_output = f.read()
+
+    server, base_url = start_mock_server(
+        host=args.host,
+        port=args.port,
+        api_key=args.api_key,
+        workers=args.workers,
+        queue_delay=args.queue_delay,
+        exec_time=args.exec_time,
+        seconds_per_1k_tokens=args.seconds_per_1k_tokens,
+        failure_rate=args.failure_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        canned_output=canned_output,
+        replay=load_replay_file(args.replay) if args.replay else None,
+        record_path=args.record,
+        upstream=args.upstream,
+        upstream_api_key=args.upstream_api_key,
+        runsync_timeout=args.runsync_timeout,
+        webhook_drop_rate=args.webhook_drop_rate,
+        health_latency=args.health_latency,
+        accept_gzip=not args.no_gzip,
+    )
+    print(f"Mock RunPod API listening on {base_url}/<endpoint_id>")
+    print(f"Run the app with: RUNPOD_BASE_URL={base_url} streamlit run streamlit_app.py")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,539 @@
+from __future__ import annotations
+
+import os
 import streamlit as st
 import requests
 import json
 import time
 import re
 import ast
-import pandas as pd
-import tiktoken
-from typing import List, Dict, Any
+import bisect
+import cProfile
+import gzip
+import hashlib
+import heapq
+import hmac
+import importlib
+import pickle
+import pstats
+import shutil
+import sys
+import sqlite3
+import tempfile
+import threading
+import types
+import uuid
+import weakref
+from collections import Counter, OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from itertools import islice
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 from io import BytesIO
+from urllib.parse import urlsplit
+
+# Heavy dependencies are imported the first time they are used, so the first page renders
+# without waiting for pandas, pyarrow or tiktoken (annotations are strings and don't count)
+class LazyModule(types.ModuleType):
+    """Stands in for a module until one of its attributes is first used, then imports it"""
 
-# Page configuration
-st.set_page_config(
-    page_title="AQA Prompt Builder",
-    page_icon="🔨",
-    layout="wide"
-)
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)  # Later lookups are plain attribute hits
+        return getattr(module, attr)
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+pa = LazyModule("pyarrow")
+pc = LazyModule("pyarrow.compute")
+ds = LazyModule("pyarrow.dataset")
+pq = LazyModule("pyarrow.parquet")
+pafs = LazyModule("pyarrow.fs")
+tiktoken = LazyModule("tiktoken")
 
 # RunPod configuration
-RUNPOD_ENDPOINT_ID = "cj0k04fo6vknjh"
-RUNPOD_API_KEY = "rpa_ARG4EDO1OIMKM70C4J04YBVR1685WN3VB46AFUSU1c54vp"
-RUNPOD_URL = f"https://api.runpod.ai/v2/{RUNPOD_ENDPOINT_ID}/run"
-HEADERS = {
-    "Authorization": f"Bearer {RUNPOD_API_KEY}",
-    "Content-Type": "application/json"
-}
+RUNPOD_ENDPOINT_ID = os.environ.get("RUNPOD_ENDPOINT_ID", "cj0k04fo6vknjh")
+RUNPOD_API_KEY = os.environ.get("RUNPOD_API_KEY", "rpa_ARG4EDO1OIMKM70C4J04YBVR1685WN3VB46AFUSU1c54vp")
+# Set RUNPOD_BASE_URL=http://localhost:8000/v2 to use mock_runpod_server.py instead
+RUNPOD_BASE_URL = os.environ.get("RUNPOD_BASE_URL", "https://api.runpod.ai/v2").rstrip("/")
+# sampling_params key the worker reads a JSON schema from for guided decoding
+GUIDED_JSON_PARAM = os.environ.get("RUNPOD_GUIDED_JSON_PARAM", "guided_json")
+
+# Endpoint pool for spreading large runs across several RunPod endpoints, e.g.
+# RUNPOD_ENDPOINTS='[{"id": "abc123", "weight": 2, "max_concurrency": 40}, {"id": "def456"}]'
+# Each entry may also set "base_url" and "api_key"; without it the single endpoint above is used.
+ENDPOINT_HEALTH_TTL = 5.0  # Seconds between /health refreshes used for routing
+FINISHED_STATUSES = ('COMPLETED', 'FAILED', 'CANCELLED', 'TIMED_OUT')
+
+def load_endpoint_config() -> List[Dict[str, Any]]:
+    """Read the endpoint pool from RUNPOD_ENDPOINTS, falling back to RUNPOD_ENDPOINT_ID"""
+    raw = os.environ.get("RUNPOD_ENDPOINTS", "").strip()
+    entries = json.loads(raw) if raw else [{"id": RUNPOD_ENDPOINT_ID}]
+    endpoints = []
+    for entry in entries:
+        endpoints.append({
+            'id': entry['id'],
+            'weight': float(entry.get('weight', 1)),
+            'max_concurrency': int(entry['max_concurrency']) if entry.get('max_concurrency') else None,
+            'base_url': entry.get('base_url', RUNPOD_BASE_URL).rstrip("/"),
+            'api_key': entry.get('api_key', RUNPOD_API_KEY)
+        })
+    return endpoints
+
+RUNPOD_ENDPOINTS = load_endpoint_config()
+
+# Process-wide shared resources
+# Streamlit runs this script in a fresh module namespace on every rerun of every session, so a
+# plain module global lasts one rerun. State that all sessions and the background threads share
+# (HTTP connections, the tokenizer, routing, metrics, caches) is built once per server process by
+# an st.cache_resource factory and rebound to its module name on each rerun. Values that get
+# reassigned live in a dict so every rerun sees the change.
+HTTP_POOL_SIZE = int(os.environ.get("AQA_HTTP_POOL_SIZE", "32"))  # Connections kept per RunPod host, shared by all sessions
+
+@st.cache_resource(show_spinner=False)
+def runpod_client() -> requests.Session:
+    """The one HTTP session for RunPod requests; callers wait for a free connection when the pool is busy"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max(4, len(RUNPOD_ENDPOINTS)), pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+@st.cache_resource(show_spinner=False)
+def token_encoder():
+    """The gpt-4 tiktoken encoder, or None when it can't be loaded (e.g. offline), so the download isn't retried per call"""
+    try:
+        return tiktoken.encoding_for_model("gpt-4")
+    except Exception:
+        return None
+
+# Routing state: local in-flight counts, last /health snapshot, and job ownership
+FINISHED_JOB_ROUTES_LIMIT = 100000  # Finished jobs whose endpoint is remembered for later status checks
+
+@st.cache_resource(show_spinner=False)
+def _endpoint_registry():
+    state = {
+        endpoint['id']: {'in_flight': 0, 'queue_depth': 0, 'submitted_since_refresh': 0, 'finished_since_refresh': 0, 'checked_at': 0.0, 'health': None, 'error': None, 'refreshing': False}
+        for endpoint in RUNPOD_ENDPOINTS
+    }
+    return threading.Lock(), state, {}, OrderedDict()
+
+_endpoint_lock, _endpoint_state, _job_endpoints, _finished_job_endpoints = _endpoint_registry()
+_endpoint_state: Dict[str, Dict[str, Any]]
+_job_endpoints: Dict[str, str]  # job ID -> owning endpoint ID while the job is in flight
+_finished_job_endpoints: OrderedDict  # the same for the most recently finished jobs, oldest first
+
+def get_endpoint(endpoint_id: str) -> Dict[str, Any]:
+    """Look up a configured endpoint by ID (first endpoint if unknown)"""
+    for endpoint in RUNPOD_ENDPOINTS:
+        if endpoint['id'] == endpoint_id:
+            return endpoint
+    return RUNPOD_ENDPOINTS[0]
+
+def endpoint_url(endpoint: Dict[str, Any], action: str) -> str:
+    """Build an API URL such as .../v2/{endpoint_id}/run"""
+    return f"{endpoint['base_url']}/{endpoint['id']}/{action}"
+
+def endpoint_headers(endpoint: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {endpoint['api_key']}",
+        "Content-Type": "application/json"
+    }
+
+def refresh_endpoint_health(endpoint: Dict[str, Any], force: bool = False) -> Dict[str, Any]:
+    """Fetch /health for an endpoint (cached for ENDPOINT_HEALTH_TTL) and return its routing state"""
+    state = _endpoint_state[endpoint['id']]
+    if not force and time.time() - state['checked_at'] < ENDPOINT_HEALTH_TTL:
+        return state
+
+    try:
+        response = runpod_client().get(endpoint_url(endpoint, 'health'), headers=endpoint_headers(endpoint), timeout=10)
+        response.raise_for_status()
+        health = response.json()
+        jobs = health.get('jobs', {}) if isinstance(health, dict) else {}
+        queue_depth = (jobs.get('inQueue') or 0) + (jobs.get('inProgress') or 0)
+        with _endpoint_lock:
+            state.update(health=health, error=None, queue_depth=queue_depth, submitted_since_refresh=0, finished_since_refresh=0, checked_at=time.time())
+            # Jobs we never polled to completion would otherwise hold the concurrency cap forever
+            state['in_flight'] = min(state['in_flight'], queue_depth)
+    except Exception as e:
+        with _endpoint_lock:
+            state.update(health=None, error=str(e), checked_at=time.time())
+    return state
+
+def refresh_endpoint_health_async(endpoint: Dict[str, Any]) -> Dict[str, Any]:
+    """Start a background /health refresh if the snapshot is stale and return a copy of the current one
+
+    Lets the page render without waiting on RunPod; checked_at stays 0 until the first response arrives.
+    """
+    state = _endpoint_state[endpoint['id']]
+    with _endpoint_lock:
+        snapshot = dict(state)
+        if state['refreshing'] or time.time() - state['checked_at'] < ENDPOINT_HEALTH_TTL:
+            return snapshot
+        state['refreshing'] = True
+
+    def refresh():
+        try:
+            refresh_endpoint_health(endpoint, force=True)
+        finally:
+            with _endpoint_lock:
+                state['refreshing'] = False
+
+    threading.Thread(target=refresh, name=f"health-{endpoint['id']}", daemon=True).start()
+    return snapshot
+
+def select_endpoint() -> Dict[str, Any]:
+    """Pick the endpoint for a new job by live queue depth relative to weight
+
+    Endpoints below their max_concurrency are preferred; if every endpoint is at
+    its cap the one with the lowest relative load still takes the job.
+    """
+    if len(RUNPOD_ENDPOINTS) == 1:
+        return RUNPOD_ENDPOINTS[0]
+
+    for endpoint in RUNPOD_ENDPOINTS:
+        refresh_endpoint_health(endpoint)
+
+    with _endpoint_lock:
+        def load(endpoint):
+            state = _endpoint_state[endpoint['id']]
+            return (state['queue_depth'] + state['submitted_since_refresh']) / max(endpoint['weight'], 0.01)
+
+        def has_capacity(endpoint):
+            cap = endpoint['max_concurrency']
+            return cap is None or _endpoint_state[endpoint['id']]['in_flight'] < cap
+
+        reachable = [e for e in RUNPOD_ENDPOINTS if _endpoint_state[e['id']]['error'] is None] or RUNPOD_ENDPOINTS
+        candidates = [e for e in reachable if has_capacity(e)] or reachable
+        return min(candidates, key=load)
+
+def register_job_endpoint(job_id: str, endpoint: Dict[str, Any]):
+    """Remember which endpoint owns a job and count it as in flight"""
+    with _endpoint_lock:
+        _job_endpoints[job_id] = endpoint['id']
+        state = _endpoint_state[endpoint['id']]
+        state['in_flight'] += 1
+        state['submitted_since_refresh'] += 1
+
+def job_endpoint(job_id: str, endpoint_id: str = None) -> Dict[str, Any]:
+    """Endpoint that owns a job"""
+    return get_endpoint(endpoint_id or job_endpoint_id(job_id))
+
+def job_endpoint_id(job_id: str) -> str:
+    """ID of the endpoint a job was submitted to, also after it has finished (first endpoint if unknown)"""
+    with _endpoint_lock:
+        return _job_endpoints.get(job_id) or _finished_job_endpoints.get(job_id) or RUNPOD_ENDPOINTS[0]['id']
+
+def mark_job_finished(job_id: str):
+    """Release a job's slot on its endpoint once it reaches a terminal state"""
+    # COMPLETED jobs were timed by record_job_completion already; drop the rest unrecorded
+    with _metrics_lock:
+        _job_submit_times.pop(job_id, None)
+    with _endpoint_lock:
+        endpoint_id = _job_endpoints.pop(job_id, None)
+        if endpoint_id is not None:
+            state = _endpoint_state[endpoint_id]
+            state['in_flight'] = max(0, state['in_flight'] - 1)
+            state['finished_since_refresh'] += 1
+            # Status checks that pass no endpoint_id (Test Prompt, Batch, chunk and reduce jobs) still need the owner
+            _finished_job_endpoints[job_id] = endpoint_id
+            while len(_finished_job_endpoints) > FINISHED_JOB_ROUTES_LIMIT:
+                _finished_job_endpoints.popitem(last=False)
+
+# Metrics configuration
+# AQA_METRICS_FILE ending in .jsonl appends snapshots; any other path is rewritten in OpenMetrics text format
+METRICS_FILE = os.environ.get("AQA_METRICS_FILE", "")
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+METRICS_SAMPLE_LIMIT = 2048  # Recent samples kept per stage for percentile display
+
+# Process-wide metrics registry, shared by all sessions
+@st.cache_resource(show_spinner=False)
+def _metrics_registry():
+    return threading.Lock(), {}, {}, {}, {'changed': 0, 'written': 0}
+
+_metrics_lock, _histograms, _counters, _job_submit_times, _metrics_versions = _metrics_registry()
+_histograms: Dict[str, Dict[str, Any]]
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]
+_job_submit_times: Dict[str, float]
+
+def observe_stage(stage: str, seconds: float):
+    """Record one duration sample for a pipeline stage"""
+    with _metrics_lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = {
+                'buckets': [0] * (len(METRICS_BUCKETS) + 1),
+                'count': 0,
+                'sum': 0.0,
+                'samples': deque(maxlen=METRICS_SAMPLE_LIMIT)
+            }
+            _histograms[stage] = hist
+        hist['buckets'][bisect.bisect_left(METRICS_BUCKETS, seconds)] += 1
+        hist['count'] += 1
+        hist['sum'] += seconds
+        hist['samples'].append(seconds)
+        _metrics_versions['changed'] += 1
+
+def increment_counter(name: str, amount: float = 1, **labels):
+    """Increment a counter, optionally split by labels"""
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+        _metrics_versions['changed'] += 1
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time the wrapped block and record it under the given stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def record_job_submitted(job_id: str):
+    """Remember when a job was submitted so polling lag can be measured"""
+    increment_counter('jobs_submitted')
+    with _metrics_lock:
+        _job_submit_times[job_id] = time.time()
+
+def record_job_completion(job_id: str, status: Dict[str, Any]):
+    """Record queue, execution and polling-lag time the first time a job is seen finished"""
+    with _metrics_lock:
+        submitted_at = _job_submit_times.pop(job_id, None)
+    if submitted_at is None:
+        return  # Unknown to this process or already recorded
+
+    delay_s = (status.get('delayTime') or 0) / 1000
+    execution_s = (status.get('executionTime') or 0) / 1000
+    if status.get('delayTime') is not None:
+        observe_stage('queue', delay_s)
+    if status.get('executionTime') is not None:
+        observe_stage('execution', execution_s)
+    observe_stage('polling_lag', max(0.0, time.time() - submitted_at - delay_s - execution_s))
+    record_cost_sample(status)
+
+def metrics_snapshot() -> Dict[str, Any]:
+    """Summarize histograms and counters for display and JSONL export"""
+    with _metrics_lock:
+        stages = {}
+        for stage, hist in _histograms.items():
+            samples = sorted(hist['samples'])
+            def pct(p):
+                return samples[min(len(samples) - 1, int(p / 100 * len(samples)))] if samples else 0.0
+            stages[stage] = {
+                'count': hist['count'],
+                'sum_s': hist['sum'],
+                'mean_s': hist['sum'] / hist['count'] if hist['count'] else 0.0,
+                'p50_s': pct(50),
+                'p95_s': pct(95),
+                'p99_s': pct(99),
+                'max_s': samples[-1] if samples else 0.0
+            }
+        counters = [
+            {'name': name, 'labels': dict(labels), 'value': value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+    return {'timestamp': time.time(), 'stages': stages, 'counters': counters}
+
+def render_openmetrics() -> str:
+    """Render all metrics in Prometheus/OpenMetrics text exposition format"""
+    lines = [
+        "# HELP aqa_stage_duration_seconds Time spent in each pipeline stage.",
+        "# TYPE aqa_stage_duration_seconds histogram"
+    ]
+    with _metrics_lock:
+        for stage, hist in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(METRICS_BUCKETS, hist['buckets']):
+                cumulative += bucket_count
+                lines.append(f'aqa_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'aqa_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist["count"]}')
+            lines.append(f'aqa_stage_duration_seconds_sum{{stage="{stage}"}} {hist["sum"]}')
+            lines.append(f'aqa_stage_duration_seconds_count{{stage="{stage}"}} {hist["count"]}')
+
+        for name in sorted({name for name, _ in _counters}):
+            lines.append(f"# TYPE aqa_{name} counter")
+            for (counter_name, labels), value in sorted(_counters.items()):
+                if counter_name != name:
+                    continue
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"aqa_{name}_total{{{label_text}}} {value}" if label_text else f"aqa_{name}_total {value}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+def write_metrics_file(path: str = None, force: bool = False) -> bool:
+    """Write metrics to the configured file if anything changed since the last write"""
+    path = path or METRICS_FILE
+    if not path or (not force and _metrics_versions['changed'] == _metrics_versions['written']):
+        return False
+
+    version = _metrics_versions['changed']
+    if path.endswith('.jsonl'):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(metrics_snapshot()) + "\n")
+    else:
+        # Write to a temp file and swap so scrapers never read a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(render_openmetrics())
+        os.replace(tmp_path, path)
+    _metrics_versions['written'] = version
+    return True
+
+# Rerun profiling: opt in with AQA_PROFILE=1 or the sidebar toggle
+PROFILE_RERUNS = os.environ.get("AQA_PROFILE", "").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.environ.get("AQA_PROFILE_DIR", "profiles")
+PROFILE_HISTORY_LIMIT = 20  # Recent reruns kept in the session for the Diagnostics tab
+PROFILE_KEEP_FILES = 200  # Oldest .prof files beyond this are deleted
+PROFILE_TOP_FUNCTIONS = 30
+
+@st.cache_resource(show_spinner=False)
+def _profiler_lock_resource() -> threading.Lock:
+    return threading.Lock()
+
+# From Python 3.12 cProfile hooks sys.monitoring, which allows one profiler per process, so
+# sessions take turns; a section that finds the profiler busy runs unprofiled
+_profiler_lock = _profiler_lock_resource()
+
+def start_rerun_profile() -> Dict[str, Any]:
+    return {'started_at': time.time(), 'start': time.perf_counter(), 'sections': []}
+
+@contextmanager
+def profile_section(profile: Optional[Dict[str, Any]], name: str):
+    """cProfile the wrapped block as one section of a rerun (no-op when profile is None)
+
+    Sections run one after another, never nested. Only one profiler may be active in the
+    process, so while another session is profiling the block runs unprofiled and its time
+    shows up as (unprofiled).
+    """
+    if profile is None:
+        yield
+        return
+    if not _profiler_lock.acquire(blocking=False):
+        increment_counter('profile_sections_skipped', section=name)
+        yield
+        return
+    try:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Another profiling tool (a debugger, an outer cProfile) holds sys.monitoring
+            profiler = None
+            increment_counter('profile_sections_skipped', section=name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profile['sections'].append({'name': name, 'seconds': time.perf_counter() - start, 'profiler': profiler})
+    finally:
+        _profiler_lock.release()
+
+def finish_rerun_profile(profile: Optional[Dict[str, Any]]):
+    """Keep a finished rerun in the session for the Diagnostics tab and write its combined stats to PROFILE_DIR"""
+    if profile is None or not profile['sections']:
+        return
+    total = time.perf_counter() - profile['start']
+    record = {
+        'started_at': profile['started_at'],
+        'total_s': total,
+        'sections': {section['name']: section['seconds'] for section in profile['sections']},
+        'profilers': {section['name']: section['profiler'] for section in profile['sections']},
+        'path': None
+    }
+    record['sections']['(unprofiled)'] = max(0.0, total - sum(record['sections'].values()))
+    if PROFILE_DIR:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(profile['started_at']))
+            path = os.path.join(PROFILE_DIR, f"rerun-{stamp}-{uuid.uuid4().hex[:6]}.prof")
+            rerun_stats(record).dump_stats(path)
+            with open(os.path.join(PROFILE_DIR, "sections.jsonl"), 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'file': os.path.basename(path), 'started_at': record['started_at'],
+                                    'total_s': total, 'sections': record['sections']}) + "\n")
+            record['path'] = path
+            prune_profile_files()
+        except OSError:
+            increment_counter('profile_write_errors')
+    if 'rerun_profiles' not in st.session_state:
+        st.session_state.rerun_profiles = deque(maxlen=PROFILE_HISTORY_LIMIT)
+    st.session_state.rerun_profiles.append(record)
+    observe_stage('rerun', total)
+
+def prune_profile_files():
+    files = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.prof'))
+    for name in files[:max(0, len(files) - PROFILE_KEEP_FILES)]:
+        os.remove(os.path.join(PROFILE_DIR, name))
+
+def rerun_stats(record: Dict[str, Any], section: str = None) -> pstats.Stats:
+    """pstats for one section of a profiled rerun, or all sections combined"""
+    profilers = [record['profilers'][section]] if section else list(record['profilers'].values())
+    stats = pstats.Stats(profilers[0])
+    for profiler in profilers[1:]:
+        stats.add(profiler)
+    return stats
+
+def profile_hot_spots(stats: pstats.Stats, sort_by: str = 'cumulative_s', limit: int = PROFILE_TOP_FUNCTIONS) -> pd.DataFrame:
+    """Top functions of a profile as a table"""
+    rows = [
+        {
+            'function': f"{func} ({os.path.basename(filename)}:{line})" if line else func,
+            'calls': calls,
+            'own_s': round(own, 4),
+            'cumulative_s': round(cumulative, 4)
+        }
+        for (filename, line, func), (_, calls, own, cumulative, _) in stats.stats.items()
+    ]
+    return pd.DataFrame(rows).sort_values(sort_by, ascending=False).head(limit).reset_index(drop=True)
+
+def recent_profiles() -> List[Dict[str, Any]]:
+    return list(st.session_state.get('rerun_profiles', []))
+
+def render_profiles_panel():
+    """Per-section wall time of recent reruns and the hot spots of a selected one"""
+    st.subheader("🔬 Rerun Profiles")
+    profiles = recent_profiles()
+    if not profiles:
+        st.info("Profiling is off. Turn on **Profile reruns** in the sidebar or set AQA_PROFILE=1; "
+                "each rerun after that is profiled section by section.")
+        return
+
+    timings = pd.DataFrame([
+        {'rerun': time.strftime('%H:%M:%S', time.localtime(record['started_at'])), 'total_s': record['total_s'], **record['sections']}
+        for record in reversed(profiles)
+    ]).round(3)
+    st.dataframe(timings, use_container_width=True)
+
+    col1, col2, col3 = st.columns(3)
+    choice = col1.selectbox("Rerun", range(len(profiles)), format_func=lambda i: timings['rerun'][i], key="profile_rerun")
+    record = profiles[len(profiles) - 1 - choice]
+    section = col2.selectbox("Section", ["All sections"] + list(record['profilers']), key="profile_section")
+    sort_by = col3.selectbox("Sort by", ['cumulative_s', 'own_s', 'calls'], key="profile_sort")
+    stats = rerun_stats(record, None if section == "All sections" else section)
+    st.dataframe(profile_hot_spots(stats, sort_by), use_container_width=True)
+    if record['path']:
+        st.caption(f"Saved to `{record['path']}` (open with `python -m pstats` or snakeviz)")
+
+def reset_metrics():
+    """Clear all collected metrics"""
+    with _metrics_lock:
+        _histograms.clear()
+        _counters.clear()
+        _job_submit_times.clear()
+        _metrics_versions['changed'] += 1
 
 # Token counting function
 def count_tokens(text: str) -> int:
     """Count tokens in text using tiktoken"""
     try:
-        encoder = tiktoken.encoding_for_model("gpt-4")
+        encoder = token_encoder()
+        if encoder is None:
+            raise RuntimeError("tiktoken gpt-4 encoding unavailable")
         tokens = encoder.encode(text)
         return len(tokens)
     except Exception as e:
@@ -58,6 +562,393 @@ Generate a structured prompt that includes:
 The generated prompt should be ready for use with the RunPod inference API.
 """
 
+# Completion webhooks: RunPod POSTs each job's final status here; polling remains the fallback
+WEBHOOK_HOST = os.environ.get("AQA_WEBHOOK_HOST", "127.0.0.1")  # Put a reverse proxy in front, or bind 0.0.0.0, for RunPod to reach it
+WEBHOOK_PORT = int(os.environ.get("AQA_WEBHOOK_PORT", "8787"))
+# Address RunPod can reach the receiver at, e.g. https://qa-tools.example.com:8787 (default http://127.0.0.1:<port>, for the mock server)
+WEBHOOK_PUBLIC_URL = os.environ.get("AQA_WEBHOOK_PUBLIC_URL", "")
+# Shared secret in the callback path, so only RunPod (which is given the URL) can post results. Required
+# once the receiver is reachable from other hosts; a local receiver for the mock server makes up its own.
+WEBHOOK_SECRET = os.environ.get("AQA_WEBHOOK_SECRET", "")
+WEBHOOK_SECRET_MIN_LENGTH = 16
+# The receiver serves every session, so it is switched on for the whole server rather than per session
+WEBHOOKS_ENABLED = os.environ.get("AQA_WEBHOOKS", "").lower() in ("1", "true", "yes") or bool(WEBHOOK_PUBLIC_URL)
+WEBHOOK_FALLBACK_POLL_INTERVAL = 30.0  # Seconds between fallback polls of a job still waiting for its webhook
+WEBHOOK_EARLY_TTL = 60.0  # Seconds a callback for a not yet registered job is kept for its /run response to catch up
+WEBHOOK_EARLY_LIMIT = 10000
+
+@st.cache_resource(show_spinner=False)
+def _webhook_registry():
+    return threading.Lock(), {'server': None, 'url': None}, {}, {}, OrderedDict()
+
+_webhook_lock, _webhook_receiver, _webhook_statuses, _webhook_jobs, _webhook_early = _webhook_registry()
+_webhook_receiver: Dict[str, Any]  # 'server' and 'url' are set while the receiver runs; post_job adds the URL to every payload
+_webhook_statuses: Dict[str, Dict[str, Any]]  # job ID -> final status delivered by webhook, until read
+_webhook_jobs: Dict[str, float]  # job ID -> last submit/poll time, for jobs still waiting for their webhook
+_webhook_early: OrderedDict  # job ID -> (arrival time, final status) for callbacks that beat post_job's registration, oldest first
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Accepts RunPod completion callbacks at /runpod-webhook/<token>"""
+
+    def do_POST(self):
+        webhook_url = _webhook_receiver['url']
+        if webhook_url is None or not hmac.compare_digest(urlsplit(webhook_url).path, self.path):
+            self.send_response(404)
+            self.end_headers()
+            return
+        try:
+            status = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            self.send_response(400)
+            self.end_headers()
+            return
+        ingest_webhook_status(status)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def ingest_webhook_status(status: Dict[str, Any]) -> bool:
+    """Store a final status delivered by webhook so the next check_job_status needs no request
+
+    A fast job's callback can arrive before post_job has registered the job; it is held for
+    WEBHOOK_EARLY_TTL seconds and picked up by expect_webhook. Returns True if the status was stored.
+    """
+    job_id = status.get('id')
+    if not job_id or status.get('status') not in FINISHED_STATUSES:
+        return False
+    with _webhook_lock:
+        if job_id not in _webhook_jobs:
+            # Either early or for a job already resolved by a fallback poll; the latter simply expires
+            now = time.time()
+            _webhook_early[job_id] = (now, status)
+            while _webhook_early and (len(_webhook_early) > WEBHOOK_EARLY_LIMIT
+                                      or now - next(iter(_webhook_early.values()))[0] > WEBHOOK_EARLY_TTL):
+                _webhook_early.popitem(last=False)
+            return False
+        del _webhook_jobs[job_id]
+        _webhook_statuses[job_id] = status
+    finish_webhook_job(job_id, status)
+    return True
+
+def expect_webhook(job_id: str):
+    """Wait for a submitted job's callback, taking it at once if it arrived before the /run response"""
+    with _webhook_lock:
+        early = _webhook_early.pop(job_id, None)
+        if early is None or time.time() - early[0] > WEBHOOK_EARLY_TTL:
+            _webhook_jobs[job_id] = time.time()
+            return
+        _webhook_statuses[job_id] = early[1]
+    finish_webhook_job(job_id, early[1])
+
+def finish_webhook_job(job_id: str, status: Dict[str, Any]):
+    increment_counter('webhooks_received', status=status['status'])
+    if status['status'] == 'COMPLETED':
+        record_job_completion(job_id, status)
+    mark_job_finished(job_id)
+
+def webhook_secret(public_url: str = None) -> str:
+    """AQA_WEBHOOK_SECRET, or a random one for a receiver only this host can reach"""
+    if WEBHOOK_SECRET:
+        if len(WEBHOOK_SECRET) < WEBHOOK_SECRET_MIN_LENGTH:
+            raise ValueError(f"AQA_WEBHOOK_SECRET must be at least {WEBHOOK_SECRET_MIN_LENGTH} characters")
+        return WEBHOOK_SECRET
+    if public_url or WEBHOOK_HOST not in ('127.0.0.1', 'localhost', '::1'):
+        raise ValueError("Set AQA_WEBHOOK_SECRET to a long random string before exposing the webhook receiver")
+    return uuid.uuid4().hex
+
+def start_webhook_receiver(port: int = None, public_url: str = None) -> str:
+    """Start the process-wide receiver (once) and return the webhook URL sent with each job"""
+    with _webhook_lock:
+        if _webhook_receiver['server'] is None:
+            public_url = public_url or WEBHOOK_PUBLIC_URL
+            secret = webhook_secret(public_url)
+            server = ThreadingHTTPServer((WEBHOOK_HOST, WEBHOOK_PORT if port is None else port), WebhookHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="webhook-receiver", daemon=True).start()
+            base = (public_url or f"http://127.0.0.1:{server.server_address[1]}").rstrip('/')
+            _webhook_receiver.update(server=server, url=f"{base}/runpod-webhook/{secret}")
+        return _webhook_receiver['url']
+
+def stop_webhook_receiver():
+    """Stop the receiver; jobs still waiting for a webhook fall back to polling
+
+    For scripts and server shutdown only: the receiver is shared, and without AQA_WEBHOOK_SECRET a
+    new one gets a new path, so callbacks for jobs submitted before the restart would be refused.
+    """
+    with _webhook_lock:
+        server = _webhook_receiver['server']
+        _webhook_receiver.update(server=None, url=None)
+        _webhook_jobs.clear()
+        _webhook_early.clear()
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+def take_webhook_status(job_id: str) -> Optional[Dict[str, Any]]:
+    with _webhook_lock:
+        return _webhook_statuses.pop(job_id, None)
+
+def awaiting_webhook(job_id: str) -> bool:
+    """True if a job's webhook is still expected; lets one fallback poll through per interval"""
+    with _webhook_lock:
+        last = _webhook_jobs.get(job_id)
+        if last is None:
+            return False
+        if time.time() - last < WEBHOOK_FALLBACK_POLL_INTERVAL:
+            return True
+        _webhook_jobs[job_id] = time.time()
+        return False
+
+# Priority scheduling: interactive jobs go straight to RunPod, bulk jobs wait in a local queue
+# until the endpoint has room for them outside the share reserved for interactive work.
+# The queue and the endpoints are shared by every session, so this is a server setting.
+PRIORITY_SCHEDULING = os.environ.get("AQA_PRIORITY_SCHEDULING", "").lower() in ("1", "true", "yes")
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BULK = 'bulk'
+HELD_JOB_PREFIX = 'held-'
+DEFAULT_RESERVED_SHARE = 0.25  # Share of endpoint concurrency kept free for interactive jobs
+RESERVED_SHARE = float(os.environ.get("AQA_RESERVED_SHARE", str(DEFAULT_RESERVED_SHARE)))
+RESOLVED_TICKET_LIMIT = 10000  # Finished held-job tickets still resolvable to their RunPod job ID
+SCHEDULER_DEFAULT_CAPACITY = 8  # Concurrency assumed when neither max_concurrency nor /health workers are known
+SCHEDULER_HEALTH_INTERVAL = 1.0  # Seconds between /health refreshes while bulk jobs are held
+SCHEDULER_TICK = 0.25
+
+@st.cache_resource(show_spinner=False)
+def _scheduler_registry():
+    return threading.Lock(), {'enabled': PRIORITY_SCHEDULING, 'reserved_share': RESERVED_SHARE}, deque(), {}, OrderedDict(), {'thread': None}
+
+_scheduler_lock, _scheduler_config, _scheduler_queue, _scheduler_tickets, _resolved_tickets, _scheduler_worker = _scheduler_registry()
+_scheduler_queue: deque  # (ticket, payload, description) in submission order
+_scheduler_tickets: Dict[str, Dict[str, Any]]  # ticket -> job_id/endpoint_id once dispatched, or error, until its job finishes
+_resolved_tickets: OrderedDict  # the most recent finished tickets, oldest first
+_scheduler_worker: Dict[str, Optional[threading.Thread]]  # the dispatcher thread while held jobs remain
+
+def configure_scheduler(enabled: bool, reserved_share: float = DEFAULT_RESERVED_SHARE):
+    """Turn priority scheduling on or off for the whole server (scripts and benchmarks; the app uses
+    AQA_PRIORITY_SCHEDULING); held jobs are released at once when it is turned off"""
+    with _scheduler_lock:
+        _scheduler_config.update(enabled=enabled, reserved_share=reserved_share)
+
+def endpoint_capacity(endpoint: Dict[str, Any], state: Dict[str, Any]) -> int:
+    """Concurrent jobs an endpoint can run: its max_concurrency, else its workers from /health"""
+    if endpoint['max_concurrency']:
+        return endpoint['max_concurrency']
+    workers = (state['health'] or {}).get('workers') or {}
+    return (workers.get('running') or 0) + (workers.get('idle') or 0) or SCHEDULER_DEFAULT_CAPACITY
+
+def bulk_headroom(endpoint: Dict[str, Any]) -> int:
+    """How many held bulk jobs the endpoint can take without eating into the interactive reserve
+
+    Outstanding work (queued plus running from /health, adjusted by jobs submitted and seen
+    finishing since) counts interactive jobs too, so bulk backs off while interactive traffic is busy.
+    """
+    state = _endpoint_state[endpoint['id']]
+    refresh_endpoint_health(endpoint, force=time.time() - state['checked_at'] >= SCHEDULER_HEALTH_INTERVAL)
+    with _endpoint_lock:
+        if state['error'] is None:
+            outstanding = max(0, state['queue_depth'] + state['submitted_since_refresh'] - state['finished_since_refresh'])
+        else:
+            outstanding = state['in_flight']
+        limit = max(1, int(endpoint_capacity(endpoint, state) * (1 - _scheduler_config['reserved_share'])))
+    return limit - outstanding
+
+def schedule_bulk_job(payload: Dict[str, Any], description: str) -> str:
+    """Queue a bulk job locally and return its ticket"""
+    ticket = f"{HELD_JOB_PREFIX}{uuid.uuid4().hex}"
+    with _scheduler_lock:
+        _scheduler_tickets[ticket] = {'job_id': None, 'endpoint_id': None, 'error': None, 'queued_at': time.time()}
+        _scheduler_queue.append((ticket, payload, description))
+        if _scheduler_worker['thread'] is None:
+            _scheduler_worker['thread'] = threading.Thread(target=_scheduler_loop, name="bulk-scheduler", daemon=True)
+            _scheduler_worker['thread'].start()
+    increment_counter('jobs_held')
+    return ticket
+
+def _scheduler_loop():
+    """Dispatch held bulk jobs as endpoints gain headroom; exits once the queue is empty"""
+    while True:
+        with _scheduler_lock:
+            if not _scheduler_queue:
+                _scheduler_worker['thread'] = None
+                return
+            enabled = _scheduler_config['enabled']
+            held = len(_scheduler_queue)
+        if enabled:
+            releases = [(endpoint, bulk_headroom(endpoint)) for endpoint in RUNPOD_ENDPOINTS]
+        else:
+            # Scheduling was turned off: release everything, routed like any other job
+            releases = [(None, held)]
+        dispatched = 0
+        for target, headroom in releases:
+            for _ in range(max(0, headroom)):
+                with _scheduler_lock:
+                    if not _scheduler_queue:
+                        break
+                    ticket, payload, description = _scheduler_queue.popleft()
+                endpoint = target or select_endpoint()
+                errors = []
+                with collect_submit_errors(errors):
+                    job_id = post_job_to_endpoint(endpoint, payload, description)
+                with _scheduler_lock:
+                    info = _scheduler_tickets[ticket]
+                    info.update(job_id=job_id, endpoint_id=endpoint['id'],
+                                error=None if job_id else (errors[-1] if errors else f"Failed to submit {description}"))
+                observe_stage('scheduler_hold', time.time() - info['queued_at'])
+                increment_counter('jobs_dispatched' if job_id else 'submit_errors', **({} if job_id else {'status_code': 'held'}))
+                dispatched += 1
+        if not dispatched:
+            time.sleep(SCHEDULER_TICK)
+
+def held_job_count() -> int:
+    with _scheduler_lock:
+        return len(_scheduler_queue)
+
+def scheduled_job(ticket: str) -> Optional[Dict[str, Any]]:
+    """Dispatch state of a held-job ticket (None for ordinary job IDs)"""
+    if not ticket.startswith(HELD_JOB_PREFIX):
+        return None
+    with _scheduler_lock:
+        info = _scheduler_tickets.get(ticket) or _resolved_tickets.get(ticket)
+        return dict(info or {'job_id': None, 'endpoint_id': None, 'error': 'Unknown held job'})
+
+def retire_ticket(ticket: str):
+    """Drop a held-job ticket whose job has finished, keeping its resolution in a bounded map for later lookups"""
+    with _scheduler_lock:
+        info = _scheduler_tickets.pop(ticket, None)
+        if info is not None:
+            _resolved_tickets[ticket] = info
+            while len(_resolved_tickets) > RESOLVED_TICKET_LIMIT:
+                _resolved_tickets.popitem(last=False)
+
+def release_held_job(ticket: str) -> bool:
+    """Drop a job that is still waiting in the local queue; False if it was already dispatched"""
+    with _scheduler_lock:
+        for position, entry in enumerate(_scheduler_queue):
+            if entry[0] == ticket:
+                del _scheduler_queue[position]
+                _scheduler_tickets[ticket]['error'] = 'CANCELLED'
+                return True
+    return False
+
+# Request transport
+# /run bodies are compact UTF-8 JSON. With compression on, bodies of COMPRESSION_MIN_BYTES or more are
+# gzipped and sent with Content-Encoding: gzip, which folds the prompt text and schema repeated for every
+# question down to a fraction. Compression is a server setting (AQA_COMPRESS_REQUESTS). An endpoint that
+# answers 415, or a 400 that the same body sent uncompressed doesn't get, is sent plain bodies from then on.
+COMPRESS_REQUESTS = os.environ.get("AQA_COMPRESS_REQUESTS", "").lower() in ("1", "true", "yes")
+COMPRESSION_LEVEL = int(os.environ.get("AQA_COMPRESSION_LEVEL", "6"))
+COMPRESSION_MIN_BYTES = 1024  # Below this the gzip header and CPU cost more than they save
+
+@st.cache_resource(show_spinner=False)
+def _transport_registry():
+    return threading.Lock(), {'compress': COMPRESS_REQUESTS}, set()
+
+_transport_lock, _transport_config, _compression_rejected = _transport_registry()
+_compression_rejected: set  # Endpoint IDs that rejected compressed bodies
+
+def configure_transport(compress: bool):
+    """Turn request-body compression on or off for the whole process (for scripts such as benchmark.py; the app uses AQA_COMPRESS_REQUESTS)"""
+    with _transport_lock:
+        _transport_config['compress'] = compress
+
+def encode_payload(payload: Dict[str, Any], compress: bool = False) -> Tuple[bytes, Dict[str, str], int]:
+    """Serialize a payload to compact JSON, gzipped when asked and large enough
+
+    Returns the body, the headers it needs beyond endpoint_headers and the size of the uncompressed JSON.
+    """
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if not compress or len(body) < COMPRESSION_MIN_BYTES:
+        return body, {}, len(body)
+    return gzip.compress(body, compresslevel=COMPRESSION_LEVEL, mtime=0), {"Content-Encoding": "gzip"}, len(body)
+
+def transport_totals() -> Dict[str, float]:
+    """Request body bytes sent so far and what the same bodies would be as uncompressed JSON"""
+    with _metrics_lock:
+        return {name: _counters.get((name, ()), 0) for name in ('request_bytes_json', 'request_bytes_sent')}
+
+def send_job_payload(endpoint: Dict[str, Any], payload: Dict[str, Any]) -> requests.Response:
+    """POST a payload to an endpoint's /run, compressed per the transport settings"""
+    with _transport_lock:
+        compress = _transport_config['compress'] and endpoint['id'] not in _compression_rejected
+    body, extra_headers, json_size = encode_payload(payload, compress)
+    response = runpod_client().post(endpoint_url(endpoint, 'run'), headers={**endpoint_headers(endpoint), **extra_headers}, data=body)
+    if extra_headers and response.status_code in (400, 415):
+        # 415 means the endpoint doesn't understand Content-Encoding. A 400 may just be a bad payload,
+        # so it only counts against compression if the plain resend gets through.
+        body, _, _ = encode_payload(payload)
+        plain = runpod_client().post(endpoint_url(endpoint, 'run'), headers=endpoint_headers(endpoint), data=body)
+        if response.status_code == 415 or plain.status_code != 400:
+            with _transport_lock:
+                _compression_rejected.add(endpoint['id'])
+            increment_counter('compression_rejected', endpoint=endpoint['id'])
+        response = plain
+    increment_counter('request_bytes_json', json_size)
+    increment_counter('request_bytes_sent', len(body))
+    return response
+
+# Submission errors on threads without a script run (background submission, the
+# scheduler) are collected for the session instead of going to st.error, which drops them
+@st.cache_resource(show_spinner=False)
+def _submit_error_sinks():
+    return threading.local()
+
+_submit_error_sink = _submit_error_sinks()
+
+@contextmanager
+def collect_submit_errors(errors: List[str], lock: threading.Lock = None):
+    """Append this thread's submission errors to errors (holding lock) instead of showing them"""
+    _submit_error_sink.target = (errors, lock)
+    try:
+        yield
+    finally:
+        _submit_error_sink.target = None
+
+def show_submit_error(message: str):
+    target = getattr(_submit_error_sink, 'target', None)
+    if target is None:
+        st.error(message)
+        return
+    errors, lock = target
+    with lock or nullcontext():
+        errors.append(message)
+
+# Submit a /run payload to the least-loaded endpoint
+def post_job(payload: Dict[str, Any], description: str = "job", priority: str = PRIORITY_INTERACTIVE) -> str:
+    """POST a job payload and return its job ID (None on failure)
+
+    With priority scheduling on, bulk jobs are held in a local queue and the returned ID
+    is a held-job ticket that resolves to the RunPod job ID once it is dispatched.
+    """
+    if priority == PRIORITY_BULK and _scheduler_config['enabled']:
+        return schedule_bulk_job(payload, description)
+    return post_job_to_endpoint(select_endpoint(), payload, description)
+
+def post_job_to_endpoint(endpoint: Dict[str, Any], payload: Dict[str, Any], description: str = "job") -> str:
+    """POST a job payload to one endpoint and return its job ID (None on failure)"""
+    webhook_url = _webhook_receiver['url']
+    if webhook_url:
+        payload = dict(payload, webhook=webhook_url)
+    try:
+        with stage_timer('submit'):
+            response = send_job_payload(endpoint, payload)
+        if response.status_code == 200:
+            response_json = response.json()
+            register_job_endpoint(response_json["id"], endpoint)
+            record_job_submitted(response_json["id"])
+            if webhook_url:
+                expect_webhook(response_json["id"])
+            return response_json["id"]
+        else:
+            increment_counter('submit_errors', status_code=response.status_code)
+            show_submit_error(f"Failed to submit {description}: {response.text}")
+            return None
+    except Exception as e:
+        increment_counter('submit_errors', status_code='exception')
+        show_submit_error(f"Error submitting {description}: {e}")
+        return None
+
 # Submit job to RunPod to generate prompt
 def submit_prompt_generation_job(question: str, rating_options: str, guideline: str, max_tokens: int = 2048, temperature: float = 0.4) -> str:
     """Submit a job to RunPod to generate a prompt based on the template and inputs"""
@@ -95,17 +986,7 @@ Generate only the prompt text, nothing else."""
         }
     }
 
-    try:
-        response = requests.post(RUNPOD_URL, headers=HEADERS, json=payload)
-        if response.status_code == 200:
-            response_json = response.json()
-            return response_json["id"]
-        else:
-            st.error(f"Failed to submit prompt generation job: {response.text}")
-            return None
-    except Exception as e:
-        st.error(f"Error submitting prompt generation job: {e}")
-        return None
+    return post_job(payload, "prompt generation job")
 
 # Get the generated prompt from job result
 def extract_generated_prompt_from_response(response_text: str) -> str:
@@ -130,9 +1011,88 @@ def extract_generated_prompt_from_response(response_text: str) -> str:
         st.error(f"Error extracting generated prompt: {e}")
         return response_text
 
+# Structured (guided JSON) output mode
+STRUCTURED_STOP_SEQUENCES = ["< | User | >", "< | Assistant | >", "```\n\n"]
+DEFAULT_STRUCTURED_OUTPUT = {'reasoning_tokens': 2048, 'explanation_chars': 1200}
+RATING_OPTIONS_HEADER = re.compile(r'(?im)^[#*\s\d.]*(?:rating|answer|response)\s+options?\s*\**\s*:?\s*\**[ \t]*(.*)$')
+
+def parse_rating_options(prompt_text: str) -> List[str]:
+    """Read the rating labels from a prompt's Rating Options section (empty list if none is found)"""
+    match = RATING_OPTIONS_HEADER.search(prompt_text)
+    if not match:
+        return []
+
+    inline = match.group(1).strip(' *')
+    if inline:
+        lines = re.split(r'\s*(?:/|\||,|;|\bor\b)\s*', inline)
+    else:
+        lines = []
+        for line in prompt_text[match.end():].lstrip('\n').splitlines():
+            stripped = line.strip()
+            if not stripped:
+                if lines:
+                    break
+                continue
+            # Stop at the next section heading
+            if not re.match(r'^(?:[-*•]|\d+[.)])\s', stripped) and (stripped.startswith('#') or stripped.rstrip('*').endswith(':')):
+                break
+            lines.append(stripped)
+
+    options = []
+    for line in lines:
+        label = re.sub(r'^(?:[-*•]|\d+[.)])\s*', '', line.strip())
+        label = re.split(r'\s+[-–—]\s+|:\s|\s\(', label.replace('**', ''))[0]
+        label = label.strip(' "\'`:.')
+        if label and len(label) <= 60 and label not in options:
+            options.append(label)
+    return options
+
+def build_output_schema(questions: List[Tuple[str, str]], explanation_chars: int) -> Dict[str, Any]:
+    """JSON schema for the evaluation output
+
+    questions is a list of (question, prompt_text); question may be None when unknown.
+    One question gives a single {question, rating, explanation} object, several give
+    an array with exactly one object per question, in question order.
+    """
+    items = []
+    for question, prompt_text in questions:
+        options = parse_rating_options(prompt_text)
+        items.append({
+            'type': 'object',
+            'properties': {
+                'question': {'type': 'string', 'enum': [question]} if question else {'type': 'string'},
+                'rating': {'type': 'string', 'enum': options} if options else {'type': 'string'},
+                'explanation': {'type': 'string', 'maxLength': explanation_chars}
+            },
+            'required': ['question', 'rating', 'explanation'],
+            'additionalProperties': False
+        })
+    if len(items) == 1:
+        return items[0]
+    return {'type': 'array', 'prefixItems': items, 'items': False, 'minItems': len(items), 'maxItems': len(items)}
+
+def structured_sampling_params(sampling_params: Dict[str, Any], user_prompt: str, structured: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the output schema, stop sequences and a reasoning-length cap to sampling_params"""
+    schema = structured.get('schema') or build_output_schema([(None, user_prompt)], structured['explanation_chars'])
+    answers = schema.get('maxItems', 1)
+    # ~3 characters per token for the explanation plus room for the JSON keys and question text
+    answer_tokens = answers * (structured['explanation_chars'] // 3 + 96)
+    sampling_params = dict(sampling_params)
+    sampling_params[GUIDED_JSON_PARAM] = schema
+    sampling_params['stop'] = STRUCTURED_STOP_SEQUENCES
+    sampling_params['max_tokens'] = min(sampling_params['max_tokens'], structured['reasoning_tokens'] + answer_tokens)
+    return sampling_params
+
 # Submit job to RunPod
-def submit_job(transcript: str, user_prompt: str, max_tokens: int = 32768, temperature: float = 0.4) -> str:
-    """Submit a job to RunPod for inference"""
+def submit_job(transcript: str, user_prompt: str, max_tokens: int = 32768, temperature: float = 0.4,
+               structured: Dict[str, Any] = None, samples: int = 1, priority: str = PRIORITY_INTERACTIVE) -> str:
+    """Submit a job to RunPod for inference
+
+    structured enables guided JSON decoding (see structured_sampling_params); it may carry a
+    precomputed 'schema', otherwise the schema is derived from the prompt's rating options.
+    samples > 1 asks for that many completions of the one prompt (sampling_params n).
+    priority is the scheduling class (PRIORITY_INTERACTIVE or PRIORITY_BULK), see post_job.
+    """
     system_prompt = f"""Evaluate this transcript between an agent and a customer. Provide output in the following format:
 
 **Output Format:**  
@@ -150,44 +1110,203 @@ Transcript:
 {transcript}
 """
 
+    sampling_params = {
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+    if structured:
+        system_prompt += f"\nKeep your reasoning brief (under {structured['reasoning_tokens']} tokens) before giving the JSON.\n"
+        sampling_params = structured_sampling_params(sampling_params, user_prompt, structured)
+        increment_counter('structured_jobs')
+    if samples > 1:
+        sampling_params["n"] = samples
+
     payload = {
         "input": {
             "prompt": f"{system_prompt}< | User | >{user_prompt}< | Assistant | >",
-            "sampling_params": {
-                "temperature": temperature,
-                "max_tokens": max_tokens
-            }
+            "sampling_params": sampling_params
         }
     }
 
-    try:
-        response = requests.post(RUNPOD_URL, headers=HEADERS, json=payload)
-        if response.status_code == 200:
-            response_json = response.json()
-            return response_json["id"]
-        else:
-            st.error(f"Failed to submit job: {response.text}")
-            return None
-    except Exception as e:
-        st.error(f"Error submitting job: {e}")
-        return None
+    return post_job(payload, priority=priority)
 
 # RunPod job status checking
-def check_job_status(job_id: str) -> Dict[str, Any]:
-    """Check the status of a RunPod job"""
-    url = f"https://api.runpod.ai/v2/{RUNPOD_ENDPOINT_ID}/status/{job_id}"
-    headers = {"Authorization": f"Bearer {RUNPOD_API_KEY}"}
+def check_job_status(job_id: str, endpoint_id: str = None) -> Dict[str, Any]:
+    """Check the status of a RunPod job on the endpoint that owns it
+
+    Statuses already delivered by webhook are returned without a request, and jobs
+    still waiting for their webhook are only polled every WEBHOOK_FALLBACK_POLL_INTERVAL.
+    Held bulk jobs report IN_QUEUE until the scheduler dispatches them.
+    """
+    held = scheduled_job(job_id)
+    if held is not None:
+        if held['error'] == 'CANCELLED':
+            status = {'id': job_id, 'status': 'CANCELLED'}
+        elif held['error']:
+            status = {'id': job_id, 'status': 'FAILED', 'error': held['error']}
+        elif held['job_id'] is None:
+            return {'id': job_id, 'status': 'IN_QUEUE', 'held': True}
+        else:
+            status = check_job_status(held['job_id'], held['endpoint_id'])
+        if status.get('status') in FINISHED_STATUSES:
+            retire_ticket(job_id)
+        return status
+
+    delivered = take_webhook_status(job_id)
+    if delivered is not None:
+        return delivered
+    if awaiting_webhook(job_id):
+        increment_counter('status_polls_skipped')
+        return {'id': job_id, 'status': 'IN_PROGRESS', 'awaiting_webhook': True}
+
+    endpoint = job_endpoint(job_id, endpoint_id)
+    url = endpoint_url(endpoint, f"status/{job_id}")
+    headers = {"Authorization": f"Bearer {endpoint['api_key']}"}
     
     try:
-        response = requests.get(url, headers=headers)
-        return response.json()
+        with stage_timer('status_check'):
+            response = runpod_client().get(url, headers=headers)
+        status = response.json()
+        increment_counter('status_checks', status=status.get('status', 'UNKNOWN'))
+        if status.get('status') == 'COMPLETED':
+            record_job_completion(job_id, status)
+        if status.get('status') in FINISHED_STATUSES:
+            mark_job_finished(job_id)
+            with _webhook_lock:
+                _webhook_jobs.pop(job_id, None)
+        return status
     except Exception as e:
+        increment_counter('status_checks', status='ERROR')
         st.error(f"Error checking job status: {e}")
         return {"status": "ERROR", "error": str(e)}
 
+# Job cancellation (frees the worker instead of letting abandoned jobs run to completion)
+CANCEL_WORKERS = 16  # Concurrent /cancel requests
+
+def cancel_job(job_id: str, endpoint_id: str = None) -> bool:
+    """Cancel a RunPod job on the endpoint that owns it; False if it could not be cancelled or had already finished"""
+    held = scheduled_job(job_id)
+    if held is not None:
+        if release_held_job(job_id):
+            increment_counter('jobs_cancelled')
+            return True
+        if held['job_id'] is None:
+            return False
+        job_id, endpoint_id = held['job_id'], held['endpoint_id']
+    endpoint = job_endpoint(job_id, endpoint_id)
+    try:
+        with stage_timer('cancel'):
+            response = runpod_client().post(endpoint_url(endpoint, f"cancel/{job_id}"), headers=endpoint_headers(endpoint))
+        # /cancel answers 200 with the job's current status, which is COMPLETED if it finished first
+        status = response.json().get('status') if response.status_code == 200 else None
+    except (requests.RequestException, ValueError):
+        status = None
+    cancelled = status == 'CANCELLED'
+    if cancelled:
+        increment_counter('jobs_cancelled')
+    elif status is not None:
+        increment_counter('cancel_too_late', status=status)  # Left pending so the next status check collects it
+    else:
+        increment_counter('cancel_errors')
+    if cancelled:
+        mark_job_finished(job_id)
+        with _webhook_lock:
+            _webhook_jobs.pop(job_id, None)
+    return cancelled
+
+def cancel_jobs(job_ids: List[str]) -> int:
+    """Cancel RunPod jobs (or held-job tickets) concurrently; returns how many were cancelled"""
+    if not job_ids:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(CANCEL_WORKERS, len(job_ids))) as pool:
+        return sum(pool.map(cancel_job, job_ids))
+
+def evaluation_job_ids(job_id: str, chunked_record: Dict[str, Any] = None) -> List[str]:
+    """RunPod job IDs still running for an evaluation: unfinished chunk/reduce jobs, or the latest truncation retry"""
+    if chunked_record is not None:
+        ids = [chunk_id for part, chunk_id in enumerate(chunked_record['chunk_job_ids']) if part not in chunked_record['chunk_outputs']]
+        if chunked_record['reduce_job_id']:
+            ids.append(chunked_record['reduce_job_id'])
+        return ids
+    return [_job_retries.get(job_id, job_id)]
+
+def cancel_evaluation_jobs(jobs: List[Dict[str, Any]]) -> int:
+    """Cancel evaluation jobs concurrently and mark them cancelled
+
+    jobs are run-state records with 'job_id' and optional 'chunked'/'endpoint_id';
+    each successfully cancelled record gets 'cancelled': True. Returns the count.
+    """
+    targets = []
+    for job in jobs:
+        for runpod_id in evaluation_job_ids(job['job_id'], job.get('chunked')):
+            targets.append((job, runpod_id, job.get('endpoint_id') if runpod_id == job['job_id'] else None))
+    if not targets:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=min(CANCEL_WORKERS, len(targets))) as pool:
+        outcomes = list(pool.map(lambda target: cancel_job(target[1], target[2]), targets))
+
+    cancelled = 0
+    for (_, runpod_id, _), ok in zip(targets, outcomes):
+        if ok:
+            forget_evaluation_job(runpod_id)
+    for job in jobs:
+        if all(ok for (target_job, _, _), ok in zip(targets, outcomes) if target_job is job):
+            job['cancelled'] = True
+            cancelled += 1
+    return cancelled
+
 # JSON response parsing and validation
 def extract_jsons_from_response(raw_response: str) -> List[Dict]:
     """Extract JSON content from the response text"""
+    with stage_timer('parse'):
+        jsons = _extract_jsons_from_response(raw_response)
+    _count_parsed(jsons)
+    return jsons
+
+_json_decoder = json.JSONDecoder()
+_CODE_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+def decode_json_objects(text: str) -> Optional[List[Dict]]:
+    """Objects of a text that holds nothing but JSON: one object, an array of objects, or objects one after another
+
+    Returns None for anything else (prose around the JSON, Python-style quoting) so the caller
+    can fall back to the lenient extraction.
+    """
+    text = text.strip()
+    if text.startswith('```'):
+        text = _CODE_FENCE_RE.sub('', text)
+    if not text or text[0] not in '{[':
+        return None
+    objects, pos, end = [], 0, len(text)
+    try:
+        while pos < end:
+            value, pos = _json_decoder.raw_decode(text, pos)
+            objects.extend(value if isinstance(value, list) else [value])
+            while pos < end and text[pos] in ' \t\r\n,':
+                pos += 1
+    except ValueError:
+        return None
+    if not objects or not all(isinstance(item, dict) for item in objects):
+        return None
+    return objects
+
+def _count_parsed(jsons: List[Dict]):
+    increment_counter('json_objects_parsed', len(jsons))
+    if not jsons:
+        increment_counter('parse_failures')
+
+def _extract_jsons_from_response(raw_response: str, problems: Optional[List[str]] = None) -> List[Dict]:
+    """Uninstrumented JSON extraction used by extract_jsons_from_response
+
+    Parse problems are shown with st.error/st.warning, or appended to problems when it is given.
+    """
+    def report(show, message):
+        if problems is None:
+            show(message)
+        else:
+            problems.append(message)
+
     try:
         # Function to extract content after reasoning tags
         def extract_think_content(response_text):
@@ -212,6 +1331,11 @@ def extract_jsons_from_response(raw_response: str) -> List[Dict]:
         # Extract the final answer after any reasoning tags
         final_ans = extract_think_content(raw_response)
 
+        # Guided (structured) output and most free-form answers are plain JSON, which the C decoder reads fastest
+        direct = decode_json_objects(final_ans)
+        if direct is not None:
+            return direct
+
         # Try to find and parse JSON
         # Look for the first valid JSON object
         json_pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'  # Better JSON pattern
@@ -224,7 +1348,7 @@ def extract_jsons_from_response(raw_response: str) -> List[Dict]:
                 dict_result = clean_and_dict(final_ans)
                 return [dict_result]
             except:
-                st.error(f"Could not parse response as JSON: {final_ans[:200]}")
+                report(st.error, f"Could not parse response as JSON: {final_ans[:200]}")
                 return []
 
         # Clean and convert each JSON string to a dictionary
@@ -236,49 +1360,2347 @@ def extract_jsons_from_response(raw_response: str) -> List[Dict]:
                 json_dict = ast.literal_eval(cleaned_str)
                 json_dicts.append(json_dict)
             except Exception as e:
-                st.warning(f"Could not parse JSON block: {e}")
+                report(st.warning, f"Could not parse JSON block: {e}")
                 continue
 
         return json_dicts if json_dicts else []
         
     except Exception as e:
-        st.error(f"Error parsing JSON response: {e}")
-        st.error(f"Raw response: {raw_response[:500]}")
+        report(st.error, f"Error parsing JSON response: {e}")
+        report(st.error, f"Raw response: {raw_response[:500]}")
         return []
 
-# Main Streamlit app
-def main():
-    st.title("🔨 AQA Prompt Builder")
-    st.markdown("Build, test, and refine prompts for AQA evaluation")
-    
-    # Sidebar for configuration
-    with st.sidebar:
-        st.header("Configuration")
-        max_tokens = st.number_input("Max Tokens", min_value=1000, max_value=32768, value=32768)
-        temperature = st.slider("Temperature", min_value=0.0, max_value=2.0, value=0.4, step=0.1)
+# Self-consistency: several samples per job, combined by majority vote
+MAX_CONSISTENCY_SAMPLES = 10
+
+def response_texts(status: Dict[str, Any]) -> List[str]:
+    """Text of every choice in a completed status (one per sample when n > 1)"""
+    return ["".join(choice.get('tokens') or []) for choice in status.get('output')[0].get('choices')]
+
+def consensus_results(samples: List[List[Dict]]) -> List[Dict]:
+    """Majority-vote the parsed samples question by question
+
+    Each returned result is the first sample that gave the majority rating (so the
+    explanation matches it), plus 'agreement' (share of samples with that rating),
+    'votes' and 'samples'.
+    """
+    results = []
+    for position in range(max((len(sample) for sample in samples), default=0)):
+        answers = [sample[position] for sample in samples if position < len(sample)]
+        ratings = [str(a.get('rating', a.get('Rating', a.get('Answer', '')))).strip() for a in answers]
+        votes = Counter(rating.lower() for rating in ratings)
+        majority, count = votes.most_common(1)[0]
+        chosen = next(a for a, rating in zip(answers, ratings) if rating.lower() == majority)
+        results.append(dict(
+            chosen,
+            agreement=round(count / len(answers), 3),
+            votes={rating: votes[rating.lower()] for rating in dict.fromkeys(ratings)},
+            samples=len(answers)
+        ))
+    return results
+
+def parse_evaluation_output(status: Dict[str, Any]) -> List[Dict]:
+    """Parsed results of a completed evaluation job, majority-voted when it returned several samples"""
+    texts = response_texts(status)
+    if len(texts) == 1:
+        return extract_jsons_from_response(texts[0])
+    increment_counter('consistency_jobs')
+    return consensus_results([extract_jsons_from_response(text) for text in texts])
+
+# Batched post-processing: a status check polls every job first, then parses the completed
+# outputs together. Each output is cut down to the text after </think> as it arrives, so the
+# long reasoning blocks are not kept while the rest of the jobs are polled.
+def final_answer_text(text: str) -> str:
+    """The part of a model output that is parsed: everything after the last </think>"""
+    return text.rpartition('</think>')[2]
+
+def parse_many_outputs(answer_texts: List[List[str]]) -> List[Tuple[List[Dict], List[str]]]:
+    """parse_evaluation_output for many jobs, given each job's answer texts
+
+    Returns (results, problems) per job in input order. Parse problems are returned rather than
+    shown, so the caller can report them against the job they belong to.
+    """
+    results = []
+    for texts in answer_texts:
+        start = time.perf_counter()
+        problems = []
+        samples = [_extract_jsons_from_response(text, problems) for text in texts]
+        observe_stage('parse', (time.perf_counter() - start) / max(1, len(samples)))
+        for jsons in samples:
+            _count_parsed(jsons)
+        if len(samples) == 1:
+            results.append((samples[0], problems))
+        else:
+            increment_counter('consistency_jobs')
+            results.append((consensus_results(samples), problems))
+    return results
+
+# Adaptive max_tokens from observed output lengths
+OUTPUT_HISTORY_FILE = os.environ.get("AQA_OUTPUT_HISTORY_FILE", "output_length_history.json")
+OUTPUT_HISTORY_LIMIT = 500  # Most recent output lengths kept per prompt
+DEFAULT_ADAPTIVE_TOKENS = {'percentile': 95, 'headroom': 0.25, 'min_samples': 5, 'floor': 512}
+ADAPTIVE_RETRY_FACTOR = 4  # Truncated jobs are resubmitted with this many times the budget, up to the ceiling
+JOB_RETRY_ROUTES_LIMIT = 100000  # Retried jobs whose latest attempt is remembered for later status checks
+
+@st.cache_resource(show_spinner=False)
+def _output_history_registry():
+    return threading.Lock(), {'history': None, 'dirty': False}, {}, {}, OrderedDict()
+
+_output_history_lock, _output_history, _job_output_keys, _adaptive_jobs, _job_retries = _output_history_registry()
+_output_history: Dict[str, Any]  # 'history': prompt version -> recent output token counts (loaded on first use); 'dirty': unsaved changes
+_job_output_keys: Dict[str, List[str]]  # unfinished job ID -> prompt version of each question its output length is recorded under
+_adaptive_jobs: Dict[str, Dict[str, Any]]  # unfinished job ID -> budget, resubmission details and usage of earlier attempts
+_job_retries: OrderedDict  # original job ID -> latest retry job ID, oldest first (bounded by JOB_RETRY_ROUTES_LIMIT)
+
+def _load_output_history() -> Dict[str, deque]:
+    """Read the history file on first use (call with _output_history_lock held)"""
+    if _output_history['history'] is None:
+        history = {}
+        if OUTPUT_HISTORY_FILE and os.path.exists(OUTPUT_HISTORY_FILE):
+            try:
+                with open(OUTPUT_HISTORY_FILE, 'r', encoding='utf-8') as f:
+                    for key, lengths in json.load(f).items():
+                        history[key] = deque(lengths, maxlen=OUTPUT_HISTORY_LIMIT)
+            except (OSError, ValueError):
+                history = {}
+        _output_history['history'] = history
+    return _output_history['history']
+
+def record_output_length(key: str, output_tokens: int):
+    """Add one completed job's output length to the history for its prompt"""
+    if output_tokens <= 0:
+        return
+    with _output_history_lock:
+        history = _load_output_history()
+        history.setdefault(key, deque(maxlen=OUTPUT_HISTORY_LIMIT)).append(output_tokens)
+        _output_history['dirty'] = True
+
+def output_history_keys(question_prompts: List[str]) -> List[str]:
+    """History keys for a job: one per question it asks, so combined prompts share their questions' history"""
+    return [prompt_version(prompt) for prompt in question_prompts]
+
+def output_length_samples(key: str) -> List[int]:
+    with _output_history_lock:
+        return list(_load_output_history().get(key, []))
+
+def save_output_history(force: bool = False) -> bool:
+    """Write the output length history to disk if it changed"""
+    with _output_history_lock:
+        if not OUTPUT_HISTORY_FILE or _output_history['history'] is None or (not force and not _output_history['dirty']):
+            return False
+        snapshot = {key: list(lengths) for key, lengths in _output_history['history'].items()}
+        _output_history['dirty'] = False
+    tmp_path = f"{OUTPUT_HISTORY_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, OUTPUT_HISTORY_FILE)
+    return True
+
+def adaptive_max_tokens(keys: List[str], ceiling: int, adaptive: Dict[str, Any]) -> int:
+    """max_tokens for a job: per question, a high percentile of its past output lengths plus headroom, summed
+
+    keys are the prompt versions of the questions the job asks. Falls back to the
+    ceiling until every question has min_samples completed jobs.
+    """
+    budget = 0
+    for key in keys:
+        samples = sorted(output_length_samples(key))
+        if len(samples) < adaptive['min_samples']:
+            return ceiling
+        rank = min(len(samples) - 1, int(round(adaptive['percentile'] / 100 * (len(samples) - 1))))
+        budget += int(samples[rank] * (1 + adaptive['headroom']))
+    return min(ceiling, max(adaptive['floor'], budget))
+
+def job_was_truncated(status: Dict[str, Any], max_tokens: int = None) -> bool:
+    """True when a completed job stopped because it hit max_tokens"""
+    try:
+        if any(choice.get('finish_reason') == 'length' for choice in status['output'][0]['choices']):
+            return True
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return False
+    return bool(max_tokens) and extract_job_usage(status)['output_tokens'] >= max_tokens
+
+def track_evaluation_job(job_id: str, user_prompt: str, transcript: str, max_tokens: int, ceiling: int,
+                         temperature: float, structured: Dict[str, Any] = None, samples: int = 1,
+                         priority: str = PRIORITY_INTERACTIVE, keys: List[str] = None):
+    """Remember which questions a job asks (keys, default the whole prompt) and, for reduced budgets, how to resubmit it"""
+    with _output_history_lock:
+        _job_output_keys[job_id] = keys or [prompt_version(user_prompt)]
+        if max_tokens < ceiling:
+            _adaptive_jobs[job_id] = {
+                'transcript': transcript,
+                'user_prompt': user_prompt,
+                'max_tokens': max_tokens,
+                'ceiling': ceiling,
+                'temperature': temperature,
+                'structured': structured,
+                'samples': samples,
+                'priority': priority,
+                'usages': []
+            }
+
+def finish_evaluation_job(job_id: str, current_id: str, status: Dict[str, Any]) -> Dict[str, Any]:
+    """Handle a COMPLETED status: retry truncated adaptive jobs, record output length, merge retry usage
+
+    The job's tracking entries are dropped here, so a repeated check of the same
+    attempt returns RunPod's status as is.
+    """
+    with _output_history_lock:
+        keys = _job_output_keys.pop(current_id, None)
+        attempt = _adaptive_jobs.pop(current_id, None)
+    truncated = job_was_truncated(status, attempt['max_tokens'] if attempt else None)
+
+    if attempt and truncated and attempt['max_tokens'] < attempt['ceiling']:
+        budget = min(attempt['ceiling'], attempt['max_tokens'] * ADAPTIVE_RETRY_FACTOR)
+        retry_id = submit_job(attempt['transcript'], attempt['user_prompt'], budget, attempt['temperature'],
+                              attempt['structured'], attempt['samples'], attempt['priority'])
+        if retry_id:
+            increment_counter('truncation_retries')
+            with _output_history_lock:
+                _job_output_keys[retry_id] = keys
+                _adaptive_jobs[retry_id] = dict(attempt, max_tokens=budget, usages=attempt['usages'] + [extract_job_usage(status)])
+                _job_retries[job_id] = retry_id
+                _job_retries.move_to_end(job_id)
+                while len(_job_retries) > JOB_RETRY_ROUTES_LIMIT:
+                    _job_retries.popitem(last=False)
+            return {'id': job_id, 'status': 'IN_PROGRESS', 'retry_job_id': retry_id, 'retry_max_tokens': budget}
+
+    if keys and not truncated:
+        output_tokens = extract_job_usage(status)['output_tokens']
+        if not output_tokens:
+            output_tokens = sum(approx_token_count(text) for text in response_texts(status))
+        # History is per completion and per question, so split the job's total evenly over both
+        share = output_tokens // (len(status['output'][0]['choices']) * len(keys))
+        for key in keys:
+            record_output_length(key, share)
+
+    if attempt and attempt['usages']:
+        usages = attempt['usages'] + [extract_job_usage(status)]
+        status = dict(status, id=job_id, retries=len(attempt['usages']),
+                      delayTime=sum(u['delay_ms'] for u in usages),
+                      executionTime=sum(u['execution_ms'] for u in usages))
+        status['output'] = [dict(status['output'][0], usage={
+            'input': sum(u['input_tokens'] for u in usages),
+            'output': sum(u['output_tokens'] for u in usages)
+        })]
+    return status
+
+def forget_evaluation_job(current_id: str):
+    """Drop a failed or cancelled attempt's tracking entries (and with them its transcript)"""
+    with _output_history_lock:
+        _job_output_keys.pop(current_id, None)
+        _adaptive_jobs.pop(current_id, None)
+
+# Map-reduce evaluation for transcripts longer than the context window
+TURN_BOUNDARY_PATTERN = re.compile(r'(?m)^(?=[ \t]*(?:Agent|Customer)[ \t]*:)')
+
+TOKEN_COUNT_CACHE_SIZE = 20000
+
+def approx_token_count(text: str) -> int:
+    """Token count for sizing decisions (falls back to ~4 characters per token without tiktoken)"""
+    encoder = token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return max(1, len(text) // 4)
+
+@st.cache_resource(show_spinner=False)
+def _transcript_token_counter():
+    return lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)(approx_token_count)
+
+def transcript_token_count(transcript: str) -> int:
+    """approx_token_count memoized per transcript across sessions, so repeated submissions (questions, A/B variants, other users) count once"""
+    return _transcript_token_counter()(transcript)
+
+def split_transcript_into_chunks(transcript: str, max_chunk_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """Split a transcript on Agent:/Customer: turn boundaries into token-bounded, overlapping windows"""
+    overlap_tokens = min(overlap_tokens, max_chunk_tokens // 2)
+    turns = [turn.strip() for turn in TURN_BOUNDARY_PATTERN.split(transcript) if turn.strip()]
+
+    # Hard-split any single turn that is larger than a whole window
+    pieces = []
+    for turn in turns:
+        turn_tokens = approx_token_count(turn) + 1  # +1 for the joining newline
+        if turn_tokens <= max_chunk_tokens:
+            pieces.append((turn, turn_tokens))
+            continue
+        step = max(1, len(turn) * max_chunk_tokens // turn_tokens)
+        for start in range(0, len(turn), step):
+            piece = turn[start:start + step]
+            pieces.append((piece, approx_token_count(piece) + 1))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece, piece_tokens in pieces:
+        if current and current_tokens + piece_tokens > max_chunk_tokens:
+            chunks.append("\n".join(p for p, _ in current))
+
+            # Carry trailing turns into the next window as overlap
+            overlap = []
+            overlap_used = 0
+            for p, p_tokens in reversed(current):
+                if overlap_used + p_tokens > overlap_tokens:
+                    break
+                overlap.insert(0, (p, p_tokens))
+                overlap_used += p_tokens
+            while overlap and overlap_used + piece_tokens > max_chunk_tokens:
+                overlap_used -= overlap.pop(0)[1]
+            current = overlap
+            current_tokens = overlap_used
+
+        current.append((piece, piece_tokens))
+        current_tokens += piece_tokens
+
+    if current:
+        chunks.append("\n".join(p for p, _ in current))
+    return chunks
+
+def build_chunk_prompt(user_prompt: str, part: int, total: int) -> str:
+    """Evaluation prompt for one window of a chunked transcript"""
+    return f"""{user_prompt}
+
+NOTE: This is part {part} of {total} of a longer transcript (consecutive parts overlap slightly). Evaluate only what this part shows. If this part contains no evidence relevant to a question, still return its JSON object, say so in the explanation and give your best provisional rating."""
+
+def build_reduce_prompt(user_prompt: str, chunk_outputs: List[str]) -> str:
+    """Prompt that merges per-chunk evaluations into the final JSON answer(s)"""
+    total = len(chunk_outputs)
+    sections = "\n\n".join(f"--- Part {i} of {total} ---\n{output}" for i, output in enumerate(chunk_outputs, 1))
+    return f"""{user_prompt}
+
+The transcript was too long to evaluate in one pass, so it was split into {total} consecutive, overlapping parts and each part was evaluated separately. The partial evaluations are below.
+
+Combine them into ONE final evaluation of the whole call for each question:
+- Base the rating on the evidence from all parts together (an issue found in any part counts for the whole call unless the guidelines say otherwise)
+- Ignore parts that found no relevant evidence
+- Merge the supporting evidence into a single explanation
+
+PARTIAL EVALUATIONS:
+{sections}"""
+
+def submit_chunked_job(transcript: str, user_prompt: str, max_tokens: int, temperature: float,
+                       max_chunk_tokens: int, overlap_tokens: int, structured: Dict[str, Any] = None,
+                       samples: int = 1, priority: str = PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+    """Submit one map job per transcript window; returns the chunked-job record (None on failure)"""
+    chunks = split_transcript_into_chunks(transcript, max_chunk_tokens, overlap_tokens)
+    chunk_job_ids = []
+    for part, chunk in enumerate(chunks, 1):
+        job_id = submit_job(chunk, build_chunk_prompt(user_prompt, part, len(chunks)), max_tokens, temperature, structured, priority=priority)
+        if not job_id:
+            # Without every part there is nothing to reduce, so stop the parts already submitted
+            cancel_jobs(chunk_job_ids)
+            return None
+        chunk_job_ids.append(job_id)
+
+    increment_counter('chunked_jobs')
+    return {
+        'job_id': f"chunked-{uuid.uuid4()}",
+        'chunk_job_ids': chunk_job_ids,
+        'chunk_outputs': {},
+        'chunk_usage': {},
+        'reduce_job_id': None,
+        'error': None,
+        'user_prompt': user_prompt,
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'structured': structured,
+        'samples': samples,
+        'priority': priority
+    }
+
+def submit_evaluation(transcript: str, user_prompt: str, max_tokens: int, temperature: float,
+                      chunking: Dict[str, int] = None, structured: Dict[str, Any] = None,
+                      adaptive: Dict[str, Any] = None, samples: int = 1,
+                      priority: str = PRIORITY_INTERACTIVE, question_prompts: List[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """Submit a transcript for evaluation, chunking it when it exceeds the configured window
+
+    With adaptive set, ordinary jobs get max_tokens from the output length history of
+    each question (question_prompts for a combined prompt, otherwise user_prompt; max_tokens
+    becomes the ceiling) and are retried if they get truncated.
+    samples > 1 requests that many completions per job (the reduce job, for chunked ones).
+    Returns (job_id, chunked_record); chunked_record is None for ordinary single jobs.
+    """
+    if chunking and transcript_token_count(transcript) > chunking['max_chunk_tokens']:
+        record = submit_chunked_job(transcript, user_prompt, max_tokens, temperature,
+                                    chunking['max_chunk_tokens'], chunking['overlap_tokens'], structured, samples, priority)
+        return (record['job_id'], record) if record else (None, None)
+    keys = output_history_keys(question_prompts or [user_prompt])
+    budget = adaptive_max_tokens(keys, max_tokens, adaptive) if adaptive else max_tokens
+    job_id = submit_job(transcript, user_prompt, budget, temperature, structured, samples, priority)
+    if job_id:
+        track_evaluation_job(job_id, user_prompt, transcript, budget, max_tokens, temperature, structured, samples, priority, keys)
+    return job_id, None
+
+def advance_chunked_job(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Poll a chunked job's map jobs, submit the reduce job when they finish, and return a status dict
+
+    The returned COMPLETED status carries the reduce job's output with queue time,
+    execution time and token usage summed over every map and reduce job.
+    """
+    total = len(record['chunk_job_ids'])
+    if record.get('error'):
+        return {'status': 'FAILED', 'error': record['error']}
+
+    if record['reduce_job_id'] is None:
+        for part, chunk_job_id in enumerate(record['chunk_job_ids']):
+            if part in record['chunk_outputs']:
+                continue
+            status = check_job_status(chunk_job_id)
+            if status.get('status') == 'COMPLETED':
+                response_text = status.get('output')[0].get('choices')[0].get('tokens')[0]
+                # Keep only the answer; the reasoning block is not needed for the reduce step
+                record['chunk_outputs'][part] = response_text.split('</think>')[-1].strip()
+                record['chunk_usage'][chunk_job_id] = extract_job_usage(status)
+            elif status.get('status') in FINISHED_STATUSES or status.get('status') == 'ERROR':
+                # The reduce step needs every part, so stop the others and remember the failure
+                record['error'] = f"Chunk {part + 1}/{total} {status.get('status')}: {status.get('error', '')}"
+                cancel_jobs([job_id for other, job_id in enumerate(record['chunk_job_ids'])
+                             if other != part and other not in record['chunk_outputs']])
+                return {'status': 'FAILED', 'error': record['error']}
+
+        if len(record['chunk_outputs']) < total:
+            return {'status': 'IN_PROGRESS', 'chunks_completed': len(record['chunk_outputs']), 'chunks_total': total}
+
+        chunk_outputs = [record['chunk_outputs'][part] for part in range(total)]
+        reduce_job_id = submit_job(
+            f"[Evaluated in {total} parts - see the partial evaluations after the question prompt]",
+            build_reduce_prompt(record['user_prompt'], chunk_outputs),
+            record['max_tokens'],
+            record['temperature'],
+            record.get('structured'),
+            record.get('samples', 1),
+            record.get('priority', PRIORITY_INTERACTIVE)
+        )
+        if not reduce_job_id:
+            return {'status': 'FAILED', 'error': "Could not submit reduce job"}
+        record['reduce_job_id'] = reduce_job_id
+        return {'status': 'IN_PROGRESS', 'chunks_completed': total, 'chunks_total': total}
+
+    status = check_job_status(record['reduce_job_id'])
+    if status.get('status') != 'COMPLETED':
+        return status
+
+    usages = list(record['chunk_usage'].values()) + [extract_job_usage(status)]
+    return {
+        'id': record['job_id'],
+        'status': 'COMPLETED',
+        'delayTime': sum(u['delay_ms'] for u in usages),
+        'executionTime': sum(u['execution_ms'] for u in usages),
+        'output': [{
+            'choices': status.get('output')[0].get('choices'),
+            'usage': {
+                'input': sum(u['input_tokens'] for u in usages),
+                'output': sum(u['output_tokens'] for u in usages)
+            }
+        }]
+    }
+
+def check_evaluation_status(job_id: str, chunked_record: Dict[str, Any] = None, endpoint_id: str = None) -> Dict[str, Any]:
+    """Status of an evaluation job, whether ordinary or chunked"""
+    if chunked_record is not None:
+        return advance_chunked_job(chunked_record)
+
+    # Follow automatic retries of truncated jobs
+    current_id = _job_retries.get(job_id, job_id)
+    status = check_job_status(current_id, endpoint_id if current_id == job_id else None)
+    if status.get('status') == 'COMPLETED':
+        status = finish_evaluation_job(job_id, current_id, status)
+    elif status.get('status') in FINISHED_STATUSES:
+        forget_evaluation_job(current_id)
+    return status
+
+# Transcript preprocessing (run once per transcript before submission)
+PREPROCESSING_CACHE_LIMIT = 50000  # Cleaned transcripts kept for reuse across questions and runs
+DEFAULT_PREPROCESSING = {
+    'normalize_whitespace': True,
+    'strip_timestamps': True,
+    'strip_boilerplate': True,
+    'remove_fillers': False,
+    'collapse_speakers': True,
+    'extra_patterns': []
+}
+SPEAKER_LABEL_SUFFIX = r'(?:[ \t]*(?:\([^)\n]{0,30}\)|\[[^\]\n]{0,30}\]|#?\d{1,6}))?[ \t]*:[ \t]*'
+# (option, pattern, replacement) applied in order with vectorized Series.str.replace
+PREPROCESSING_RULES = [
+    ('normalize_whitespace', r'\r\n?', '\n'),
+    # [00:01:23] or (12:04) anywhere, and bare 00:01:23 / 00:01:23 - at the start of a line
+    ('strip_timestamps', r'[\[\(]\d{1,2}:\d{2}(?::\d{2})?(?:[.,]\d+)?(?:\s?[AaPp][Mm])?[\]\)][ \t]*', ''),
+    ('strip_timestamps', r'(?m)^[ \t]*\d{1,2}:\d{2}(?::\d{2})?(?:[.,]\d+)?(?:\s?[AaPp][Mm])?[ \t]*-?[ \t]*', ''),
+    # System/IVR lines and lines that are only a bracketed note such as [hold music]
+    ('strip_boilerplate', r'(?mi)^[ \t]*(?:system|automated message|ivr|recording)[ \t]*:.*(?:\n|$)', ''),
+    ('strip_boilerplate', r'(?m)^[ \t]*[\[\(<][^\]\)>\n]*[\]\)>][ \t]*(?:\n|$)', ''),
+    # 'AGENT (Sarah):', 'Rep 2:', 'Caller:' -> 'Agent:' / 'Customer:'; only a role word with an optional
+    # (name), [ID] or number counts as a turn label, so lines like 'Customer service is closed:' are left alone
+    ('collapse_speakers', r'(?mi)^[ \t]*(?:agent|representative|rep|advisor|csr)' + SPEAKER_LABEL_SUFFIX, 'Agent: '),
+    ('collapse_speakers', r'(?mi)^[ \t]*(?:customer|caller|client|member)' + SPEAKER_LABEL_SUFFIX, 'Customer: '),
+    ('remove_fillers', r"(?i)(?<![\w'])(?:u+m+|u+h+|e+r+m+|h+m+)(?![\w'])[,.]?[ \t]*", ''),
+    ('normalize_whitespace', r'[ \t]+', ' '),
+    ('normalize_whitespace', r'(?m)^ | $', ''),
+    ('normalize_whitespace', r'\n{2,}', '\n'),
+]
+SAME_SPEAKER_PATTERN = r'(?m)^(Agent|Customer):(.*)\n\1:[ \t]*'
+
+@st.cache_resource(show_spinner=False)
+def _preprocessing_registry():
+    return threading.Lock(), OrderedDict()
+
+_preprocessing_lock, _preprocessing_cache = _preprocessing_registry()
+_preprocessing_cache: "OrderedDict[Tuple[str, str], str]"
+
+def preprocessing_options_key(options: Dict[str, Any]) -> str:
+    # The rules are part of the key so a changed rule doesn't reuse transcripts cleaned by the old one
+    return json.dumps({'options': options, 'rules': PREPROCESSING_RULES}, sort_keys=True)
+
+def _preprocess_series(transcripts: pd.Series, options: Dict[str, Any]) -> pd.Series:
+    """Apply the enabled preprocessing rules to a Series of transcripts in one vectorized pass per rule"""
+    cleaned = transcripts.fillna('').astype(str)
+    for option, pattern, replacement in PREPROCESSING_RULES:
+        if options.get(option):
+            cleaned = cleaned.str.replace(pattern, replacement, regex=True)
+            if option == 'collapse_speakers' and replacement == 'Customer: ':
+                # Merge consecutive turns by the same speaker into one turn
+                while True:
+                    merged = cleaned.str.replace(SAME_SPEAKER_PATTERN, r'\1:\2 ', regex=True)
+                    if merged.equals(cleaned):
+                        break
+                    cleaned = merged
+    for pattern in options.get('extra_patterns', []):
+        cleaned = cleaned.str.replace(pattern, '', regex=True)
+    return cleaned.str.strip()
+
+def preprocess_transcripts(transcripts: pd.Series, options: Dict[str, Any]) -> pd.Series:
+    """Clean a Series of transcripts, reusing cached results for transcripts seen before"""
+    options_key = preprocessing_options_key(options)
+    keys = [(hashlib.sha1(str(t).encode('utf-8')).hexdigest(), options_key) for t in transcripts]
+
+    with _preprocessing_lock:
+        cached = [_preprocessing_cache.get(key) for key in keys]
+    missing = [i for i, value in enumerate(cached) if value is None]
+
+    if missing:
+        with stage_timer('preprocess'):
+            fresh = _preprocess_series(transcripts.iloc[missing], options).tolist()
+        with _preprocessing_lock:
+            for i, value in zip(missing, fresh):
+                cached[i] = value
+                _preprocessing_cache[keys[i]] = value
+            while len(_preprocessing_cache) > PREPROCESSING_CACHE_LIMIT:
+                _preprocessing_cache.popitem(last=False)
+    increment_counter('preprocess_cache_hits', len(keys) - len(missing))
+
+    return pd.Series(cached, index=transcripts.index)
+
+def preprocess_transcript(transcript: str, options: Dict[str, Any]) -> str:
+    """Clean a single transcript (cached)"""
+    return preprocess_transcripts(pd.Series([transcript]), options).iloc[0]
+
+def measure_token_savings(original: pd.Series, cleaned: pd.Series) -> Dict[str, Any]:
+    """Compare total tokens before and after preprocessing using count_tokens"""
+    tokens_before = count_tokens("\n".join(original.fillna('').astype(str)))
+    tokens_after = count_tokens("\n".join(cleaned.astype(str)))
+    saved = tokens_before - tokens_after
+    return {
+        'tokens_before': tokens_before,
+        'tokens_after': tokens_after,
+        'tokens_saved': saved,
+        'percent_saved': saved / tokens_before * 100 if tokens_before else 0.0
+    }
+
+def render_token_savings(savings: Dict[str, Any], questions_per_transcript: int = 1):
+    """Show the token reduction from preprocessing"""
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Tokens Before", f"{savings['tokens_before']:,}")
+    col2.metric("Tokens After", f"{savings['tokens_after']:,}", f"-{savings['percent_saved']:.1f}%", delta_color="inverse")
+    col3.metric("Input Tokens Saved", f"{savings['tokens_saved'] * questions_per_transcript:,}",
+                help="Saved per run; multiplied by the number of jobs each transcript is sent in")
+
+# Bulk testing pipeline helpers (shared by the Bulk Testing tab and benchmark.py)
+def build_combined_prompt(prompts_dict: Dict[str, str], prompts_with_numbers: Dict[str, Dict]) -> str:
+    """Combine all question prompts into one multi-question prompt"""
+    questions_list = []
+    for q_idx, (question, prompt_text) in enumerate(prompts_dict.items(), 1):
+        question_num = prompts_with_numbers.get(question, {}).get('question_number', q_idx)
+        questions_list.append(f"Question {question_num}: {question}")
+
+    return f"""Please evaluate the following {len(prompts_dict)} questions based on the transcript provided.
+
+QUESTIONS TO EVALUATE:
+{chr(10).join(questions_list)}
+
+For each question, please provide your answer in the JSON format below. Return an array of JSON objects, one for each question.
+""" + "\n\n".join([prompt_text for prompt_text in prompts_dict.values()])
+
+def submit_bulk_jobs(df: pd.DataFrame, prompts_info: Dict[str, Any], max_tokens: int, temperature: float, run_id: str = None,
+                     chunking: Dict[str, int] = None, preprocessing: Dict[str, Any] = None,
+                     structured: Dict[str, Any] = None, adaptive: Dict[str, Any] = None, samples: int = 1,
+                     longest_first: bool = False, priority: str = PRIORITY_BULK) -> List[Dict]:
+    """Submit one job per transcript and return the job records for st.session_state.bulk_jobs
+
+    longest_first submits in descending order of estimated cost (see estimate_job_costs)
+    and stores each job's estimate as 'predicted_cost_s'; otherwise rows go in file order.
+    priority is the scheduling class (see post_job); a pilot sample the user is waiting on
+    goes as PRIORITY_INTERACTIVE so it is not held behind queued bulk jobs.
+    """
+    bulk_job_ids = []
+    run_id = run_id or new_run_id('bulk')
+
+    # Clean every transcript once up front; job records keep the original text
+    if preprocessing:
+        submitted_transcripts = preprocess_transcripts(df['transcript'], preprocessing)
+    else:
+        submitted_transcripts = df['transcript']
+
+    if prompts_info['single']:
+        prompt_text, question_prompts = prompts_info['prompt'], [prompts_info['prompt']]
+    else:
+        prompt_text = build_combined_prompt(prompts_info['prompts'], prompts_info.get('prompts_with_numbers', {}))
+        question_prompts = list(prompts_info['prompts'].values())
+    costs = None
+    if longest_first:
+        costs = estimate_job_costs(submitted_transcripts, prompt_text, question_prompts, max_tokens, samples)
+        df = df.loc[costs.sort_values(ascending=False, kind='stable').index]
+
+    if prompts_info['single']:
+        # Single prompt - test against all transcripts
+        if structured:
+            structured = dict(structured, schema=build_output_schema([(None, prompts_info['prompt'])], structured['explanation_chars']))
+
+        for idx, row in df.iterrows():
+            interaction_id = row['interactionid']
+            transcript = row['transcript']
+
+            job_id, chunked = submit_evaluation(
+                submitted_transcripts[idx],
+                prompts_info['prompt'],
+                max_tokens,
+                temperature,
+                chunking,
+                structured,
+                adaptive,
+                samples,
+                priority
+            )
+
+            if job_id:
+                bulk_job_ids.append({
+                    'interactionid': interaction_id,
+                    'transcript_hash': transcript_digest(transcript),
+                    'job_id': job_id,
+                    'index': idx,
+                    'prompt': 'Single Prompt',
+                    'question': '',
+                    'prompt_version': prompt_version(prompts_info['prompt']),
+                    'run_id': run_id,
+                    'endpoint_id': None if chunked else job_endpoint_id(job_id),
+                    'chunked': chunked,
+                    'submitted_at': time.time()
+                })
+                if costs is not None:
+                    bulk_job_ids[-1]['predicted_cost_s'] = float(costs[idx])
+    else:
+        # Multiple prompts - send ALL prompts in ONE request per transcript
+        prompts_dict = prompts_info['prompts']
+        prompts_with_numbers = prompts_info.get('prompts_with_numbers', {})
+        combined_prompt = prompt_text
+        if structured:
+            # One schema item per question, each with that question's own rating options
+            structured = dict(structured, schema=build_output_schema(list(prompts_dict.items()), structured['explanation_chars']))
+
+        for idx, row in df.iterrows():
+            interaction_id = row['interactionid']
+            transcript = row['transcript']
+
+            # Single job per transcript with all prompts
+            job_id, chunked = submit_evaluation(
+                submitted_transcripts[idx],
+                combined_prompt,
+                max_tokens,
+                temperature,
+                chunking,
+                structured,
+                adaptive,
+                samples,
+                priority,
+                question_prompts
+            )
+
+            if job_id:
+                bulk_job_ids.append({
+                    'interactionid': interaction_id,
+                    'transcript_hash': transcript_digest(transcript),
+                    'job_id': job_id,
+                    'index': idx,
+                    'prompts': list(prompts_dict.keys()),  # Store all questions
+                    'prompts_with_numbers': prompts_with_numbers,
+                    'run_id': run_id,
+                    'endpoint_id': None if chunked else job_endpoint_id(job_id),
+                    'chunked': chunked,
+                    'submitted_at': time.time()
+                })
+                if costs is not None:
+                    bulk_job_ids[-1]['predicted_cost_s'] = float(costs[idx])
+
+    return bulk_job_ids
+
+def is_bulk_job_processed(job_info: Dict[str, Any], bulk_results: Dict[str, Dict]) -> bool:
+    """Check whether results for a bulk job are already stored"""
+    if 'prompts' in job_info and len(job_info['prompts']) > 0:
+        # Multi-prompt mode: check if any result exists for this job
+        return any(key.startswith(f"{job_info['job_id']}_") for key in bulk_results.keys())
+    # Single prompt mode: check if job_id exists
+    return job_info['job_id'] in bulk_results
+
+def processed_bulk_job_ids(bulk_results: Dict[str, Dict]) -> set:
+    """Job IDs with stored results, for checking many jobs at once (multi-prompt keys are '{job_id}_{i}')"""
+    return set(bulk_results) | {key.rsplit('_', 1)[0] for key in bulk_results}
+
+def match_answers_to_questions(questions: List[str], jsons: List[Dict]) -> List[Tuple[int, Dict]]:
+    """Pair answers with question indices: by the answer's question field when it names a question
+    exactly, otherwise by position; a repeated answer to a question, or one whose position is
+    already answered, is dropped rather than stored under the wrong question"""
+    positions = {question: i for i, question in enumerate(questions)}
+    matched, unnamed = {}, []
+    for position, answer in enumerate(jsons):
+        named = answer.get('question', answer.get('Question')) if isinstance(answer, dict) else None
+        i = positions.get(named) if isinstance(named, str) else None
+        if i is None:
+            unnamed.append((position, answer))
+        elif i not in matched:
+            matched[i] = answer
+    for position, answer in unnamed:
+        if position < len(questions) and position not in matched:
+            matched[position] = answer
+    return sorted(matched.items(), key=lambda pair: pair[0])
+
+def store_bulk_job_results(job_info: Dict[str, Any], jsons: List[Dict], bulk_results: Dict[str, Dict]):
+    """Store parsed results for a completed bulk job, one entry per question"""
+    # Check if this job has multiple prompts (bulk multi-prompt mode)
+    if 'prompts' in job_info and len(job_info['prompts']) > 0:
+        # Process multiple responses for multiple prompts
+        prompts_list = job_info['prompts']
+        prompts_with_numbers = job_info.get('prompts_with_numbers', {})
+
+        # Store each result separately, under the question it answers
+        for i, json_result in match_answers_to_questions(prompts_list, jsons):
+            question = prompts_list[i]
+            question_number = prompts_with_numbers.get(question, {}).get('question_number', '')
+
+            bulk_results[f"{job_info['job_id']}_{i}"] = {
+                'interactionid': job_info['interactionid'],
+                'transcript_hash': job_info['transcript_hash'],
+                'result': json_result,
+                'index': job_info['index'],
+                'question': question,
+                'question_number': question_number,
+                'prompt': 'Multi-Prompt',
+                'prompt_version': prompt_version(prompts_with_numbers.get(question, {}).get('prompt', question)),
+                'run_id': job_info.get('run_id')
+            }
+    else:
+        # Single prompt mode
+        bulk_results[job_info['job_id']] = {
+            'interactionid': job_info['interactionid'],
+            'transcript_hash': job_info['transcript_hash'],
+            'result': jsons[0] if jsons else None,
+            'index': job_info['index'],
+            'question': job_info.get('question', ''),
+            'question_number': job_info.get('question_number', ''),
+            'prompt': job_info.get('prompt', ''),
+            'prompt_version': job_info.get('prompt_version', ''),
+            'run_id': job_info.get('run_id')
+        }
+
+# Incremental re-evaluation: results are remembered per (interaction, question, prompt version)
+def result_store_key(interactionid: Any, question: str, version: str) -> Tuple[str, str, str]:
+    return (str(interactionid), question or 'Single Prompt', version)
+
+def remember_bulk_results(result_store: Dict[Tuple, Dict], bulk_results: Dict[str, Dict]):
+    """Add parsed bulk results to the store used to carry unchanged results into later runs"""
+    for entry in bulk_results.values():
+        if entry.get('result') and entry.get('prompt_version'):
+            result_store[result_store_key(entry['interactionid'], entry.get('question'), entry['prompt_version'])] = entry
+
+def plan_incremental_run(df: pd.DataFrame, prompts_info: Dict[str, Any],
+                         result_store: Dict[Tuple, Dict]) -> Tuple[Dict[Any, List[str]], List[Dict]]:
+    """Diff a run against stored results
+
+    Returns (todo, carried): todo maps each df index that still needs work to the
+    questions to evaluate (['Single Prompt'] in single-prompt mode); carried holds
+    stored results whose interaction, question, prompt and transcript are unchanged.
+    """
+    if prompts_info['single']:
+        questions = {'Single Prompt': prompt_version(prompts_info['prompt'])}
+    else:
+        questions = {question: prompt_version(prompt) for question, prompt in prompts_info['prompts'].items()}
+    numbers = prompts_info.get('prompts_with_numbers', {})
+
+    todo, carried = {}, []
+    for idx, interactionid, transcript in zip(df.index, df['interactionid'], df['transcript']):
+        missing = []
+        digest = transcript_digest(transcript)
+        for question, version in questions.items():
+            entry = result_store.get(result_store_key(interactionid, question, version))
+            if entry is not None and entry.get('transcript_hash') == digest:
+                carried.append(dict(entry, index=idx, question_number=numbers.get(question, {}).get('question_number', entry.get('question_number', ''))))
+            else:
+                missing.append(question)
+        if missing:
+            todo[idx] = missing
+    return todo, carried
+
+def submit_incremental_bulk_jobs(df: pd.DataFrame, prompts_info: Dict[str, Any], result_store: Dict[Tuple, Dict],
+                                 max_tokens: int, temperature: float, run_id: str = None,
+                                 **options) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """Submit only the (transcript, question) pairs whose prompt changed or that have no stored result
+
+    Returns (jobs, carried_results); carried_results is keyed like bulk_results so it can
+    seed the new run's results and flow into the pivoted export unchanged.
+    """
+    run_id = run_id or new_run_id('bulk')
+    todo, carried = plan_incremental_run(df, prompts_info, result_store)
+    jobs = submit_planned_bulk_jobs(df, prompts_info, todo, max_tokens, temperature, run_id=run_id, **options)
+    return jobs, carry_forward_results(carried, run_id)
+
+def submit_planned_bulk_jobs(df: pd.DataFrame, prompts_info: Dict[str, Any], todo: Dict[Any, List[str]],
+                             max_tokens: int, temperature: float, run_id: str = None, **options) -> List[Dict]:
+    """Submit the questions a plan_incremental_run todo lists for each of its df rows"""
+    jobs = []
+    if prompts_info['single']:
+        if todo:
+            jobs = submit_bulk_jobs(df.loc[list(todo)], prompts_info, max_tokens, temperature, run_id=run_id, **options)
+    else:
+        # Transcripts needing the same set of questions share one combined prompt
+        groups: Dict[Tuple[str, ...], List[Any]] = {}
+        for idx, questions in todo.items():
+            groups.setdefault(tuple(questions), []).append(idx)
+        numbers = prompts_info.get('prompts_with_numbers', {})
+        for questions, indices in groups.items():
+            subset_info = {
+                'single': False,
+                'prompts': {q: prompts_info['prompts'][q] for q in questions},
+                'prompts_with_numbers': {q: numbers[q] for q in questions if q in numbers}
+            }
+            jobs.extend(submit_bulk_jobs(df.loc[indices], subset_info, max_tokens, temperature, run_id=run_id, **options))
+    return jobs
+
+def carry_forward_results(carried: List[Dict], run_id: str) -> Dict[str, Dict]:
+    """Stored results from plan_incremental_run, keyed like bulk_results so they seed a run's results"""
+    increment_counter('results_carried_forward', len(carried))
+    return {
+        f"carried-{run_id}-{entry['index']}-{entry.get('question_number', '')}-{entry['prompt_version']}": dict(entry, run_id=run_id, carried=True)
+        for entry in carried
+    }
+
+def process_bulk_job_statuses(completed: Iterable[Tuple[Dict[str, Any], Dict[str, Any]]], bulk_results: Dict[str, Dict],
+                              accounting: Dict[str, Dict] = None, results_key: str = None) -> List[Tuple[Dict[str, Any], Exception]]:
+    """Record accounting for (job_info, COMPLETED status) pairs, parse their outputs together and store the results
+
+    completed may be a generator that polls as it goes. Accounting is recorded and each output
+    is cut to its final answer as jobs arrive, so full statuses aren't kept; results are stored
+    in arrival order once everything is parsed. With results_key, bulk_results maps
+    job_info[results_key] (e.g. an A/B variant) to the results dict for that job.
+    Returns (job_info, error) for jobs that failed or whose output could not be parsed.
+    """
+    jobs, answer_texts, errors = [], [], []
+    for job_info, status in completed:
+        try:
+            if accounting is not None:
+                record_job_accounting(accounting, job_info['job_id'], status, bulk_job_questions(job_info), 'bulk',
+                                      job_info.get('run_id', 'bulk'), job_info['interactionid'])
+            answer_texts.append([final_answer_text(text) for text in response_texts(status)])
+            jobs.append(job_info)
+        except Exception as e:
+            errors.append((job_info, e))
+
+    for job_info, (jsons, problems) in zip(jobs, parse_many_outputs(answer_texts)):
+        if jsons:
+            store_bulk_job_results(job_info, jsons, bulk_results[job_info[results_key]] if results_key else bulk_results)
+        else:
+            errors.append((job_info, ValueError("; ".join(problems) or "No JSON found in output")))
+    return errors
+
+def build_bulk_results_df(bulk_results: Dict[str, Dict]) -> pd.DataFrame:
+    """Flatten stored bulk results into one row per (question, interaction)"""
+    with stage_timer('build_results'):
+        return _build_bulk_results_df(bulk_results)
+
+def _build_bulk_results_df(bulk_results: Dict[str, Dict]) -> pd.DataFrame:
+    results_list = []
+    for job_id, result_data in bulk_results.items():
+        result = result_data['result']
+        if result:
+            # Store both rating and explanation with question number
+            row = {
+                'question_number': result_data.get('question_number', ''),
+                'interactionid': result_data['interactionid'],
+                'question': result_data.get('question', result.get('question', result.get('Question', ''))),
+                'rating': result.get('rating', result.get('Rating', result.get('Answer', ''))),
+                'explanation': result.get('explanation', result.get('Explanation', result.get('Justification', '')))
+            }
+            # Self-consistency runs also report how many samples agreed with the majority
+            if 'agreement' in result:
+                row['agreement'] = result['agreement']
+                row['votes'] = ", ".join(f"{rating}: {count}" for rating, count in result['votes'].items())
+            results_list.append(row)
+
+    results_df = pd.DataFrame(results_list)
+    if results_list:
+        # Add combined question label if question_number exists (vectorized; a row-wise apply dominated large runs)
+        numbers = results_df['question_number']
+        labels = "Q" + numbers.astype(str) + ": " + results_df['question'].astype(str)
+        results_df['question_label'] = labels.where(numbers.astype(bool), results_df['question'])
+    return results_df
+
+def pivot_bulk_results(results_df: pd.DataFrame, values: str) -> pd.DataFrame:
+    """Pivot results: questions as rows, interaction IDs as columns"""
+    with stage_timer('pivot'):
+        pivot_df = results_df.pivot_table(
+            index='question_label',
+            columns='interactionid',
+            values=values,
+            aggfunc='first'
+        )
+        return pivot_df.fillna('').reset_index()
+
+def export_bulk_results_excel(results_df: pd.DataFrame, rating_df: pd.DataFrame, transcripts_df: pd.DataFrame = None) -> bytes:
+    """Build the multi-sheet Excel download for bulk results"""
+    buffer = BytesIO()
+    with stage_timer('export'), pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        # Pivoted ratings
+        rating_df.to_excel(writer, sheet_name='Ratings (Pivoted)', index=False)
+
+        # Create pivoted explanations
+        explanation_df = pivot_bulk_results(results_df, 'explanation')
+        explanation_df.to_excel(writer, sheet_name='Explanations (Pivoted)', index=False)
+
+        # Original format
+        results_df.to_excel(writer, sheet_name='Original Format', index=False)
+
+        # Transcripts
+        if transcripts_df is not None:
+            transcripts_df.to_excel(writer, sheet_name='Transcripts', index=False)
+    increment_counter('exports', format='xlsx')
+    return buffer.getvalue()
+
+# GPU time and token accounting
+def new_run_id(kind: str) -> str:
+    """Identifier for one submission run, e.g. bulk-20240101_120000"""
+    return f"{kind}-{time.strftime('%Y%m%d_%H%M%S')}"
+
+def prompt_version(prompt_text: str) -> str:
+    """Short stable hash identifying a prompt version"""
+    return hashlib.sha1(str(prompt_text).encode('utf-8')).hexdigest()[:8]
+
+def transcript_digest(transcript: str) -> str:
+    """Hash kept in job and result records instead of the transcript text itself"""
+    return hashlib.sha1(str(transcript).encode('utf-8')).hexdigest()
+
+def extract_job_usage(status: Dict[str, Any]) -> Dict[str, int]:
+    """Pull queue time, execution time and token usage out of a status response"""
+    usage = {
+        'delay_ms': status.get('delayTime') or 0,
+        'execution_ms': status.get('executionTime') or 0,
+        'input_tokens': 0,
+        'output_tokens': 0
+    }
+    output = status.get('output')
+    if isinstance(output, list):
+        for item in output:
+            item_usage = item.get('usage') if isinstance(item, dict) else None
+            if not isinstance(item_usage, dict):
+                continue
+            # worker-vllm reports input/output; OpenAI-style workers report prompt_tokens/completion_tokens
+            usage['input_tokens'] += item_usage.get('input', item_usage.get('prompt_tokens', 0)) or 0
+            usage['output_tokens'] += item_usage.get('output', item_usage.get('completion_tokens', 0)) or 0
+    return usage
+
+def record_job_accounting(accounting: Dict[str, Dict], job_id: str, status: Dict[str, Any], questions: List[Dict],
+                          kind: str, run_id: str, interactionid: str = ''):
+    """Store per-job queue/execution time and token usage
+
+    questions lists the {question, question_number, prompt_version} entries the job
+    evaluated; multi-prompt jobs share their cost evenly across them.
+    """
+    accounting[job_id] = {
+        'job_id': job_id,
+        'run_id': run_id,
+        'kind': kind,
+        'interactionid': interactionid,
+        'status': status.get('status', ''),
+        'questions': questions,
+        **extract_job_usage(status)
+    }
+
+def bulk_job_questions(job_info: Dict[str, Any]) -> List[Dict]:
+    """Questions (with prompt versions) evaluated by a bulk job"""
+    if 'prompts' in job_info and len(job_info['prompts']) > 0:
+        prompts_with_numbers = job_info.get('prompts_with_numbers', {})
+        return [
+            {
+                'question': question,
+                'question_number': prompts_with_numbers.get(question, {}).get('question_number', ''),
+                'prompt_version': prompt_version(prompts_with_numbers.get(question, {}).get('prompt', question))
+            }
+            for question in job_info['prompts']
+        ]
+    return [{
+        'question': job_info.get('question', '') or 'Single Prompt',
+        'question_number': job_info.get('question_number', ''),
+        'prompt_version': job_info.get('prompt_version', '')
+    }]
+
+def build_accounting_df(accounting: Dict[str, Dict]) -> pd.DataFrame:
+    """One row per (job, question) with the job's cost apportioned across its questions"""
+    rows = []
+    for record in accounting.values():
+        questions = record['questions'] or [{'question': '', 'question_number': '', 'prompt_version': ''}]
+        share = 1 / len(questions)
+        for q in questions:
+            rows.append({
+                'job_id': record['job_id'],
+                'run_id': record['run_id'],
+                'kind': record['kind'],
+                'interactionid': record['interactionid'],
+                'status': record['status'],
+                'question_number': q.get('question_number', ''),
+                'question': q.get('question', ''),
+                'prompt_version': q.get('prompt_version', ''),
+                'queue_s': record['delay_ms'] / 1000 * share,
+                'gpu_s': record['execution_ms'] / 1000 * share,
+                'input_tokens': record['input_tokens'] * share,
+                'output_tokens': record['output_tokens'] * share
+            })
+    return pd.DataFrame(rows)
+
+def summarize_accounting(accounting_df: pd.DataFrame, by: List[str]) -> pd.DataFrame:
+    """Aggregate apportioned cost by the given columns"""
+    summary = accounting_df.groupby(by, dropna=False).agg(
+        jobs=('job_id', 'nunique'),
+        evaluations=('job_id', 'size'),
+        queue_s=('queue_s', 'sum'),
+        gpu_s=('gpu_s', 'sum'),
+        input_tokens=('input_tokens', 'sum'),
+        output_tokens=('output_tokens', 'sum')
+    ).reset_index()
+    summary['gpu_s_per_evaluation'] = summary['gpu_s'] / summary['evaluations']
+    summary['output_tokens_per_evaluation'] = summary['output_tokens'] / summary['evaluations']
+    return summary.sort_values('gpu_s', ascending=False)
+
+def render_accounting_panel(accounting: Dict[str, Dict], key_prefix: str):
+    """Show run totals and per-question / per-prompt-version cost tables"""
+    accounting_df = build_accounting_df(accounting)
+    if accounting_df.empty:
+        st.info("No completed jobs with timing data yet.")
+        return
+
+    jobs = accounting_df['job_id'].nunique()
+    gpu_s = accounting_df['gpu_s'].sum()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("GPU Time", f"{gpu_s / 3600:.2f} h")
+    col2.metric("Queue Time", f"{accounting_df['queue_s'].sum() / 3600:.2f} h")
+    col3.metric("Input Tokens", f"{int(accounting_df['input_tokens'].sum()):,}")
+    col4.metric("Output Tokens", f"{int(accounting_df['output_tokens'].sum()):,}")
+    st.caption(f"{jobs} jobs - {gpu_s / jobs:.1f} GPU-seconds per job, "
+               f"~{gpu_s / jobs * 1000 / 3600:.1f} GPU-hours per 1,000 jobs")
+
+    st.write("**By Run:**")
+    st.dataframe(summarize_accounting(accounting_df, ['run_id']), use_container_width=True)
+    st.write("**By Question:**")
+    st.dataframe(summarize_accounting(accounting_df, ['question_number', 'question']), use_container_width=True)
+    st.write("**By Prompt Version:**")
+    st.dataframe(summarize_accounting(accounting_df, ['prompt_version', 'question']), use_container_width=True)
+
+    st.download_button(
+        label="📥 Download Per-Job Accounting CSV",
+        data=accounting_df.to_csv(index=False).encode('utf-8'),
+        file_name=f"job_accounting_{time.strftime('%Y%m%d_%H%M%S')}.csv",
+        mime="text/csv",
+        key=f"{key_prefix}_accounting_download"
+    )
+
+# Longest-processing-time-first (LPT) ordering: submit the most expensive jobs first so that
+# no long transcript starts last and keeps one worker busy after the others are idle
+DEFAULT_COST_RATES = {'overhead_ms': 500.0, 'input_ms': 0.05, 'output_ms': 25.0}
+DEFAULT_OUTPUT_TOKENS_PER_QUESTION = 400  # Output estimate for prompts without length history
+COST_MIN_SAMPLES = 10  # Finished jobs needed before the rates are fitted instead of defaulted
+COST_SAMPLE_LIMIT = 2000
+
+@st.cache_resource(show_spinner=False)
+def _cost_registry():
+    return threading.Lock(), deque(maxlen=COST_SAMPLE_LIMIT)
+
+_cost_lock, _cost_samples = _cost_registry()
+_cost_samples: deque  # (input tokens, output tokens, execution ms) of finished jobs
+
+def record_cost_sample(status: Dict[str, Any]):
+    usage = extract_job_usage(status)
+    if usage['execution_ms'] and (usage['input_tokens'] or usage['output_tokens']):
+        with _cost_lock:
+            _cost_samples.append((usage['input_tokens'], usage['output_tokens'], usage['execution_ms']))
+
+def job_cost_rates() -> Dict[str, float]:
+    """GPU milliseconds per job, per input token and per output token
+
+    Fitted by least squares to the jobs this process has seen finish; the defaults apply
+    until COST_MIN_SAMPLES jobs are available.
+    """
+    with _cost_lock:
+        samples = np.array(_cost_samples, dtype=float)
+    if len(samples) < COST_MIN_SAMPLES:
+        return dict(DEFAULT_COST_RATES)
+    design = np.column_stack([np.ones(len(samples)), samples[:, 0], samples[:, 1]])
+    coefficients = np.clip(np.linalg.lstsq(design, samples[:, 2], rcond=None)[0], 0, None)
+    return dict(zip(('overhead_ms', 'input_ms', 'output_ms'), coefficients.tolist()))
+
+def estimate_job_costs(transcripts: pd.Series, prompt_text: str, question_prompts: List[str], max_tokens: int, samples: int = 1) -> pd.Series:
+    """Predicted GPU seconds per transcript from transcript and prompt tokens and each question's typical output length"""
+    rates = job_cost_rates()
+    per_question = []
+    for key in output_history_keys(question_prompts):
+        history = output_length_samples(key)
+        per_question.append(float(np.median(history)) if history else DEFAULT_OUTPUT_TOKENS_PER_QUESTION)
+    output_tokens = samples * min(max_tokens, sum(per_question))
+    input_tokens = transcripts.map(transcript_token_count) + transcript_token_count(prompt_text)
+    return (rates['overhead_ms'] + rates['input_ms'] * input_tokens + rates['output_ms'] * output_tokens) / 1000
+
+def simulate_makespan(costs: List[float], workers: int) -> float:
+    """Finish time of the last job when jobs start in the given order, each on the first free worker"""
+    finish = [0.0] * max(1, workers)
+    for cost in costs:
+        heapq.heapreplace(finish, finish[0] + cost)
+    return max(finish)
+
+def scheduling_workers() -> int:
+    """Workers bulk jobs can use: endpoint capacity, less the interactive reserve while scheduling is on"""
+    total = 0
+    for endpoint in RUNPOD_ENDPOINTS:
+        capacity = endpoint_capacity(endpoint, _endpoint_state[endpoint['id']])
+        if _scheduler_config['enabled']:
+            capacity = max(1, int(capacity * (1 - _scheduler_config['reserved_share'])))
+        total += capacity
+    return total
+
+def makespan_report(jobs: List[Dict], accounting: Dict[str, Dict], workers: int) -> Optional[Dict[str, Any]]:
+    """Predicted makespan (as submitted and in file order) against the actual one, for jobs with cost estimates
+
+    Actual finish times are submission time plus RunPod's queue and execution time, so
+    they do not depend on when the app happened to poll.
+    """
+    planned = [job for job in jobs if 'predicted_cost_s' in job]
+    if not planned:
+        return None
+    report = {
+        'jobs': len(planned),
+        'workers': workers,
+        'predicted_s': simulate_makespan([job['predicted_cost_s'] for job in planned], workers),
+        'file_order_s': simulate_makespan([job['predicted_cost_s'] for job in sorted(planned, key=lambda job: job['index'])], workers),
+        'predicted_gpu_s': sum(job['predicted_cost_s'] for job in planned),
+        'finished': 0,
+        'actual_s': None,
+        'actual_gpu_s': None
+    }
+    records = [accounting[job['job_id']] for job in planned if job['job_id'] in accounting]
+    report['finished'] = len(records)
+    if records:
+        report['actual_gpu_s'] = sum(record['execution_ms'] for record in records) / 1000
+    if len(records) == len(planned):
+        start = min(job['submitted_at'] for job in planned)
+        report['actual_s'] = max(
+            job['submitted_at'] + (accounting[job['job_id']]['delay_ms'] + accounting[job['job_id']]['execution_ms']) / 1000
+            for job in planned
+        ) - start
+    return report
+
+def render_makespan_report(bulk_jobs: List[Dict], accounting: Dict[str, Dict]):
+    """Predicted vs actual makespan of the latest bulk run"""
+    if not bulk_jobs:
+        return
+    run_id = bulk_jobs[-1].get('run_id')
+    report = makespan_report([job for job in bulk_jobs if job.get('run_id') == run_id and not job.get('cancelled')],
+                             accounting, scheduling_workers())
+    if report is None:
+        return
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Predicted Makespan", f"{report['predicted_s'] / 60:.1f} min",
+                delta=f"{(report['predicted_s'] - report['file_order_s']) / 60:+.1f} min vs file order", delta_color="inverse")
+    col2.metric("Actual Makespan", f"{report['actual_s'] / 60:.1f} min" if report['actual_s'] is not None else "—")
+    col3.metric("Predicted GPU Time", f"{report['predicted_gpu_s'] / 60:.1f} min")
+    col4.metric("Actual GPU Time", f"{report['actual_gpu_s'] / 60:.1f} min" if report['actual_gpu_s'] is not None else "—")
+    st.caption(f"Run `{run_id}`: {report['finished']}/{report['jobs']} jobs finished · {report['workers']} workers · "
+               "predictions use fitted per-token GPU rates and each prompt's output length history")
+
+# Pilot runs: evaluate a stratified sample first and extrapolate the full run
+DEFAULT_PILOT_SIZE = 50
+BACKGROUND_SUBMIT_BATCH = 25  # Rows submitted per step by the background continuation
+
+@st.cache_resource(show_spinner=False)
+def _background_submission_registry():
+    return threading.Lock()
+
+# Guards every background submission's progress record, which its thread and the session's reruns share
+_background_submission_lock = _background_submission_registry()
+
+def stratified_sample(df: pd.DataFrame, sample_size: int, strata: str = None, seed: int = 42) -> pd.DataFrame:
+    """Random sample with every stratum represented in proportion to its size
+
+    strata names a column to stratify on; by default transcripts are stratified by
+    length quartile so short and long calls are both represented.
+    """
+    if sample_size >= len(df):
+        return df
+    if strata and strata in df.columns:
+        groups = df[strata].fillna('(blank)')
+    else:
+        lengths = df['transcript'].fillna('').astype(str).str.len()
+        groups = pd.qcut(lengths.rank(method='first'), q=min(4, len(df)), labels=False)
+
+    # Shuffle, then keep the first quota rows of each stratum
+    fraction = sample_size / len(df)
+    quota = groups.map(groups.value_counts().mul(fraction).round().clip(lower=1))
+    shuffled = groups.sample(frac=1, random_state=seed)
+    keep = shuffled.groupby(shuffled).cumcount() < quota.loc[shuffled.index]
+    return df.loc[shuffled.index[keep.to_numpy()]].sort_index()
+
+def estimate_full_run(pilot_jobs: List[Dict], accounting: Dict[str, Dict], total_jobs: int) -> Dict[str, Any]:
+    """Extrapolate GPU time and wall-clock time for total_jobs from the completed pilot jobs"""
+    records = [accounting[job['job_id']] for job in pilot_jobs if job['job_id'] in accounting]
+    if not records:
+        return {}
+
+    gpu_s = [r['execution_ms'] / 1000 for r in records]
+    queue_s = [r['delay_ms'] / 1000 for r in records]
+    latency_s = [q + g for q, g in zip(queue_s, gpu_s)]
+
+    # Observed throughput: completed jobs over the span from first submit to last finish
+    by_id = {job['job_id']: job for job in pilot_jobs}
+    start = min(by_id[r['job_id']].get('submitted_at', time.time()) for r in records)
+    finish = max(by_id[r['job_id']].get('submitted_at', start) + latency for r, latency in zip(records, latency_s))
+    span = max(finish - start, 1e-3)
+    throughput = len(records) / span
+
+    mean_gpu = sum(gpu_s) / len(gpu_s)
+    return {
+        'pilot_completed': len(records),
+        'mean_gpu_s': mean_gpu,
+        'mean_queue_s': sum(queue_s) / len(queue_s),
+        'p90_latency_s': sorted(latency_s)[int(0.9 * (len(latency_s) - 1))],
+        'throughput_jobs_per_s': throughput,
+        'parallelism': sum(gpu_s) / span,
+        'est_gpu_hours': mean_gpu * total_jobs / 3600,
+        'est_wall_hours': total_jobs / throughput / 3600,
+        'est_output_tokens': sum(r['output_tokens'] for r in records) / len(records) * total_jobs
+    }
+
+def rating_distribution(results_df: pd.DataFrame) -> pd.DataFrame:
+    """Share of each rating per question"""
+    counts = pd.crosstab(results_df['question_label'], results_df['rating'].astype(str), normalize='index')
+    return (counts * 100).round(1)
+
+def start_background_submission(df: pd.DataFrame, prompts_info: Dict[str, Any], max_tokens: int, temperature: float,
+                                run_id: str, todo: Dict[Any, List[str]] = None, **options) -> Dict[str, Any]:
+    """Submit df in small batches on a background thread
+
+    With todo (from plan_incremental_run), only the listed rows and questions are submitted.
+    Returns a progress record whose 'jobs' list fills as jobs are submitted; the caller
+    moves them into st.session_state.bulk_jobs on each rerun. Rows that fail to submit
+    add a message to 'errors'. Read or change the record only while holding
+    _background_submission_lock.
+    """
+    if todo is not None:
+        df = df.loc[list(todo)]
+    progress = {'jobs': [], 'total': len(df), 'submitted_rows': 0, 'done': False, 'error': None, 'errors': [], 'cancelled': False}
+
+    def run():
+        try:
+            with collect_submit_errors(progress['errors'], _background_submission_lock):
+                for start in range(0, len(df), BACKGROUND_SUBMIT_BATCH):
+                    with _background_submission_lock:
+                        if progress['cancelled']:
+                            break
+                    batch = df.iloc[start:start + BACKGROUND_SUBMIT_BATCH]
+                    if todo is None:
+                        jobs = submit_bulk_jobs(batch, prompts_info, max_tokens, temperature, run_id=run_id, **options)
+                    else:
+                        jobs = submit_planned_bulk_jobs(batch, prompts_info, {idx: todo[idx] for idx in batch.index},
+                                                        max_tokens, temperature, run_id=run_id, **options)
+                    with _background_submission_lock:
+                        progress['jobs'].extend(jobs)
+                        progress['submitted_rows'] += len(batch)
+        except Exception as e:
+            with _background_submission_lock:
+                progress['error'] = str(e)
+        finally:
+            with _background_submission_lock:
+                progress['done'] = True
+
+    threading.Thread(target=run, name=f"bulk-submit-{run_id}", daemon=True).start()
+    return progress
+
+def render_pilot_panel(pilot: Dict[str, Any], bulk_jobs: List[Dict], bulk_results: Dict[str, Dict], accounting: Dict[str, Dict]):
+    """Pilot progress, extrapolated totals and rating distribution"""
+    pilot_jobs = [job for job in bulk_jobs if job['job_id'] in pilot['job_ids']]
+    completed = sum(is_bulk_job_processed(job, bulk_results) for job in pilot_jobs)
+    st.write(f"**Pilot sample:** {len(pilot_jobs)} of {pilot['total_rows']} transcripts "
+             f"(stratified by {pilot['strata'] or 'transcript length'}) - {completed} completed")
+
+    estimate = estimate_full_run(pilot_jobs, accounting, pilot['total_rows'])
+    if not estimate:
+        st.info("Check statuses once some pilot jobs have completed to see the estimate.")
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Est. GPU Time", f"{estimate['est_gpu_hours']:.2f} h")
+    col2.metric("Est. Wall-Clock", f"{estimate['est_wall_hours'] * 60:.0f} min")
+    col3.metric("Throughput", f"{estimate['throughput_jobs_per_s'] * 60:.1f} jobs/min")
+    col4.metric("Est. Output Tokens", f"{estimate['est_output_tokens']:,.0f}")
+    st.caption(f"Based on {estimate['pilot_completed']} completed pilot jobs: {estimate['mean_gpu_s']:.1f} GPU-s and "
+               f"{estimate['mean_queue_s']:.1f} s queue per job, p90 latency {estimate['p90_latency_s']:.1f} s, "
+               f"~{estimate['parallelism']:.1f} jobs running in parallel. Wall-clock assumes the pilot's throughput holds.")
+
+    # Multi-prompt results are keyed '{job_id}_{question index}'
+    pilot_results = {key: value for key, value in bulk_results.items()
+                     if key in pilot['job_ids'] or key.rsplit('_', 1)[0] in pilot['job_ids']}
+    if pilot_results:
+        st.write("**Pilot Rating Distribution (% of transcripts):**")
+        st.dataframe(rating_distribution(build_bulk_results_df(pilot_results)), use_container_width=True)
+
+# A/B prompt comparison: two prompt versions over the same transcripts
+AB_VARIANTS = ('A', 'B')
+
+def prompts_info_from_df(prompts_df: pd.DataFrame) -> Dict[str, Any]:
+    """Multi-prompt bulk_test_prompts record from a prompts file (question_number, question, prompt)"""
+    if 'question_number' not in prompts_df.columns:
+        prompts_df = prompts_df.assign(question_number=range(1, len(prompts_df) + 1))
+    prompts_dict = {}
+    prompts_with_numbers = {}
+    for _, row in prompts_df.iterrows():
+        prompts_dict[row['question']] = row['prompt']
+        prompts_with_numbers[row['question']] = {
+            'prompt': row['prompt'],
+            'question_number': row['question_number']
+        }
+    return {
+        'single': False,
+        'prompts': prompts_dict,
+        'prompts_with_numbers': prompts_with_numbers,
+        'df': prompts_df
+    }
+
+def prompt_versions(prompts_info: Dict[str, Any]) -> Dict[str, str]:
+    """Question -> prompt version for a bulk_test_prompts record"""
+    if prompts_info['single']:
+        return {'Single Prompt': prompt_version(prompts_info['prompt'])}
+    return {question: prompt_version(prompt) for question, prompt in prompts_info['prompts'].items()}
+
+def submit_ab_jobs(df: pd.DataFrame, variants: Dict[str, Dict[str, Any]], result_store: Dict[Tuple, Dict],
+                   max_tokens: int, temperature: float, **options) -> Dict[str, Any]:
+    """Submit both prompt versions over df, interleaved batch by batch so they progress together
+
+    Both versions share preprocessing and token counts (both cached per transcript) and
+    the result store, so evaluations either version already has are carried, not rerun.
+    Questions whose prompt is identical in A and B are only evaluated once, under A.
+    """
+    versions_a = prompt_versions(variants['A'])
+    shared = {question for question, version in prompt_versions(variants['B']).items() if versions_a.get(question) == version}
+    prompts_b = variants['B']
+    if shared and not prompts_b['single']:
+        prompts_b = dict(prompts_b, prompts={q: p for q, p in prompts_b['prompts'].items() if q not in shared})
+    submitted = {'A': variants['A'], 'B': prompts_b}
+    if prompts_b['single'] and shared or not prompts_b['single'] and not prompts_b['prompts']:
+        del submitted['B']
+
+    ab_run = {
+        'run_ids': {variant: new_run_id(f"ab-{variant.lower()}") for variant in variants},
+        'jobs': [],
+        'results': {variant: {} for variant in variants},
+        'shared_questions': shared
+    }
+    for start in range(0, len(df), BACKGROUND_SUBMIT_BATCH):
+        batch = df.iloc[start:start + BACKGROUND_SUBMIT_BATCH]
+        for variant, prompts_info in submitted.items():
+            jobs, carried = submit_incremental_bulk_jobs(
+                batch, prompts_info, result_store, max_tokens, temperature, run_id=ab_run['run_ids'][variant], **options
+            )
+            for job in jobs:
+                job['variant'] = variant
+            ab_run['jobs'].extend(jobs)
+            ab_run['results'][variant].update(carried)
+    return ab_run
+
+def ab_variant_results(ab_run: Dict[str, Any], variant: str) -> Dict[str, Dict]:
+    """A variant's results, with B borrowing A's results for questions whose prompt is unchanged"""
+    results = ab_run['results'][variant]
+    if variant == 'A' or not ab_run['shared_questions']:
+        return results
+    borrowed = {
+        f"shared-{key}": entry for key, entry in ab_run['results']['A'].items()
+        if (entry.get('question') or 'Single Prompt') in ab_run['shared_questions']
+    }
+    return {**results, **borrowed}
+
+def compare_ab_results(results_a: Dict[str, Dict], results_b: Dict[str, Dict]) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """Join A and B ratings per (interaction, question) and summarize agreement
+
+    Questions are matched on question_number when both versions have one, so reworded
+    questions still line up. Returns (merged, summary, confusion matrices by question).
+    """
+    frames = {}
+    for variant, results in zip(AB_VARIANTS, (results_a, results_b)):
+        variant_df = build_bulk_results_df(results)
+        if variant_df.empty:
+            return pd.DataFrame(), pd.DataFrame(), {}
+        variant_df['question_key'] = variant_df['question_number'].astype(str).where(
+            variant_df['question_number'].astype(str) != '', variant_df['question'])
+        frames[variant] = variant_df[['interactionid', 'question_key', 'question_label', 'rating', 'explanation']]
+
+    merged = frames['A'].merge(frames['B'], on=['interactionid', 'question_key'], suffixes=('_a', '_b'))
+    if merged.empty:
+        return merged, pd.DataFrame(), {}
+    merged['rating_a'] = merged['rating_a'].astype(str).str.strip()
+    merged['rating_b'] = merged['rating_b'].astype(str).str.strip()
+    merged['flipped'] = merged['rating_a'].str.lower() != merged['rating_b'].str.lower()
+
+    summary = merged.groupby('question_label_a').agg(
+        compared=('flipped', 'size'),
+        flips=('flipped', 'sum')
+    ).reset_index().rename(columns={'question_label_a': 'question'})
+    summary['flip_rate_%'] = (summary['flips'] / summary['compared'] * 100).round(1)
+    summary['agreement_%'] = 100 - summary['flip_rate_%']
+
+    confusion = {
+        label: pd.crosstab(group['rating_a'], group['rating_b'], rownames=['A'], colnames=['B'])
+        for label, group in merged.groupby('question_label_a')
+    }
+    return merged, summary.sort_values('flip_rate_%', ascending=False), confusion
+
+def export_ab_report_excel(merged: pd.DataFrame, summary: pd.DataFrame, confusion: Dict[str, pd.DataFrame]) -> bytes:
+    """Excel workbook with the agreement summary, every flipped rating and one confusion matrix per question"""
+    with stage_timer('export'):
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            summary.to_excel(writer, sheet_name='Summary', index=False)
+            merged[merged['flipped']].drop(columns=['question_key', 'question_label_b']).to_excel(writer, sheet_name='Flips', index=False)
+            row = 0
+            for label, matrix in confusion.items():
+                pd.DataFrame({label: []}).to_excel(writer, sheet_name='Confusion', startrow=row, index=False)
+                matrix.to_excel(writer, sheet_name='Confusion', startrow=row + 1)
+                row += len(matrix) + 4
+    increment_counter('exports', format='ab_xlsx')
+    return output.getvalue()
+
+# Agreement with human QA labels
+LABEL_COLUMNS = ('interactionid', 'question_number', 'rating')
+# Rating spellings that mean the same thing once case and punctuation are dropped
+RATING_KEY_ALIASES = {'notapplicable': 'na', 'y': 'yes', 'n': 'no', 'true': 'yes', 'false': 'no'}
+
+def _id_text(series: pd.Series) -> pd.Series:
+    """IDs as strings, so 1, 1.0 and '1' from CSV or Excel uploads all match"""
+    return series.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+
+def rating_keys(series: pd.Series) -> pd.Series:
+    """Comparison key for ratings: lower case, letters and digits only, common aliases folded"""
+    keys = series.astype(str).str.lower().str.replace(r'[^a-z0-9]+', '', regex=True)
+    return keys.replace(RATING_KEY_ALIASES)
+
+def rating_options_by_question(prompts_info: Dict[str, Any] = None) -> Dict[str, List[str]]:
+    """Rating Options of each prompt, keyed by question number ('' for a single prompt)"""
+    if not prompts_info:
+        return {}
+    if prompts_info['single']:
+        return {'': parse_rating_options(prompts_info['prompt'])}
+    return {
+        str(info['question_number']): parse_rating_options(info['prompt'])
+        for info in prompts_info.get('prompts_with_numbers', {}).values()
+    }
+
+def normalize_ratings(question_numbers: pd.Series, ratings: pd.Series,
+                      options_by_question: Dict[str, List[str]] = None) -> pd.Series:
+    """Map ratings onto their question's Rating Options (by key), in one vectorized join
+
+    Ratings that match no option, or whose question has none, take the first spelling seen
+    for their key, so 'yes', 'Yes.' and 'YES' still count as one label.
+    """
+    keys = rating_keys(ratings)
+    frame = pd.DataFrame({'question_number': question_numbers.values, 'key': keys.values})
+    options = pd.DataFrame(
+        [(number, option) for number, labels in (options_by_question or {}).items() for option in labels],
+        columns=['question_number', 'option']
+    )
+    options['key'] = rating_keys(options['option'])
+    options = options.drop_duplicates(['question_number', 'key'])
+    canonical = frame.merge(options, on=['question_number', 'key'], how='left')['option']
+
+    first_spelling = ratings.astype(str).str.strip().groupby(keys.values).first()
+    fallback = keys.map(first_spelling)
+    return pd.Series(canonical.values, index=ratings.index).fillna(fallback)
+
+def score_against_labels(results_df: pd.DataFrame, labels_df: pd.DataFrame,
+                         options_by_question: Dict[str, List[str]] = None,
+                         single_question_number: str = None) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """Per-question accuracy, Cohen's kappa and confusion matrices of model ratings vs human labels
+
+    Everything is derived from one groupby over the joined rows. Results without question
+    numbers (single-prompt runs) are scored against the labels for single_question_number
+    only; with no number given nothing matches. Returns (merged rows, summary, confusion
+    matrices by question number with model ratings as rows).
+    """
+    with stage_timer('label_scoring'):
+        model = pd.DataFrame({
+            'interactionid': _id_text(results_df['interactionid']),
+            'question_number': _id_text(results_df['question_number']).replace('nan', ''),
+            'question': results_df['question'].astype(str),
+            'model_rating': results_df['rating'],
+            'explanation': results_df['explanation']
+        })
+        human = pd.DataFrame({
+            'interactionid': _id_text(labels_df['interactionid']),
+            'question_number': _id_text(labels_df['question_number']),
+            'human_rating': labels_df['rating']
+        }).dropna(subset=['human_rating'])
+
+        single_prompt = (model['question_number'] == '').all()
+        if single_prompt:
+            # The one prompt answers one labelled question; labels for the others don't apply
+            single_question_number = '' if single_question_number is None else str(single_question_number)
+            model['question_number'] = single_question_number
+            human = human[human['question_number'] == single_question_number]
+            options_by_question = {single_question_number: (options_by_question or {}).get('', [])}
+        merged = model.merge(human, on=['interactionid', 'question_number'])
+        if merged.empty:
+            return merged, pd.DataFrame(), {}
+
+        merged['model_rating'] = normalize_ratings(merged['question_number'], merged['model_rating'], options_by_question)
+        merged['human_rating'] = normalize_ratings(merged['question_number'], merged['human_rating'], options_by_question)
+        merged['match'] = merged['model_rating'] == merged['human_rating']
+
+        counts = merged.groupby(['question_number', 'model_rating', 'human_rating']).size()
+        totals = counts.groupby(level='question_number').sum()
+        agreed = counts[counts.index.get_level_values('model_rating') == counts.index.get_level_values('human_rating')]
+        observed = agreed.groupby(level='question_number').sum().reindex(totals.index, fill_value=0) / totals
+
+        # Chance agreement: sum over ratings of the product of the two raters' marginal shares
+        model_marginals = counts.groupby(level=['question_number', 'model_rating']).sum()
+        human_marginals = counts.groupby(level=['question_number', 'human_rating']).sum()
+        model_marginals.index.names = human_marginals.index.names = ['question_number', 'rating']
+        chance = (model_marginals * human_marginals).fillna(0).groupby(level='question_number').sum() / totals ** 2
+        kappa = ((observed - chance) / (1 - chance)).where(chance < 1)
+
+        summary = pd.DataFrame({
+            'labelled': totals,
+            'accuracy_%': (observed * 100).round(1),
+            'kappa': kappa.round(3)
+        }).reset_index()
+        labelled_per_question = human.groupby('question_number').size()
+        summary['unmatched_labels'] = (summary['question_number'].map(labelled_per_question) - summary['labelled']).clip(lower=0)
+        questions = merged.drop_duplicates('question_number').set_index('question_number')['question']
+        summary.insert(1, 'question', summary['question_number'].map(questions))
+
+        confusion = {}
+        for number, question_counts in counts.groupby(level='question_number'):
+            matrix = question_counts.droplevel('question_number').unstack(fill_value=0)
+            labels = list(dict.fromkeys(list(matrix.index) + list(matrix.columns)))
+            confusion[number] = matrix.reindex(index=labels, columns=labels, fill_value=0).rename_axis(index='Model', columns='Human')
+
+    increment_counter('labels_scored', len(merged))
+    return merged, summary.sort_values('kappa', na_position='first'), confusion
+
+def export_agreement_report_excel(merged: pd.DataFrame, summary: pd.DataFrame, confusion: Dict[str, pd.DataFrame]) -> bytes:
+    """Excel workbook with per-question agreement, every disagreement and one confusion matrix per question"""
+    with stage_timer('export'):
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            summary.to_excel(writer, sheet_name='Summary', index=False)
+            merged[~merged['match']].drop(columns='match').to_excel(writer, sheet_name='Disagreements', index=False)
+            row = 0
+            for number, matrix in confusion.items():
+                pd.DataFrame({f"Question {number}": []}).to_excel(writer, sheet_name='Confusion', startrow=row, index=False)
+                matrix.to_excel(writer, sheet_name='Confusion', startrow=row + 1)
+                row += len(matrix) + 4
+    increment_counter('exports', format='labels_xlsx')
+    return output.getvalue()
+
+def render_label_agreement(results_df: pd.DataFrame, prompts_info: Dict[str, Any] = None):
+    """Upload human QA labels and score the bulk results against them"""
+    st.subheader("🎯 Agreement with Human Labels")
+    st.markdown("Upload a CSV or Excel file with columns: `interactionid`, `question_number`, `rating`")
+    labels_file = st.file_uploader("Choose a labels file", type=['csv', 'xlsx'], key="bulk_labels_file")
+    if labels_file is None:
+        return
+    try:
+        labels_df = pd.read_csv(labels_file) if labels_file.name.endswith('.csv') else pd.read_excel(labels_file)
+    except Exception as e:
+        st.error(f"Error reading file: {e}")
+        return
+    missing = [column for column in LABEL_COLUMNS if column not in labels_df.columns]
+    if missing:
+        st.error(f"❌ File must have {', '.join(repr(c) for c in LABEL_COLUMNS)} columns (missing {', '.join(missing)})")
+        return
+
+    single_question_number = None
+    if (_id_text(results_df['question_number']).replace('nan', '') == '').all():
+        label_numbers = sorted(_id_text(labels_df['question_number']).unique(), key=lambda n: (len(n), n))
+        single_question_number = st.selectbox(
+            "Labelled question answered by the single prompt", label_numbers, key="labels_single_question",
+            help="Single-prompt results have no question number; only labels for this question are scored"
+        )
+
+    merged, summary, confusion = score_against_labels(results_df, labels_df, rating_options_by_question(prompts_info),
+                                                      single_question_number)
+    if summary.empty:
+        st.warning("No labels match the current results by interaction ID and question number.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Labelled Evaluations", f"{len(merged):,}")
+    col2.metric("Overall Accuracy", f"{merged['match'].mean():.1%}")
+    col3.metric("Mean Kappa", f"{summary['kappa'].mean():.3f}")
+    st.dataframe(summary, use_container_width=True)
+
+    question_number = st.selectbox("Confusion matrix for question", list(confusion), key="labels_confusion_question")
+    st.dataframe(confusion[question_number], use_container_width=True)
+
+    st.download_button(
+        label="📥 Download Agreement Report",
+        data=export_agreement_report_excel(merged, summary, confusion),
+        file_name=f"label_agreement_{time.strftime('%Y%m%d_%H%M%S')}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+# Historical results store: Parquet files partitioned by date and run, read through memory-mapped scans
+RESULTS_STORE_DIR = os.environ.get("AQA_RESULTS_STORE", "results_store")
+RESULTS_STORE_COMPACT_FILES = 32  # A run partition with more files than this is rewritten as one file
+RESULTS_HISTORY_PREVIEW_ROWS = 500
+
+@lru_cache(maxsize=None)
+def results_store_schema() -> pa.Schema:
+    return pa.schema([
+        ('recorded_at', pa.timestamp('s')),
+        ('source', pa.string()),
+        ('question_number', pa.string()),
+        ('interactionid', pa.string()),
+        ('question', pa.string()),
+        ('prompt_version', pa.string()),
+        ('rating', pa.string()),
+        ('explanation', pa.string()),
+        ('agreement', pa.float64())
+    ])
+
+@lru_cache(maxsize=None)
+def results_store_partitioning() -> ds.Partitioning:
+    return ds.partitioning(pa.schema([('date', pa.string()), ('run_id', pa.string())]), flavor='hive')
+
+@st.cache_resource(show_spinner=False)
+def _results_store_lock_resource() -> threading.Lock:
+    return threading.Lock()
+
+_results_store_lock = _results_store_lock_resource()
+
+def result_history_row(result: Dict[str, Any], source: str, question_number: Any = '', interactionid: Any = '',
+                       question: str = '', version: str = '') -> Dict[str, Any]:
+    """One store row from a parsed result JSON"""
+    return {
+        'source': source,
+        'question_number': str(question_number or ''),
+        'interactionid': str(interactionid or ''),
+        'question': question or str(result.get('question', result.get('Question', ''))),
+        'prompt_version': version or '',
+        'rating': str(result.get('rating', result.get('Rating', result.get('Answer', '')))),
+        'explanation': str(result.get('explanation', result.get('Explanation', result.get('Justification', '')))),
+        'agreement': result.get('agreement')
+    }
+
+def append_results_history(rows: List[Dict[str, Any]], run_id: str) -> int:
+    """Append result rows to the run's partition for today, sorted by question number and interaction ID"""
+    if not rows or not RESULTS_STORE_DIR:
+        return 0
+    recorded_at = int(time.time())
+    table = pa.Table.from_pylist([dict(row, recorded_at=recorded_at) for row in rows], schema=results_store_schema())
+    table = table.sort_by([('question_number', 'ascending'), ('interactionid', 'ascending')])
+    partition = os.path.join(RESULTS_STORE_DIR, f"date={time.strftime('%Y-%m-%d')}", f"run_id={run_id}")
+    with stage_timer('history_write'), _results_store_lock:
+        os.makedirs(partition, exist_ok=True)
+        pq.write_table(table, os.path.join(partition, f"part-{uuid.uuid4().hex}.parquet"))
+        compact_results_partition(partition)
+    increment_counter('history_rows_written', len(rows))
+    return len(rows)
+
+def compact_results_partition(partition: str):
+    """Merge a partition's files once repeated appends leave too many small ones (call with _results_store_lock held)"""
+    files = sorted(os.path.join(partition, name) for name in os.listdir(partition) if name.endswith('.parquet'))
+    if len(files) <= RESULTS_STORE_COMPACT_FILES:
+        return
+    table = pa.concat_tables([pq.read_table(path, schema=results_store_schema()) for path in files])
+    table = table.sort_by([('question_number', 'ascending'), ('interactionid', 'ascending')])
+    merged = os.path.join(partition, f"part-{uuid.uuid4().hex}.parquet")
+    pq.write_table(table, merged + '.tmp')
+    os.replace(merged + '.tmp', merged)
+    for path in files:
+        os.remove(path)
+    increment_counter('history_compactions')
+
+def archive_bulk_results(bulk_results: Dict[str, Dict], archived_keys: set, source: str = 'bulk') -> int:
+    """Append bulk results not yet archived this session to the store, grouped by run
+
+    Results carried forward by an incremental run were archived by the run that evaluated them.
+    """
+    by_run: Dict[str, List[Dict]] = {}
+    for key, entry in bulk_results.items():
+        if key in archived_keys or not entry.get('result') or entry.get('carried'):
+            continue
+        by_run.setdefault(entry.get('run_id') or source, []).append(result_history_row(
+            entry['result'], source, entry.get('question_number'), entry['interactionid'],
+            entry.get('question', ''), entry.get('prompt_version', '')
+        ))
+        archived_keys.add(key)
+    return sum(append_results_history(rows, run_id) for run_id, rows in by_run.items())
+
+def results_history_dataset() -> Optional[ds.Dataset]:
+    """Dataset over the whole store, or None while it is empty; files are memory-mapped, not read up front"""
+    if not RESULTS_STORE_DIR or not os.path.isdir(RESULTS_STORE_DIR):
+        return None
+    dataset = ds.dataset(
+        os.path.abspath(RESULTS_STORE_DIR),
+        schema=pa.unify_schemas([results_store_schema(), results_store_partitioning().schema]),
+        format='parquet',
+        partitioning=results_store_partitioning(),
+        filesystem=pafs.LocalFileSystem(use_mmap=True)
+    )
+    return dataset if dataset.files else None
+
+def results_history_filter(start_date: str = None, end_date: str = None, question_numbers: List[str] = None,
+                           sources: List[str] = None, interactionid: str = None) -> Optional[ds.Expression]:
+    """Scan filter; date bounds prune whole partitions before any file is opened"""
+    conditions = []
+    if start_date:
+        conditions.append(ds.field('date') >= start_date)
+    if end_date:
+        conditions.append(ds.field('date') <= end_date)
+    if question_numbers:
+        conditions.append(ds.field('question_number').isin(question_numbers))
+    if sources:
+        conditions.append(ds.field('source').isin(sources))
+    if interactionid:
+        conditions.append(ds.field('interactionid') == interactionid)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def query_results_history(dataset: ds.Dataset, columns: List[str], expression: ds.Expression = None,
+                          limit: int = None) -> pd.DataFrame:
+    """Read only the requested columns of the matching rows (the first `limit` of them if given)"""
+    with stage_timer('history_query'):
+        scanner = dataset.scanner(columns=columns, filter=expression)
+        table = scanner.head(limit) if limit else scanner.to_table()
+        return table.to_pandas()
+
+# Store files are never rewritten in place (appends and compaction create new names), so a
+# dataset's file list identifies its contents and keys the cached scans below.
+@st.cache_data(show_spinner=False, max_entries=16)
+def results_history_values(_dataset: ds.Dataset, files: Tuple[str, ...], column: str) -> List[str]:
+    """Distinct values of one column, for filter widgets, collected batch by batch"""
+    values = set()
+    with stage_timer('history_query'):
+        for batch in _dataset.to_batches(columns=[column]):
+            values.update(pc.unique(batch.column(0)).to_pylist())
+    return sorted(value for value in values if value)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def aggregate_results_history(_dataset: ds.Dataset, files: Tuple[str, ...], by: Tuple[str, ...],
+                              filters: Tuple = ()) -> pd.DataFrame:
+    """Rating counts grouped by the given columns, computed in Arrow on a column-pruned, filtered scan
+
+    `filters` are results_history_filter's arguments, so the cache is keyed on them rather than on an expression.
+    """
+    by = list(by)
+    with stage_timer('history_query'):
+        table = _dataset.to_table(columns=list(dict.fromkeys(by + ['rating'])), filter=results_history_filter(*filters))
+        counts = table.group_by(by + ['rating']).aggregate([([], 'count_all')])
+    return counts.rename_columns(by + ['rating', 'count']).to_pandas()
+
+def rating_trend(counts: pd.DataFrame, rating: str) -> pd.DataFrame:
+    """Share of answers with the given rating per date (rows) and question (columns)"""
+    totals = counts.groupby(['date', 'question_number'])['count'].sum()
+    matching = counts[counts['rating'] == rating].groupby(['date', 'question_number'])['count'].sum()
+    return (matching.reindex(totals.index, fill_value=0) / totals).unstack('question_number').sort_index()
+
+def render_results_history():
+    """Filter, aggregate and trend archived results without loading the whole store"""
+    st.subheader("📚 Results History")
+    dataset = results_history_dataset()
+    if dataset is None:
+        st.info(f"No archived results yet. Parsed results from every run are appended to `{RESULTS_STORE_DIR}`.")
+        return
+
+    files = tuple(sorted(dataset.files))
+    col1, col2, col3 = st.columns(3)
+    default_start = time.strftime('%Y-%m-%d', time.localtime(time.time() - 30 * 86400))
+    start_date = col1.date_input("From", value=pd.Timestamp(default_start), key="history_start")
+    end_date = col2.date_input("To", value=pd.Timestamp.now(), key="history_end")
+    interactionid = col3.text_input("Interaction ID", key="history_interaction").strip()
+    # Listing distinct sources and questions scans the store, so only do it once the user asks to filter by them
+    sources, question_numbers = [], []
+    if st.toggle("Filter by source or question", key="history_filter_values"):
+        fcol1, fcol2 = st.columns([1, 2])
+        sources = fcol1.multiselect("Source", results_history_values(dataset, files, 'source'), key="history_sources")
+        question_numbers = fcol2.multiselect("Questions", results_history_values(dataset, files, 'question_number'),
+                                             key="history_questions")
+
+    filters = (str(start_date), str(end_date), tuple(question_numbers), tuple(sources), interactionid)
+    counts = aggregate_results_history(dataset, files, ('date', 'question_number'), filters)
+    matching_rows = int(counts['count'].sum())
+    st.caption(f"{matching_rows:,} matching results in {len(files)} files")
+    if not matching_rows:
+        return
+
+    distribution = counts.pivot_table(index='question_number', columns='rating', values='count', aggfunc='sum', fill_value=0)
+    st.write("**Rating Distribution by Question:**")
+    st.dataframe(distribution, use_container_width=True)
+
+    ratings = sorted(counts['rating'].unique())
+    trend_rating = st.selectbox("Trend of rating share", ratings, key="history_trend_rating")
+    st.line_chart(rating_trend(counts, trend_rating))
+
+    st.write(f"**Matching Results (first {RESULTS_HISTORY_PREVIEW_ROWS}):**")
+    st.dataframe(
+        query_results_history(
+            dataset,
+            ['date', 'run_id', 'source', 'question_number', 'interactionid', 'rating', 'explanation', 'agreement'],
+            results_history_filter(*filters), RESULTS_HISTORY_PREVIEW_ROWS
+        ),
+        use_container_width=True
+    )
+
+# Memory-bounded session state: large per-session maps keep recently used entries in memory
+# and spill the rest to a per-session SQLite file, paging them back in when they are read
+SESSION_MEMORY_LIMIT_MB = float(os.environ.get("AQA_SESSION_MEMORY_MB", "256"))
+SESSION_SPILL_DIR = os.environ.get("AQA_SESSION_SPILL_DIR", os.path.join(tempfile.gettempdir(), "aqa_session_spill"))
+MANAGED_STATE_KEYS = ('test_results', 'batch_results', 'bulk_results', 'bulk_result_store', 'session_frames')
+SIZE_SAMPLE_ITEMS = 100  # Entries pickled to estimate the size of a large unmanaged list or dict
+
+def estimate_size(value: Any) -> int:
+    """Approximate bytes held by a session value: pickled size, sampled for large containers"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, 'memory_bytes'):  # A SpillDict, possibly built by an earlier rerun's module
+        return value.memory_bytes()
+    if isinstance(value, (list, dict)) and len(value) > SIZE_SAMPLE_ITEMS:
+        sample = list(islice(value.items() if isinstance(value, dict) else value, SIZE_SAMPLE_ITEMS))
+        return estimate_size(sample) * len(value) // SIZE_SAMPLE_ITEMS
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+class SessionStore:
+    """One session's memory budget, shared by all of its SpillDicts
+
+    Entries in memory are tracked in a single LRU across the maps; when their total passes
+    the limit the least recently used ones are pickled into the session's SQLite spill file.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.directory = os.path.join(SESSION_SPILL_DIR, f"session-{uuid.uuid4().hex}")
+        self.lock = threading.RLock()
+        self.lru: OrderedDict = OrderedDict()  # (map name, key) -> bytes, for entries in memory
+        self.hot_bytes = 0
+        self.maps: Dict[str, 'SpillDict'] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        # Remove the spill file when the session (and with it this store) goes away
+        weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.directory, exist_ok=True)
+            # Reruns of one session may run on different threads; self.lock serializes access
+            self._db = sqlite3.connect(os.path.join(self.directory, "spill.sqlite"), check_same_thread=False, isolation_level=None)
+            self._db.execute("CREATE TABLE IF NOT EXISTS spill (map TEXT, key BLOB, value BLOB, PRIMARY KEY (map, key))")
+        return self._db
+
+    def track(self, name: str, key: Any, size: int = None):
+        """Mark an entry as recently used (and set its size when given), then enforce the limit"""
+        with self.lock:
+            if size is not None:
+                self.hot_bytes += size - self.lru.get((name, key), 0)
+                self.lru[(name, key)] = size
+            self.lru.move_to_end((name, key))
+            while self.hot_bytes > self.limit_bytes and len(self.lru) > 1:
+                (spill_name, spill_key), spill_size = self.lru.popitem(last=False)
+                self.hot_bytes -= spill_size
+                self.maps[spill_name]._spill(spill_key)
+                increment_counter('session_spills')
+
+    def untrack(self, name: str, key: Any):
+        with self.lock:
+            self.hot_bytes -= self.lru.pop((name, key), 0)
+
+    def write(self, name: str, key: Any, value: Any) -> int:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO spill VALUES (?, ?, ?)", (name, pickle.dumps(key), blob))
+        return len(blob)
+
+    def read(self, name: str, key: Any, remove: bool = False) -> Any:
+        with self.lock:
+            row = self.db.execute("SELECT value FROM spill WHERE map = ? AND key = ?", (name, pickle.dumps(key))).fetchone()
+            if remove:
+                self.db.execute("DELETE FROM spill WHERE map = ? AND key = ?", (name, pickle.dumps(key)))
+        increment_counter('session_page_ins')
+        return pickle.loads(row[0])
+
+    def read_all(self, name: str):
+        """Yield (key, value) for every spilled entry of a map without paging them in"""
+        with self.lock:
+            rows = self.db.execute("SELECT key, value FROM spill WHERE map = ?", (name,)).fetchall()
+        for key, value in rows:
+            yield pickle.loads(key), pickle.loads(value)
+
+    def delete(self, name: str, key: Any = None):
+        with self.lock:
+            if key is None:
+                self.db.execute("DELETE FROM spill WHERE map = ?", (name,))
+            else:
+                self.db.execute("DELETE FROM spill WHERE map = ? AND key = ?", (name, pickle.dumps(key)))
+
+class SpillDict(MutableMapping):
+    """dict for session state whose cold entries live on disk
+
+    Reading an entry by key pages it back into memory. items() and values() stream spilled
+    entries straight from disk without paging them in, so changes made to those objects
+    are not kept; assign them back by key instead.
+    """
+
+    def __init__(self, store: SessionStore, name: str, initial: Dict = None):
+        self._store = store
+        self._name = name
+        self._hot: Dict[Any, Any] = {}
+        self._spilled: Dict[Any, int] = {}  # key -> pickled bytes on disk
+        store.maps[name] = self
+        for key, value in (initial or {}).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self._hot:
+            self._store.track(self._name, key)
+            return self._hot[key]
+        if key not in self._spilled:
+            raise KeyError(key)
+        value = self._store.read(self._name, key, remove=True)
+        del self._spilled[key]
+        self._hot[key] = value
+        self._store.track(self._name, key, estimate_size(value))
+        return value
+
+    def __setitem__(self, key, value):
+        if self._spilled.pop(key, None) is not None:
+            self._store.delete(self._name, key)
+        self._hot[key] = value
+        self._store.track(self._name, key, estimate_size(value))
+
+    def __delitem__(self, key):
+        if key in self._hot:
+            del self._hot[key]
+            self._store.untrack(self._name, key)
+        elif self._spilled.pop(key, None) is not None:
+            self._store.delete(self._name, key)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._hot or key in self._spilled
+
+    def __iter__(self):
+        return iter(list(self._hot) + list(self._spilled))
+
+    def __len__(self):
+        return len(self._hot) + len(self._spilled)
+
+    def items(self):
+        yield from list(self._hot.items())
+        if self._spilled:
+            yield from self._store.read_all(self._name)
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def clear(self):
+        for key in list(self._hot):
+            self._store.untrack(self._name, key)
+        self._hot.clear()
+        self._spilled.clear()
+        self._store.delete(self._name)
+
+    def _spill(self, key):
+        """Move one entry to disk (called by the store when over its limit)"""
+        self._spilled[key] = self._store.write(self._name, key, self._hot.pop(key))
+
+    def memory_bytes(self) -> int:
+        with self._store.lock:
+            return sum(size for (name, _), size in self._store.lru.items() if name == self._name)
+
+    def usage(self) -> Dict[str, Any]:
+        return {
+            'in_memory': len(self._hot),
+            'in_memory_mb': self.memory_bytes() / 1e6,
+            'on_disk': len(self._spilled),
+            'on_disk_mb': sum(self._spilled.values()) / 1e6
+        }
+
+def session_store() -> SessionStore:
+    if '_session_store' not in st.session_state:
+        st.session_state._session_store = SessionStore(int(SESSION_MEMORY_LIMIT_MB * 1e6))
+    return st.session_state._session_store
+
+def init_managed_state():
+    """Put the large session maps under the session's memory budget
+
+    Called at the start of every rerun, so maps that were reset to a plain dict during the
+    previous rerun are wrapped again with their contents. Each rerun executes a fresh copy of
+    this module, so a map built by an earlier rerun is an instance of an earlier SpillDict class;
+    it is recognized by identity with the store's map, not by isinstance.
+    """
+    store = session_store()
+    for key in MANAGED_STATE_KEYS:
+        value = st.session_state.get(key)
+        if value is not None and store.maps.get(key) is value:
+            continue
+        initial = dict(value.items()) if value else {}
+        previous = store.maps.pop(key, None)
+        if previous is not None:
+            previous.clear()  # Replaced by a plain dict; its spilled entries are no longer reachable
+        st.session_state[key] = SpillDict(store, key, initial)
+
+def session_frame(name: str) -> Optional[pd.DataFrame]:
+    """A DataFrame kept under the session memory budget (paged back in from disk if spilled)"""
+    return st.session_state.session_frames.get(name)
+
+def set_session_frame(name: str, df: pd.DataFrame):
+    st.session_state.session_frames[name] = df
+
+def session_memory_report() -> pd.DataFrame:
+    """Per-key memory use of this session: managed maps in memory and on disk, other keys estimated"""
+    rows = []
+    for key, value in st.session_state.items():
+        if key == '_session_store':
+            continue
+        if value is not None and session_store().maps.get(key) is value:
+            rows.append({'key': key, 'managed': True, **value.usage()})
+        else:
+            rows.append({'key': key, 'managed': False, 'in_memory': len(value) if isinstance(value, (list, dict, pd.DataFrame)) else 1,
+                         'in_memory_mb': estimate_size(value) / 1e6, 'on_disk': 0, 'on_disk_mb': 0.0})
+    return pd.DataFrame(rows).sort_values('in_memory_mb', ascending=False).round(3).reset_index(drop=True)
+
+def shared_resource_stats() -> pd.DataFrame:
+    """Size of each process-wide resource; these should stay flat as sessions are added"""
+    adapter = runpod_client().get_adapter(RUNPOD_BASE_URL)
+    pools = adapter.poolmanager.pools
+    connections = sum(pools[key].num_connections for key in pools.keys())
+    token_cache = _transcript_token_counter().cache_info()
+    with _preprocessing_lock:
+        cleaned = len(_preprocessing_cache)
+    with _endpoint_lock:
+        owned_jobs = len(_job_endpoints)
+        finished_routes = len(_finished_job_endpoints)
+    with _output_history_lock:
+        tracked_jobs = len(_adaptive_jobs)
+        retry_routes = len(_job_retries)
+    with _metrics_lock:
+        timed_jobs = len(_job_submit_times)
+    rows = [
+        {'resource': 'RunPod HTTP connections', 'size': connections, 'limit': HTTP_POOL_SIZE * max(1, len(pools))},
+        {'resource': 'Transcript token counts', 'size': token_cache.currsize, 'limit': token_cache.maxsize},
+        {'resource': 'Cleaned transcripts', 'size': cleaned, 'limit': PREPROCESSING_CACHE_LIMIT},
+        {'resource': 'Job → endpoint routes', 'size': owned_jobs, 'limit': None},
+        {'resource': 'Unfinished job submit times', 'size': timed_jobs, 'limit': None},
+        {'resource': 'Finished job → endpoint routes', 'size': finished_routes, 'limit': FINISHED_JOB_ROUTES_LIMIT},
+        {'resource': 'Adaptive jobs tracked', 'size': tracked_jobs, 'limit': None},
+        {'resource': 'Retried job → latest attempt', 'size': retry_routes, 'limit': JOB_RETRY_ROUTES_LIMIT},
+        {'resource': 'Held bulk jobs', 'size': held_job_count(), 'limit': None},
+        {'resource': 'Held-job tickets (open / finished)', 'size': len(_scheduler_tickets) + len(_resolved_tickets), 'limit': None},
+    ]
+    return pd.DataFrame(rows).astype({'limit': 'Int64'})
+
+def render_shared_resources():
+    st.subheader("🔗 Shared Resources")
+    st.caption("One instance per server process, shared by every session: the RunPod HTTP pool "
+               f"(AQA_HTTP_POOL_SIZE={HTTP_POOL_SIZE} connections per host), the tokenizer, routing state, metrics and caches")
+    st.dataframe(shared_resource_stats(), use_container_width=True, hide_index=True)
+
+def render_session_memory():
+    st.subheader("🧠 Session Memory")
+    report = session_memory_report()
+    store = session_store()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Managed in Memory", f"{store.hot_bytes / 1e6:.1f} MB", help="Results and transcripts under the session limit")
+    col2.metric("Spilled to Disk", f"{report['on_disk_mb'].sum():.1f} MB")
+    col3.metric("Session Total (est.)", f"{report['in_memory_mb'].sum():.1f} MB")
+    st.caption(f"Limit {SESSION_MEMORY_LIMIT_MB:g} MB for managed state (AQA_SESSION_MEMORY_MB); "
+               f"least recently used entries spill to `{store.directory}` and are read back when viewed")
+    st.dataframe(report, use_container_width=True)
+
+def render_diagnostics():
+    """Diagnostics tab: stage latency, counters, shared resources, session memory and rerun profiles"""
+    st.header("🩺 Diagnostics")
+    st.markdown("Per-stage latency and throughput for this server process")
+    
+    snapshot = metrics_snapshot()
+    
+    st.subheader("⏱️ Stage Latency")
+    if snapshot['stages']:
+        stage_df = pd.DataFrame([
+            {'stage': stage, **values} for stage, values in snapshot['stages'].items()
+        ])
+        st.dataframe(stage_df, use_container_width=True)
+    else:
+        st.info("No timings recorded yet. Submit and check some jobs first.")
+    
+    st.subheader("🔢 Counters")
+    if snapshot['counters']:
+        counter_df = pd.DataFrame([
+            {
+                'counter': counter['name'],
+                'labels': ", ".join(f"{k}={v}" for k, v in counter['labels'].items()),
+                'value': counter['value']
+            }
+            for counter in snapshot['counters']
+        ])
+        st.dataframe(counter_df, use_container_width=True)
+    else:
+        st.info("No counters recorded yet.")
+    
+    col1, col2, col3 = st.columns([1, 1, 1])
+    with col1:
+        st.download_button(
+            label="📥 Download OpenMetrics",
+            data=render_openmetrics(),
+            file_name=f"aqa_metrics_{time.strftime('%Y%m%d_%H%M%S')}.prom",
+            mime="text/plain"
+        )
+    with col2:
+        st.download_button(
+            label="📥 Download JSONL Snapshot",
+            data=json.dumps(snapshot) + "\n",
+            file_name=f"aqa_metrics_{time.strftime('%Y%m%d_%H%M%S')}.jsonl",
+            mime="application/json"
+        )
+    with col3:
+        if st.button("♻️ Reset Metrics"):
+            reset_metrics()
+            st.rerun()
+    
+    if METRICS_FILE:
+        st.caption(f"Metrics are written to `{METRICS_FILE}` after each rerun")
+    
+    render_shared_resources()
+    
+    render_session_memory()
+    
+    render_profiles_panel()
+
+@st.fragment(run_every=ENDPOINT_HEALTH_TTL)
+def render_runpod_status():
+    """Endpoint health in the sidebar; refreshed in the background and redrawn on its own, without a full rerun"""
+    for endpoint in RUNPOD_ENDPOINTS:
+        state = refresh_endpoint_health_async(endpoint)
+        label = f" `{endpoint['id']}`" if len(RUNPOD_ENDPOINTS) > 1 else ""
+        if not state['checked_at']:
+            st.info(f"⏳ Checking RunPod endpoint{label}...")
+        elif state['error'] is None:
+            health_data = state['health']
+            st.success(f"✅ RunPod Endpoint Online{label}")
+            
+            # Safely get jobs completed if available
+            try:
+                if isinstance(health_data, dict) and "jobs" in health_data:
+                    completed = health_data.get("jobs", {}).get("completed", "N/A")
+                    st.metric("Jobs Completed", completed)
+                    if len(RUNPOD_ENDPOINTS) > 1:
+                        cap = endpoint['max_concurrency'] or "∞"
+                        st.caption(f"Queue depth {state['queue_depth']} · in flight {state['in_flight']}/{cap} · weight {endpoint['weight']:g}")
+            except:
+                pass  # Ignore if structure is unexpected
+        else:
+            st.error(f"❌ Error checking endpoint{label}: {state['error']}")
+
+# Main Streamlit app
+def main():
+    """Run one rerun of the app, profiled section by section when profiling is on"""
+    profile = start_rerun_profile() if PROFILE_RERUNS or st.session_state.get('profile_reruns') else None
+    try:
+        render_app(profile)
+    finally:
+        finish_rerun_profile(profile)
+
+def render_app(profile: Optional[Dict[str, Any]] = None):
+    # Page configuration (kept inside main so the module can be imported by benchmark.py)
+    st.set_page_config(
+        page_title="AQA Prompt Builder",
+        page_icon="🔨",
+        layout="wide"
+    )
+
+    st.title("🔨 AQA Prompt Builder")
+    st.markdown("Build, test, and refine prompts for AQA evaluation")
+    
+    # Per-job GPU time and token usage for this session
+    if 'job_accounting' not in st.session_state:
+        st.session_state.job_accounting = {}
+    
+    # Results and uploaded transcripts live under the session memory budget
+    init_managed_state()
+    
+    # Sidebar for configuration
+    with st.sidebar, profile_section(profile, 'sidebar'):
+        st.header("Configuration")
+        max_tokens = st.number_input("Max Tokens", min_value=1000, max_value=32768, value=32768)
+        temperature = st.slider("Temperature", min_value=0.0, max_value=2.0, value=0.4, step=0.1)
+        
+        st.header("Long Transcripts")
+        chunking_enabled = st.checkbox(
+            "Chunk long transcripts (map-reduce)",
+            value=False,
+            help="Split transcripts longer than the chunk size on Agent:/Customer: turns, evaluate the parts in parallel, then merge them with a reduce job"
+        )
+        chunk_tokens = st.number_input("Chunk Size (tokens)", min_value=1000, max_value=100000, value=8000, step=1000, disabled=not chunking_enabled)
+        chunk_overlap = st.number_input("Chunk Overlap (tokens)", min_value=0, max_value=5000, value=400, step=100, disabled=not chunking_enabled)
+        chunking = {'max_chunk_tokens': chunk_tokens, 'overlap_tokens': chunk_overlap} if chunking_enabled else None
+        
+        adaptive_enabled = st.checkbox(
+            "Adaptive max tokens",
+            value=False,
+            help="Set each prompt's max_tokens from a high percentile of its past output lengths plus headroom (Max Tokens becomes the ceiling). Truncated jobs are retried automatically with a larger budget."
+        )
+        adaptive = None
+        if adaptive_enabled:
+            adaptive_percentile = st.slider("Output Length Percentile", min_value=50, max_value=100, value=DEFAULT_ADAPTIVE_TOKENS['percentile'])
+            adaptive_headroom = st.slider("Headroom (%)", min_value=0, max_value=200, value=int(DEFAULT_ADAPTIVE_TOKENS['headroom'] * 100), step=5)
+            adaptive = dict(DEFAULT_ADAPTIVE_TOKENS, percentile=adaptive_percentile, headroom=adaptive_headroom / 100)
+            with _output_history_lock:
+                history_sizes = [len(lengths) for lengths in _load_output_history().values()]
+            st.caption(f"Output length history: {len(history_sizes)} prompts, "
+                       f"{sum(n >= adaptive['min_samples'] for n in history_sizes)} with enough samples")
+        
+        st.header("Structured Output")
+        structured_enabled = st.checkbox(
+            "Guided JSON decoding",
+            value=False,
+            help="Send a JSON schema (rating limited to the prompt's Rating Options), stop sequences and a reasoning cap so answers are shorter and parse on the first try"
+        )
+        reasoning_tokens = st.number_input("Reasoning Cap (tokens)", min_value=0, max_value=32768,
+                                           value=DEFAULT_STRUCTURED_OUTPUT['reasoning_tokens'], step=256, disabled=not structured_enabled)
+        explanation_chars = st.number_input("Max Explanation Length (chars)", min_value=100, max_value=10000,
+                                            value=DEFAULT_STRUCTURED_OUTPUT['explanation_chars'], step=100, disabled=not structured_enabled)
+        structured = {'reasoning_tokens': reasoning_tokens, 'explanation_chars': explanation_chars} if structured_enabled else None
+        
+        st.header("Self-Consistency")
+        samples = st.number_input(
+            "Samples per Job", min_value=1, max_value=MAX_CONSISTENCY_SAMPLES, value=1,
+            help="Ask for this many completions of each prompt in a single job (sampling n) and report the majority rating with its agreement. The transcript prefill is shared, so extra samples only cost output tokens. 1 turns this off."
+        )
+        if samples > 1 and temperature == 0:
+            st.warning("Samples only differ with a temperature above 0")
+        
+        st.header("Transcript Preprocessing")
+        preprocessing_enabled = st.checkbox(
+            "Clean transcripts before submission",
+            value=False,
+            help="Strip timestamps, system lines and redundant whitespace to cut input tokens. Each transcript is cleaned once and reused for every question."
+        )
+        preprocessing = None
+        if preprocessing_enabled:
+            with st.expander("Preprocessing Steps"):
+                preprocessing = {
+                    'normalize_whitespace': st.checkbox("Normalize whitespace", value=DEFAULT_PREPROCESSING['normalize_whitespace']),
+                    'strip_timestamps': st.checkbox("Strip timestamps", value=DEFAULT_PREPROCESSING['strip_timestamps']),
+                    'strip_boilerplate': st.checkbox("Remove system/boilerplate lines", value=DEFAULT_PREPROCESSING['strip_boilerplate']),
+                    'collapse_speakers': st.checkbox("Collapse speaker labels", value=DEFAULT_PREPROCESSING['collapse_speakers'],
+                                                     help="Normalize labels to Agent:/Customer: and merge consecutive turns by the same speaker"),
+                    'remove_fillers': st.checkbox("Remove filler words (um, uh)", value=DEFAULT_PREPROCESSING['remove_fillers']),
+                }
+                extra_patterns = st.text_area(
+                    "Extra patterns to remove (one regex per line)",
+                    value="",
+                    height=80
+                )
+                patterns = []
+                for line in extra_patterns.splitlines():
+                    if not line.strip():
+                        continue
+                    try:
+                        re.compile(line)
+                        patterns.append(line)
+                    except re.error as e:
+                        st.warning(f"Ignoring invalid pattern `{line}`: {e}")
+                preprocessing['extra_patterns'] = patterns
+        
+        st.header("Completion Webhooks")
+        if WEBHOOKS_ENABLED:
+            try:
+                start_webhook_receiver()
+                with _webhook_lock:
+                    waiting, delivered = len(_webhook_jobs), len(_webhook_statuses)
+                st.caption(f"Receiving on port {_webhook_receiver['server'].server_address[1]} · {waiting} jobs awaiting callbacks · {delivered} delivered, not yet read")
+            except (OSError, ValueError) as e:
+                st.error(f"Could not start webhook receiver: {e}")
+        else:
+            st.caption(f"Off: job status is polled. Set AQA_WEBHOOKS=1, AQA_WEBHOOK_PUBLIC_URL (an address RunPod can reach) and AQA_WEBHOOK_SECRET to have RunPod POST final statuses to an embedded receiver, "
+                       f"with jobs whose callback is missed polled every {WEBHOOK_FALLBACK_POLL_INTERVAL:.0f}s.")
+
+        st.header("Transport")
+        if _transport_config['compress']:
+            st.caption(f"Gzipping every /run body of {COMPRESSION_MIN_BYTES} bytes or more (level {COMPRESSION_LEVEL})")
+        else:
+            st.caption("Off: /run bodies are sent as plain JSON. Set AQA_COMPRESS_REQUESTS=1 to gzip them, which shrinks long transcripts "
+                       "and multi-question prompts several-fold and cuts upload time on large bulk runs.")
+        totals = transport_totals()
+        if totals['request_bytes_sent']:
+            saved = 1 - totals['request_bytes_sent'] / totals['request_bytes_json']
+            st.caption(f"Sent {totals['request_bytes_sent'] / 1e6:,.1f} MB for {totals['request_bytes_json'] / 1e6:,.1f} MB of JSON ({saved:.0%} smaller)")
+        if _compression_rejected:
+            st.caption(f"Sending uncompressed to {', '.join(sorted(_compression_rejected))} (compressed bodies rejected)")
+
+        st.header("Priority Scheduling")
+        if _scheduler_config['enabled']:
+            st.caption(f"Bulk jobs are held back while endpoints are busy; {_scheduler_config['reserved_share']:.0%} of each endpoint's concurrency is reserved for Test Prompt, Batch Evaluation and prompt generation")
+        else:
+            st.caption("Off: bulk jobs go straight to RunPod. Set AQA_PRIORITY_SCHEDULING=1 (and AQA_RESERVED_SHARE) to hold them back so interactive jobs never queue behind a bulk run.")
+        held = held_job_count()
+        if held:
+            st.caption(f"{held} bulk jobs held locally")
+        longest_first = st.checkbox(
+            "Submit longest jobs first",
+            value=True,
+            help="Order Bulk Testing submissions by estimated GPU time (transcript and prompt tokens, plus the prompt's past output length), longest first, so a cluster of long transcripts cannot finish last on a single worker"
+        )
         
+        st.header("Profiling")
+        st.checkbox(
+            "Profile reruns",
+            value=PROFILE_RERUNS,
+            key="profile_reruns",
+            help=f"cProfile every rerun section by section (sidebar, health check, each tab). Hot spots and per-section wall time appear in the Diagnostics tab; profiles are saved under {PROFILE_DIR}/ for offline analysis."
+        )
+    
+    # RunPod health check (profiled separately from the rest of the sidebar; never blocks the first render)
+    with st.sidebar, profile_section(profile, 'health_check'):
         st.header("RunPod Status")
-        try:
-            response_health = requests.get(f'https://api.runpod.ai/v2/{RUNPOD_ENDPOINT_ID}/health', headers=HEADERS)
-            if response_health.status_code == 200:
-                health_data = response_health.json()
-                st.success("✅ RunPod Endpoint Online")
-                
-                # Safely get jobs completed if available
-                try:
-                    if isinstance(health_data, dict) and "jobs" in health_data:
-                        completed = health_data.get("jobs", {}).get("completed", "N/A")
-                        st.metric("Jobs Completed", completed)
-                except:
-                    pass  # Ignore if structure is unexpected
-        except Exception as e:
-            st.error(f"❌ Error checking endpoint: {e}")
+        render_runpod_status()
 
     # Create tabs for different sections
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📝 Build Prompt", "🚀 Test Prompt", "📊 Results", "📋 Batch Evaluation", "📦 Bulk Testing"])
+    # Tabs track the selected tab (switching reruns the app) so hidden tabs can skip expensive work.
+    # Streamlit drops the value of any widget a rerun skips (uploaded files included), so the prompt,
+    # transcript and upload inputs render in every tab; result panels, file parsing and the run
+    # options that depend on a parsed file are gated on `.open`.
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
+        ["📝 Build Prompt", "🚀 Test Prompt", "📊 Results", "📋 Batch Evaluation", "📦 Bulk Testing", "🩺 Diagnostics"],
+        key="active_tab",
+        on_change="rerun"
+    )
     
     # Tab 1: Build Prompt
-    with tab1:
+    with tab1, profile_section(profile, 'build_prompt'):
         st.header("Build Your Evaluation Prompt")
         st.markdown("Enter your inputs below and RunPod will generate a comprehensive prompt based on the template")
         
@@ -335,6 +3757,11 @@ def main():
                     
                     if status.get('status') == 'COMPLETED':
                         st.success("✅ Prompt generated successfully!")
+                        record_job_accounting(
+                            st.session_state.job_accounting, job_id, status,
+                            [{'question': st.session_state.prompt_gen_question, 'question_number': '', 'prompt_version': 'generator'}],
+                            'prompt_generation', 'build'
+                        )
                         
                         # Extract and display the generated prompt
                         try:
@@ -408,7 +3835,7 @@ def main():
                 st.info("👆 Fill in the inputs on the left and click 'Generate Prompt via RunPod' to create a prompt")
     
     # Tab 2: Test Prompt
-    with tab2:
+    with tab2, profile_section(profile, 'test_prompt'):
         st.header("Test Your Prompt on Transcripts")
         
         # Check if prompt exists
@@ -452,121 +3879,167 @@ def main():
             elif 'current_test_prompt' not in st.session_state:
                 st.error("Please build or enter a prompt")
             else:
+                if preprocessing:
+                    cleaned_transcript = preprocess_transcript(transcript, preprocessing)
+                    with st.expander("🧹 Preprocessed Transcript"):
+                        render_token_savings(measure_token_savings(pd.Series([transcript]), pd.Series([cleaned_transcript])))
+                        st.text(cleaned_transcript)
+                    transcript = cleaned_transcript
+                
                 with st.spinner("Submitting job to RunPod..."):
-                    job_id = submit_job(transcript, st.session_state.current_test_prompt, max_tokens, temperature)
+                    job_id, chunked = submit_evaluation(transcript, st.session_state.current_test_prompt, max_tokens, temperature, chunking, structured, adaptive, samples)
                     
                 if job_id:
                     st.success(f"✅ Job submitted successfully!")
                     st.info(f"Job ID: `{job_id}`")
+                    if chunked:
+                        st.info(f"✂️ Long transcript split into {len(chunked['chunk_job_ids'])} chunks")
+                        if 'chunked_jobs' not in st.session_state:
+                            st.session_state.chunked_jobs = {}
+                        st.session_state.chunked_jobs[job_id] = chunked
                     
                     # Store job ID in session state
                     if 'test_job_ids' not in st.session_state:
                         st.session_state.test_job_ids = []
                     st.session_state.test_job_ids.append(job_id)
+                    if 'test_job_versions' not in st.session_state:
+                        st.session_state.test_job_versions = {}
+                    st.session_state.test_job_versions[job_id] = prompt_version(st.session_state.current_test_prompt)
                     st.session_state.current_test_job = job_id
                     st.session_state.test_job_status = "SUBMITTED"
                 else:
                     st.error("Failed to submit job")
     
-    # Tab 3: Results
-    with tab3:
-        st.header("View Results")
-        
-        # Check for pending job
-        if 'current_test_job' in st.session_state:
-            job_id = st.session_state.current_test_job
+    # Tab 3: Results, rendered only while it is the selected tab (the results history scans the Parquet store)
+    if tab3.open:
+        with tab3, profile_section(profile, 'results'):
+            st.header("View Results")
             
-            if st.button("🔄 Check Status"):
-                with st.spinner("Checking job status..."):
-                    status = check_job_status(job_id)
-                    
-                if status.get('status') == 'COMPLETED':
-                    st.success("✅ Job completed!")
-                    
-                    # Extract and display results
-                    try:
-                        tokens = status.get('output')[0].get('choices')[0].get('tokens')[0]
-                        jsons = extract_jsons_from_response(tokens)
+            # Check for pending job
+            if 'current_test_job' in st.session_state:
+                job_id = st.session_state.current_test_job
+                
+                if st.button("🔄 Check Status"):
+                    with st.spinner("Checking job status..."):
+                        status = check_evaluation_status(job_id, st.session_state.get('chunked_jobs', {}).get(job_id))
                         
-                        if jsons:
-                            st.subheader("📋 Results")
-                            
-                            # Store results
-                            if 'test_results' not in st.session_state:
-                                st.session_state.test_results = {}
-                            st.session_state.test_results[job_id] = jsons
-                            
-                            # Display results
-                            for i, result in enumerate(jsons):
-                                st.write(f"**Result {i+1}:**")
-                                st.json(result)
-                            
-                            # Download results
-                            results_json = json.dumps(jsons, indent=2)
-                            st.download_button(
-                                label="📥 Download Results as JSON",
-                                data=results_json,
-                                file_name=f"prompt_test_results_{job_id}.json",
-                                mime="application/json"
-                            )
+                    if status.get('status') == 'COMPLETED':
+                        st.success("✅ Job completed!")
+                        record_job_accounting(
+                            st.session_state.job_accounting, job_id, status,
+                            [{
+                                'question': st.session_state.get('question', ''),
+                                'question_number': '',
+                                'prompt_version': st.session_state.get('test_job_versions', {}).get(job_id, '')
+                            }],
+                            'test', 'test'
+                        )
+                        usage = extract_job_usage(status)
+                        col1, col2, col3, col4 = st.columns(4)
+                        col1.metric("Queue Time", f"{usage['delay_ms'] / 1000:.1f} s")
+                        col2.metric("GPU Time", f"{usage['execution_ms'] / 1000:.1f} s")
+                        col3.metric("Input Tokens", f"{usage['input_tokens']:,}")
+                        col4.metric("Output Tokens", f"{usage['output_tokens']:,}")
+                        
+                        # Extract and display results
+                        try:
+                            jsons = parse_evaluation_output(status)
                             
-                            # Clear current job
-                            if 'current_test_job' in st.session_state:
-                                del st.session_state.current_test_job
-                        else:
-                            st.error("No valid JSON results found in response")
+                            if jsons:
+                                st.subheader("📋 Results")
+                                
+                                # Store results
+                                if 'test_results' not in st.session_state:
+                                    st.session_state.test_results = {}
+                                if job_id not in st.session_state.test_results:
+                                    append_results_history(
+                                        [result_history_row(result, 'test', version=st.session_state.get('test_job_versions', {}).get(job_id, ''))
+                                         for result in jsons],
+                                        'test'
+                                    )
+                                st.session_state.test_results[job_id] = jsons
+                                
+                                # Display results
+                                for i, result in enumerate(jsons):
+                                    st.write(f"**Result {i+1}:**")
+                                    st.json(result)
+                                
+                                # Download results
+                                results_json = json.dumps(jsons, indent=2)
+                                st.download_button(
+                                    label="📥 Download Results as JSON",
+                                    data=results_json,
+                                    file_name=f"prompt_test_results_{job_id}.json",
+                                    mime="application/json"
+                                )
+                                
+                                # Clear current job
+                                if 'current_test_job' in st.session_state:
+                                    del st.session_state.current_test_job
+                            else:
+                                st.error("No valid JSON results found in response")
+                                
+                        except Exception as e:
+                            st.error(f"Error processing results: {e}")
                             
-                    except Exception as e:
-                        st.error(f"Error processing results: {e}")
-                        
-                elif status.get('status') == 'IN_PROGRESS':
-                    st.info("⏳ Job is still in progress...")
-                elif status.get('status') == 'FAILED':
-                    st.error("❌ Job failed")
-                    if 'error' in status:
-                        st.error(f"Error: {status['error']}")
+                    elif status.get('status') == 'IN_PROGRESS':
+                        st.info("⏳ Job is still in progress...")
+                        if 'chunks_total' in status:
+                            st.caption(f"Chunks evaluated: {status['chunks_completed']}/{status['chunks_total']}")
+                    elif status.get('status') == 'FAILED':
+                        st.error("❌ Job failed")
+                        if 'error' in status:
+                            st.error(f"Error: {status['error']}")
+                    else:
+                        st.warning(f"Job status: {status.get('status', 'Unknown')}")
                 else:
-                    st.warning(f"Job status: {status.get('status', 'Unknown')}")
-            else:
-                st.info(f"📝 Job ID: `{job_id}` - Click 'Check Status' to view results")
-        
-        # Show stored results
-        if 'test_results' in st.session_state and st.session_state.test_results:
-            st.subheader("📊 Stored Results")
+                    st.info(f"📝 Job ID: `{job_id}` - Click 'Check Status' to view results")
             
-            for job_id, results in st.session_state.test_results.items():
-                with st.expander(f"📄 Results for Job {job_id[:8]}... ({len(results)} results)"):
-                    for i, result in enumerate(results):
-                        st.write(f"**Result {i+1}:**")
-                        st.json(result)
-                    
-                    # Download individual results
-                    results_json = json.dumps(results, indent=2)
-                    st.download_button(
-                        label=f"📥 Download These Results",
-                        data=results_json,
-                        file_name=f"results_{job_id}.json",
-                        mime="application/json",
-                        key=f"download_{job_id}"
-                    )
-        
-        # Job history
-        if 'test_job_ids' in st.session_state and st.session_state.test_job_ids:
-            st.subheader("📚 Job History")
-            for i, job_id in enumerate(reversed(st.session_state.test_job_ids)):
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    st.code(job_id)
-                with col2:
-                    if st.button(f"Check", key=f"check_{i}"):
-                        st.session_state.current_test_job = job_id
-                        st.rerun()
-        
-        if 'current_test_job' not in st.session_state and 'test_job_ids' not in st.session_state:
-            st.info("👆 No tests yet. Build a prompt and test it in the 'Test Prompt' tab")
+            # Show stored results
+            if 'test_results' in st.session_state and st.session_state.test_results:
+                st.subheader("📊 Stored Results")
+                
+                for job_id, results in st.session_state.test_results.items():
+                    with st.expander(f"📄 Results for Job {job_id[:8]}... ({len(results)} results)"):
+                        for i, result in enumerate(results):
+                            st.write(f"**Result {i+1}:**")
+                            st.json(result)
+                        
+                        # Download individual results
+                        results_json = json.dumps(results, indent=2)
+                        st.download_button(
+                            label=f"📥 Download These Results",
+                            data=results_json,
+                            file_name=f"results_{job_id}.json",
+                            mime="application/json",
+                            key=f"download_{job_id}"
+                        )
+            
+            # Job history
+            if 'test_job_ids' in st.session_state and st.session_state.test_job_ids:
+                st.subheader("📚 Job History")
+                for i, job_id in enumerate(reversed(st.session_state.test_job_ids)):
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        st.code(job_id)
+                    with col2:
+                        if st.button(f"Check", key=f"check_{i}"):
+                            st.session_state.current_test_job = job_id
+                            st.rerun()
+            
+            if 'current_test_job' not in st.session_state and 'test_job_ids' not in st.session_state:
+                st.info("👆 No tests yet. Build a prompt and test it in the 'Test Prompt' tab")
+            
+            # Usage across every job checked this session
+            if st.session_state.job_accounting:
+                with st.expander("💰 GPU Time & Token Usage (this session)"):
+                    render_accounting_panel(st.session_state.job_accounting, 'results')
+            
+            st.divider()
+            render_results_history()
     
     # Tab 4: Batch Evaluation
-    with tab4:
+    with tab4, profile_section(profile, 'batch'):
         st.header("📋 Batch Evaluation - Multiple Questions")
         st.markdown("Evaluate multiple questions on the same transcript")
         
@@ -668,150 +4141,197 @@ def main():
                     st.session_state.batch_transcript = batch_transcript
                     st.session_state.batch_waiting_for_prompts = True
         
-        # Show prompt generation status
-        if 'batch_prompt_gen_jobs' in st.session_state and st.session_state.batch_prompt_gen_jobs:
-            st.subheader("📝 Prompt Generation Status")
-            
-            all_prompts_generated = True
-            generated_prompts = []
-            
-            for i, job_info in enumerate(st.session_state.batch_prompt_gen_jobs):
-                with st.expander(f"Question {job_info['question_num']}: {job_info['question'][:50]}...", expanded=True):
-                    st.write(f"**Prompt Generation Job ID:** `{job_info['prompt_gen_job_id']}`")
-                    
-                    # Check status
-                    if st.button(f"🔄 Check Prompt Status", key=f"check_prompt_gen_{i}"):
-                        with st.spinner("Checking status..."):
-                            status = check_job_status(job_info['prompt_gen_job_id'])
-                        
-                        if status.get('status') == 'COMPLETED':
-                            st.success("✅ Prompt generated!")
-                            try:
-                                response_text = status.get('output')[0].get('choices')[0].get('tokens')[0]
-                                generated_prompt = extract_generated_prompt_from_response(response_text)
-                                
-                                job_info['generated_prompt'] = generated_prompt
-                                job_info['prompt_completed'] = True
-                                
-                            except Exception as e:
-                                st.error(f"Error extracting prompt: {e}")
-                                
-                        elif status.get('status') == 'IN_PROGRESS':
-                            st.info("⏳ Still generating...")
-                        elif status.get('status') == 'FAILED':
-                            st.error(f"❌ Failed: {status.get('error', 'Unknown error')}")
-            
-            # Check if all prompts are generated
-            all_complete = all(job.get('prompt_completed', False) for job in st.session_state.batch_prompt_gen_jobs)
-            
-            if all_complete:
-                st.success("✅ All prompts generated! Ready to test.")
+        # Job panels only while the tab is selected; their buttons keep no state across reruns
+        if tab4.open:
+            # Show prompt generation status
+            if 'batch_prompt_gen_jobs' in st.session_state and st.session_state.batch_prompt_gen_jobs:
+                st.subheader("📝 Prompt Generation Status")
                 
-                # Now test all prompts on transcript
-                if st.button("🧪 Test All Prompts on Transcript"):
-                    with st.spinner("Step 2/2: Testing prompts on transcript..."):
-                        job_ids = []
-                        
-                        for job_info in st.session_state.batch_prompt_gen_jobs:
-                            if 'generated_prompt' in job_info:
-                                # Submit test job
-                                test_job_id = submit_job(
-                                    st.session_state.batch_transcript, 
-                                    job_info['generated_prompt'], 
-                                    max_tokens, 
-                                    temperature
-                                )
-                                
-                                if test_job_id:
-                                    job_ids.append({
-                                        'question_num': job_info['question_num'],
-                                        'question': job_info['question'],
-                                        'job_id': test_job_id
-                                    })
+                all_prompts_generated = True
+                generated_prompts = []
+                
+                for i, job_info in enumerate(st.session_state.batch_prompt_gen_jobs):
+                    with st.expander(f"Question {job_info['question_num']}: {job_info['question'][:50]}...", expanded=True):
+                        st.write(f"**Prompt Generation Job ID:** `{job_info['prompt_gen_job_id']}`")
                         
-                        if job_ids:
-                            st.success(f"✅ Submitted {len(job_ids)} evaluation jobs!")
-                            
-                            # Store evaluation job IDs
-                            if 'batch_jobs' not in st.session_state:
-                                st.session_state.batch_jobs = []
-                            
-                            for job_info in job_ids:
-                                st.session_state.batch_jobs.append(job_info)
-                            
-                            # Clear prompt generation tracking
-                            if 'batch_prompt_gen_jobs' in st.session_state:
-                                del st.session_state.batch_prompt_gen_jobs
-                            if 'batch_waiting_for_prompts' in st.session_state:
-                                del st.session_state.batch_waiting_for_prompts
-        
-        # Display batch results section
-        st.header("📊 Batch Results")
-        
-        if 'batch_jobs' in st.session_state and st.session_state.batch_jobs:
-            for i, job_info in enumerate(st.session_state.batch_jobs):
-                with st.expander(f"📋 Question {job_info['question_num']}: {job_info['question'][:50]}...", expanded=(i == 0)):
-                    st.write(f"**Job ID:** `{job_info['job_id']}`")
-                    
-                    col1, col2 = st.columns([1, 5])
-                    with col1:
-                        if st.button(f"🔄 Check Status", key=f"batch_check_{i}"):
+                        # Check status
+                        if st.button(f"🔄 Check Prompt Status", key=f"check_prompt_gen_{i}"):
                             with st.spinner("Checking status..."):
-                                status = check_job_status(job_info['job_id'])
+                                status = check_job_status(job_info['prompt_gen_job_id'])
                             
                             if status.get('status') == 'COMPLETED':
-                                st.success("✅ Completed!")
-                                
+                                st.success("✅ Prompt generated!")
                                 try:
                                     response_text = status.get('output')[0].get('choices')[0].get('tokens')[0]
-                                    jsons = extract_jsons_from_response(response_text)
+                                    generated_prompt = extract_generated_prompt_from_response(response_text)
+                                    
+                                    job_info['generated_prompt'] = generated_prompt
+                                    job_info['prompt_completed'] = True
                                     
-                                    if jsons:
-                                        for result in jsons:
-                                            st.json(result)
-                                        
-                                        # Store result
-                                        if 'batch_results' not in st.session_state:
-                                            st.session_state.batch_results = {}
-                                        st.session_state.batch_results[job_info['job_id']] = jsons
-                                        
-                                    else:
-                                        st.error("No valid JSON found in response")
-                                        
                                 except Exception as e:
-                                    st.error(f"Error: {e}")
-                                    st.text(response_text[:500] if 'response_text' in locals() else "No response")
-                            
+                                    st.error(f"Error extracting prompt: {e}")
+                                    
                             elif status.get('status') == 'IN_PROGRESS':
-                                st.info("⏳ Still processing...")
+                                st.info("⏳ Still generating...")
                             elif status.get('status') == 'FAILED':
                                 st.error(f"❌ Failed: {status.get('error', 'Unknown error')}")
+                
+                # Check if all prompts are generated
+                all_complete = all(job.get('prompt_completed', False) for job in st.session_state.batch_prompt_gen_jobs)
+                
+                if all_complete:
+                    st.success("✅ All prompts generated! Ready to test.")
                     
-                    # Show stored results if available
-                    if 'batch_results' in st.session_state and job_info['job_id'] in st.session_state.batch_results:
-                        st.write("**Result:**")
-                        for result in st.session_state.batch_results[job_info['job_id']]:
-                            st.json(result)
-                    
-                    with col2:
-                        if st.button(f"🗑️ Remove", key=f"batch_remove_{i}"):
-                            st.session_state.batch_jobs.pop(i)
-                            st.rerun()
+                    # Now test all prompts on transcript
+                    if st.button("🧪 Test All Prompts on Transcript"):
+                        with st.spinner("Step 2/2: Testing prompts on transcript..."):
+                            job_ids = []
+                            
+                            # Clean the transcript once; every prompt reuses it
+                            batch_transcript_to_send = st.session_state.batch_transcript
+                            if preprocessing:
+                                batch_transcript_to_send = preprocess_transcript(batch_transcript_to_send, preprocessing)
+                                render_token_savings(
+                                    measure_token_savings(pd.Series([st.session_state.batch_transcript]), pd.Series([batch_transcript_to_send])),
+                                    questions_per_transcript=len(st.session_state.batch_prompt_gen_jobs)
+                                )
+                            
+                            for job_info in st.session_state.batch_prompt_gen_jobs:
+                                if 'generated_prompt' in job_info:
+                                    # Submit test job
+                                    test_job_id, chunked = submit_evaluation(
+                                        batch_transcript_to_send, 
+                                        job_info['generated_prompt'], 
+                                        max_tokens, 
+                                        temperature,
+                                        chunking,
+                                        structured,
+                                        adaptive,
+                                        samples
+                                    )
+                                    
+                                    if test_job_id:
+                                        job_ids.append({
+                                            'question_num': job_info['question_num'],
+                                            'question': job_info['question'],
+                                            'job_id': test_job_id,
+                                            'prompt_version': prompt_version(job_info['generated_prompt']),
+                                            'chunked': chunked
+                                        })
+                            
+                            if job_ids:
+                                st.success(f"✅ Submitted {len(job_ids)} evaluation jobs!")
+                                
+                                # Store evaluation job IDs
+                                if 'batch_jobs' not in st.session_state:
+                                    st.session_state.batch_jobs = []
+                                
+                                for job_info in job_ids:
+                                    st.session_state.batch_jobs.append(job_info)
+                                
+                                # Clear prompt generation tracking
+                                if 'batch_prompt_gen_jobs' in st.session_state:
+                                    del st.session_state.batch_prompt_gen_jobs
+                                if 'batch_waiting_for_prompts' in st.session_state:
+                                    del st.session_state.batch_waiting_for_prompts
             
-            # Download all results
-            if 'batch_results' in st.session_state and st.session_state.batch_results:
-                all_results_json = json.dumps(st.session_state.batch_results, indent=2)
-                st.download_button(
-                    label="📥 Download All Batch Results",
-                    data=all_results_json,
-                    file_name=f"batch_results_{time.strftime('%Y%m%d_%H%M%S')}.json",
-                    mime="application/json"
-                )
-        else:
-            st.info("👆 Fill in the questions and transcript above, then click 'Generate & Test All'")
+            # Display batch results section
+            st.header("📊 Batch Results")
+            
+            if 'batch_jobs' in st.session_state and st.session_state.batch_jobs:
+                batch_pending = [
+                    job_info for job_info in st.session_state.batch_jobs
+                    if job_info['job_id'] not in st.session_state.get('batch_results', {}) and not job_info.get('cancelled')
+                ]
+                if batch_pending and st.button(f"⛔ Cancel All Pending ({len(batch_pending)})", key="batch_cancel_all"):
+                    with st.spinner("Cancelling jobs..."):
+                        cancelled = cancel_evaluation_jobs(batch_pending)
+                    st.success(f"Cancelled {cancelled} of {len(batch_pending)} pending jobs")
+                
+                for i, job_info in enumerate(st.session_state.batch_jobs):
+                    with st.expander(f"📋 Question {job_info['question_num']}: {job_info['question'][:50]}...", expanded=(i == 0)):
+                        st.write(f"**Job ID:** `{job_info['job_id']}`")
+                        if job_info.get('cancelled'):
+                            st.warning("🚫 Cancelled")
+                        
+                        col1, col2 = st.columns([1, 5])
+                        with col1:
+                            if st.button(f"🔄 Check Status", key=f"batch_check_{i}", disabled=job_info.get('cancelled', False)):
+                                with st.spinner("Checking status..."):
+                                    status = check_evaluation_status(job_info['job_id'], job_info.get('chunked'))
+                                
+                                if status.get('status') == 'COMPLETED':
+                                    st.success("✅ Completed!")
+                                    record_job_accounting(
+                                        st.session_state.job_accounting, job_info['job_id'], status,
+                                        [{
+                                            'question': job_info['question'],
+                                            'question_number': job_info['question_num'],
+                                            'prompt_version': job_info.get('prompt_version', '')
+                                        }],
+                                        'batch', 'batch'
+                                    )
+                                    
+                                    try:
+                                        response_text = response_texts(status)[0]
+                                        jsons = parse_evaluation_output(status)
+                                        
+                                        if jsons:
+                                            for result in jsons:
+                                                st.json(result)
+                                            
+                                            # Store result
+                                            if 'batch_results' not in st.session_state:
+                                                st.session_state.batch_results = {}
+                                            if job_info['job_id'] not in st.session_state.batch_results:
+                                                append_results_history(
+                                                    [result_history_row(result, 'batch', job_info['question_num'], question=job_info['question'],
+                                                                        version=job_info.get('prompt_version', ''))
+                                                     for result in jsons],
+                                                    'batch'
+                                                )
+                                            st.session_state.batch_results[job_info['job_id']] = jsons
+                                            
+                                        else:
+                                            st.error("No valid JSON found in response")
+                                            
+                                    except Exception as e:
+                                        st.error(f"Error: {e}")
+                                        st.text(response_text[:500] if 'response_text' in locals() else "No response")
+                                
+                                elif status.get('status') == 'IN_PROGRESS':
+                                    st.info("⏳ Still processing...")
+                                elif status.get('status') == 'FAILED':
+                                    st.error(f"❌ Failed: {status.get('error', 'Unknown error')}")
+                        
+                        # Show stored results if available
+                        if 'batch_results' in st.session_state and job_info['job_id'] in st.session_state.batch_results:
+                            st.write("**Result:**")
+                            for result in st.session_state.batch_results[job_info['job_id']]:
+                                st.json(result)
+                        
+                        with col2:
+                            if st.button(f"🗑️ Remove", key=f"batch_remove_{i}"):
+                                # Stop the job on RunPod too if it has not finished
+                                if job_info['job_id'] not in st.session_state.get('batch_results', {}) and not job_info.get('cancelled'):
+                                    cancel_evaluation_jobs([job_info])
+                                st.session_state.batch_jobs.pop(i)
+                                st.rerun()
+                
+                # Download all results
+                if 'batch_results' in st.session_state and st.session_state.batch_results:
+                    all_results_json = json.dumps(dict(st.session_state.batch_results.items()), indent=2)
+                    st.download_button(
+                        label="📥 Download All Batch Results",
+                        data=all_results_json,
+                        file_name=f"batch_results_{time.strftime('%Y%m%d_%H%M%S')}.json",
+                        mime="application/json"
+                    )
+            else:
+                st.info("👆 Fill in the questions and transcript above, then click 'Generate & Test All'")
     
     # Tab 5: Bulk Testing
-    with tab5:
+    with tab5, profile_section(profile, 'bulk'):
         st.header("📦 Bulk Testing - Multiple Transcripts")
         st.markdown("Upload multiple transcripts and test them against your generated prompts")
         
@@ -851,7 +4371,7 @@ def main():
                 key="bulk_prompts_file"
             )
             
-            if prompts_file is not None:
+            if prompts_file is not None and tab5.open:
                 try:
                     if prompts_file.name.endswith('.csv'):
                         prompts_df = pd.read_csv(prompts_file)
@@ -874,21 +4394,7 @@ def main():
                         st.dataframe(prompts_df.head(), use_container_width=True)
                         
                         # Store in session state with question numbers
-                        prompts_dict = {}
-                        prompts_with_numbers = {}
-                        for _, row in prompts_df.iterrows():
-                            prompts_dict[row['question']] = row['prompt']
-                            prompts_with_numbers[row['question']] = {
-                                'prompt': row['prompt'],
-                                'question_number': row['question_number']
-                            }
-                        
-                        st.session_state.bulk_test_prompts = {
-                            'single': False,
-                            'prompts': prompts_dict,
-                            'prompts_with_numbers': prompts_with_numbers,
-                            'df': prompts_df
-                        }
+                        st.session_state.bulk_test_prompts = prompts_info_from_df(prompts_df)
                 
                 except Exception as e:
                     st.error(f"Error reading file: {e}")
@@ -916,7 +4422,7 @@ def main():
             key="bulk_file_upload"
         )
         
-        if uploaded_file is not None:
+        if uploaded_file is not None and tab5.open:
             try:
                 # Read the file
                 if uploaded_file.name.endswith('.csv'):
@@ -935,7 +4441,63 @@ def main():
                     st.dataframe(df.head(), use_container_width=True)
                     
                     # Store in session state
-                    st.session_state.bulk_transcripts_df = df
+                    set_session_frame('bulk_transcripts_df', df)
+                    
+                    if preprocessing:
+                        with st.expander("🧹 Preprocessing Token Savings", expanded=True):
+                            # Cleaning and tokenizing the whole file is slow, so only redo it for a new file or options
+                            preview_key = (uploaded_file.file_id, preprocessing_options_key(preprocessing))
+                            preview = st.session_state.get('bulk_preprocessing_preview')
+                            if preview is None or preview['key'] != preview_key:
+                                with st.spinner("Cleaning transcripts..."):
+                                    cleaned_transcripts = preprocess_transcripts(df['transcript'], preprocessing)
+                                    preview = {
+                                        'key': preview_key,
+                                        'savings': measure_token_savings(df['transcript'], cleaned_transcripts),
+                                        'sample': cleaned_transcripts.iloc[0][:2000]
+                                    }
+                                st.session_state.bulk_preprocessing_preview = preview
+                            bulk_prompts = st.session_state.get('bulk_test_prompts')
+                            render_token_savings(preview['savings'])
+                            if bulk_prompts and not bulk_prompts['single']:
+                                st.caption("Multi-prompt mode sends each transcript once with all questions.")
+                            st.text(preview['sample'])
+                    
+                    # Pilot run on a stratified sample before committing the whole file
+                    pilot_enabled = st.checkbox(
+                        "🧪 Pilot run first",
+                        value=False,
+                        help="Evaluate a stratified sample ahead of everything else, estimate GPU time, wall-clock time and the rating distribution for the full file, then continue with the remaining rows in the background"
+                    )
+                    if pilot_enabled:
+                        pcol1, pcol2 = st.columns(2)
+                        with pcol1:
+                            pilot_size = st.number_input("Pilot Sample Size", min_value=1, max_value=len(df), value=min(DEFAULT_PILOT_SIZE, len(df)))
+                        with pcol2:
+                            strata_columns = [c for c in df.columns if c not in ('interactionid', 'transcript')]
+                            pilot_strata = st.selectbox("Stratify By", ["Transcript length"] + strata_columns)
+                    
+                    # Only re-evaluate questions whose prompt changed since earlier runs
+                    incremental = False
+                    result_store = st.session_state.get('bulk_result_store')
+                    if result_store and st.session_state.get('bulk_test_prompts'):
+                        # Diffing every transcript against the store is slow for big files, so only redo it
+                        # for a new file, changed prompts or newly remembered results
+                        plan_key = (uploaded_file.file_id, tuple(prompt_versions(st.session_state.bulk_test_prompts).items()),
+                                    st.session_state.get('bulk_result_store_revision', 0))
+                        plan = st.session_state.get('bulk_incremental_plan')
+                        if plan is None or plan['key'] != plan_key:
+                            todo, carried = plan_incremental_run(df, st.session_state.bulk_test_prompts, result_store)
+                            plan = {'key': plan_key, 'carried': len(carried), 'pairs': sum(len(q) for q in todo.values()), 'rows': len(todo)}
+                            st.session_state.bulk_incremental_plan = plan
+                        incremental = st.checkbox(
+                            "♻️ Only evaluate changed or new prompts",
+                            value=True,
+                            help="Results are remembered per (interaction, question, prompt). Unchanged ones are carried forward into this run's results and export instead of being resubmitted."
+                        )
+                        if incremental:
+                            st.caption(f"{plan['carried']} evaluations unchanged and carried forward; "
+                                       f"{plan['pairs']} to evaluate across {plan['rows']} transcripts.")
                     
                     # Submit button
                     col1, col2 = st.columns([1, 4])
@@ -946,307 +4508,450 @@ def main():
                                 st.error("Please enter or generate prompts first")
                             else:
                                 prompts_info = st.session_state.bulk_test_prompts
+                                submit_options = {'chunking': chunking, 'preprocessing': preprocessing, 'structured': structured, 'adaptive': adaptive,
+                                                  'samples': samples, 'longest_first': longest_first}
+                                run_id = new_run_id('bulk')
+                                submit_df = df
+                                priority = PRIORITY_BULK
+                                if pilot_enabled:
+                                    strata = None if pilot_strata == "Transcript length" else pilot_strata
+                                    submit_df = stratified_sample(df, pilot_size, strata)
+                                    # The user is waiting on the sample, so it skips the bulk queue; the continuation does not
+                                    priority = PRIORITY_INTERACTIVE
+                                total_jobs = len(submit_df)
                                 
                                 if prompts_info['single']:
-                                    # Single prompt - test against all transcripts
-                                    total_jobs = len(df)
-                                    with st.spinner(f"Submitting {total_jobs} jobs to RunPod..."):
-                                        bulk_job_ids = []
-                                        
-                                        for idx, row in df.iterrows():
-                                            interaction_id = row['interactionid']
-                                            transcript = row['transcript']
-                                            
-                                            job_id = submit_job(
-                                                transcript,
-                                                prompts_info['prompt'],
-                                                max_tokens,
-                                                temperature
-                                            )
-                                            
-                                            if job_id:
-                                                bulk_job_ids.append({
-                                                    'interactionid': interaction_id,
-                                                    'transcript': transcript,
-                                                    'job_id': job_id,
-                                                    'index': idx,
-                                                    'prompt': 'Single Prompt',
-                                                    'question': ''
-                                                })
-                                        
-                                        if bulk_job_ids:
-                                            st.success(f"✅ Submitted {len(bulk_job_ids)} jobs!")
-                                            
-                                            # Store in session state
-                                            if 'bulk_jobs' not in st.session_state:
-                                                st.session_state.bulk_jobs = []
-                                            
-                                            st.session_state.bulk_jobs.extend(bulk_job_ids)
-                                
+                                    spinner_text = f"Submitting {total_jobs} jobs to RunPod..."
                                 else:
-                                    # Multiple prompts - send ALL prompts in ONE request per transcript
-                                    prompts_dict = prompts_info['prompts']
-                                    prompts_with_numbers = prompts_info.get('prompts_with_numbers', {})
-                                    
-                                    # Build combined prompt with all questions
-                                    questions_list = []
-                                    for q_idx, (question, prompt_text) in enumerate(prompts_dict.items(), 1):
-                                        question_num = prompts_with_numbers.get(question, {}).get('question_number', q_idx)
-                                        questions_list.append(f"Question {question_num}: {question}")
-                                    
-                                    combined_prompt = f"""Please evaluate the following {len(prompts_dict)} questions based on the transcript provided.
-
-QUESTIONS TO EVALUATE:
-{chr(10).join(questions_list)}
-
-For each question, please provide your answer in the JSON format below. Return an array of JSON objects, one for each question.
-""" + "\n\n".join([prompt_text for prompt_text in prompts_dict.values()])
+                                    spinner_text = f"Submitting {total_jobs} jobs to RunPod (1 per transcript with all prompts)..."
+                                
+                                with st.spinner(spinner_text):
+                                    if incremental:
+                                        # The new run replaces the current view, so stop the jobs it would drop
+                                        previous_jobs = list(st.session_state.get('bulk_jobs', []))
+                                        previous_pilot = st.session_state.get('bulk_pilot')
+                                        if previous_pilot and previous_pilot['continuation']:
+                                            with _background_submission_lock:
+                                                previous_pilot['continuation']['cancelled'] = True
+                                                previous_jobs += previous_pilot['continuation']['jobs'][previous_pilot['synced']:]
+                                        processed_ids = processed_bulk_job_ids(st.session_state.get('bulk_results', {}))
+                                        dropped = [job for job in previous_jobs if job['job_id'] not in processed_ids and not job.get('cancelled')]
+                                        if dropped:
+                                            cancelled = cancel_evaluation_jobs(dropped)
+                                            st.info(f"Cancelled {cancelled} of {len(dropped)} jobs still pending from the previous run")
+                                        bulk_job_ids, carried_results = submit_incremental_bulk_jobs(
+                                            submit_df, prompts_info, result_store, max_tokens, temperature, run_id=run_id,
+                                            priority=priority, **submit_options
+                                        )
+                                        # The rerun replaces the current view: carried results plus the new jobs
+                                        st.session_state.bulk_results = carried_results
+                                        st.session_state.bulk_jobs = []
+                                        if not bulk_job_ids:
+                                            st.success(f"✅ Nothing changed - all {len(carried_results)} results carried forward")
+                                    else:
+                                        bulk_job_ids = submit_bulk_jobs(submit_df, prompts_info, max_tokens, temperature, run_id=run_id,
+                                                                        priority=priority, **submit_options)
                                     
-                                    total_jobs = len(df)
-                                    with st.spinner(f"Submitting {total_jobs} jobs to RunPod (1 per transcript with all prompts)..."):
-                                        bulk_job_ids = []
+                                    if bulk_job_ids:
+                                        st.success(f"✅ Submitted {len(bulk_job_ids)} jobs!")
                                         
-                                        for idx, row in df.iterrows():
-                                            interaction_id = row['interactionid']
-                                            transcript = row['transcript']
-                                            
-                                            # Single job per transcript with all prompts
-                                            job_id = submit_job(
-                                                transcript,
-                                                combined_prompt,
-                                                max_tokens,
-                                                temperature
-                                            )
-                                            
-                                            if job_id:
-                                                bulk_job_ids.append({
-                                                    'interactionid': interaction_id,
-                                                    'transcript': transcript,
-                                                    'job_id': job_id,
-                                                    'index': idx,
-                                                    'prompts': list(prompts_dict.keys()),  # Store all questions
-                                                    'prompts_with_numbers': prompts_with_numbers
-                                                })
+                                        if pilot_enabled:
+                                            st.session_state.bulk_pilot = {
+                                                'run_id': run_id,
+                                                'job_ids': {job['job_id'] for job in bulk_job_ids},
+                                                'total_rows': len(df),
+                                                'strata': strata,
+                                                'remaining': df.drop(index=submit_df.index),
+                                                'prompts_info': prompts_info,
+                                                'max_tokens': max_tokens,
+                                                'temperature': temperature,
+                                                'options': submit_options,
+                                                'incremental': incremental,
+                                                'continuation': None,
+                                                'synced': 0
+                                            }
                                         
-                                        if bulk_job_ids:
-                                            st.success(f"✅ Submitted {len(bulk_job_ids)} jobs!")
-                                            
-                                            # Store in session state
-                                            if 'bulk_jobs' not in st.session_state:
-                                                st.session_state.bulk_jobs = []
-                                            
-                                            st.session_state.bulk_jobs.extend(bulk_job_ids)
+                                        # Store in session state
+                                        if 'bulk_jobs' not in st.session_state:
+                                            st.session_state.bulk_jobs = []
+                                        
+                                        st.session_state.bulk_jobs.extend(bulk_job_ids)
             
             except Exception as e:
                 st.error(f"Error reading file: {e}")
         
-        # Bulk results section
-        st.subheader("📊 Bulk Results")
-        
-        if 'bulk_jobs' in st.session_state and st.session_state.bulk_jobs:
-            st.write(f"**Total jobs submitted:** {len(st.session_state.bulk_jobs)}")
+        if tab5.open:
+            # Bulk results section
+            st.subheader("📊 Bulk Results")
             
-            # Store results
-            if 'bulk_results' not in st.session_state:
-                st.session_state.bulk_results = {}
+            # Pick up jobs submitted by the background continuation of a pilot run
+            pilot = st.session_state.get('bulk_pilot')
+            if pilot and pilot['continuation']:
+                progress = pilot['continuation']
+                with _background_submission_lock:
+                    new_jobs = progress['jobs'][pilot['synced']:]
+                pilot['synced'] += len(new_jobs)
+                st.session_state.bulk_jobs.extend(new_jobs)
             
-            # Progress tracking
-            completed = len(st.session_state.bulk_results)
-            total = len(st.session_state.bulk_jobs)
-            
-            st.metric("Progress", f"{completed}/{total} completed", f"{int(completed/total*100) if total > 0 else 0}%")
-            
-            # Check status for all jobs
-            if st.button("🔄 Check All Statuses"):
-                with st.spinner("Checking job statuses..."):
-                    for job_info in st.session_state.bulk_jobs:
-                        # Check if this job is already processed
-                        if 'prompts' in job_info and len(job_info['prompts']) > 0:
-                            # Multi-prompt mode: check if any result exists for this job
-                            processed = any(key.startswith(f"{job_info['job_id']}_") for key in st.session_state.bulk_results.keys())
-                            should_process = not processed
-                        else:
-                            # Single prompt mode: check if job_id exists
-                            should_process = job_info['job_id'] not in st.session_state.bulk_results
-                        
-                        if should_process:
-                            status = check_job_status(job_info['job_id'])
-                            
-                            if status.get('status') == 'COMPLETED':
-                                try:
-                                    response_text = status.get('output')[0].get('choices')[0].get('tokens')[0]
-                                    jsons = extract_jsons_from_response(response_text)
-                                    
-                                    if jsons:
-                                        # Check if this job has multiple prompts (bulk multi-prompt mode)
-                                        if 'prompts' in job_info and len(job_info['prompts']) > 0:
-                                            # Process multiple responses for multiple prompts
-                                            prompts_list = job_info['prompts']
-                                            prompts_with_numbers = job_info.get('prompts_with_numbers', {})
-                                            
-                                            # Store each result separately
-                                            for i, json_result in enumerate(jsons):
-                                                if i < len(prompts_list):
-                                                    question = prompts_list[i]
-                                                    question_number = prompts_with_numbers.get(question, {}).get('question_number', '')
-                                                    
-                                                    st.session_state.bulk_results[f"{job_info['job_id']}_{i}"] = {
-                                                        'interactionid': job_info['interactionid'],
-                                                        'transcript': job_info['transcript'],
-                                                        'result': json_result,
-                                                        'index': job_info['index'],
-                                                        'question': question,
-                                                        'question_number': question_number,
-                                                        'prompt': 'Multi-Prompt'
-                                                    }
-                                        else:
-                                            # Single prompt mode
-                                            st.session_state.bulk_results[job_info['job_id']] = {
-                                                'interactionid': job_info['interactionid'],
-                                                'transcript': job_info['transcript'],
-                                                'result': jsons[0] if jsons else None,
-                                                'index': job_info['index'],
-                                                'question': job_info.get('question', ''),
-                                                'question_number': job_info.get('question_number', ''),
-                                                'prompt': job_info.get('prompt', '')
-                                            }
-                                except Exception as e:
-                                    st.error(f"Error processing {job_info['interactionid']}: {e}")
-                            elif status.get('status') == 'IN_PROGRESS':
-                                pass  # Don't show message for every IN_PROGRESS
-                            elif status.get('status') == 'FAILED':
-                                st.error(f"❌ {job_info['interactionid']} - Failed")
+            if pilot:
+                with st.expander("🧪 Pilot Run", expanded=pilot['continuation'] is None):
+                    render_pilot_panel(pilot, st.session_state.get('bulk_jobs', []),
+                                       st.session_state.get('bulk_results', {}), st.session_state.job_accounting)
                     
-                st.rerun()  # Rerun after checking all jobs
+                    progress = pilot['continuation']
+                    if progress is None:
+                        if len(pilot['remaining']) and st.button(f"▶️ Continue with remaining {len(pilot['remaining'])} transcripts"):
+                            todo = None
+                            if pilot['incremental']:
+                                # Like the pilot, carry unchanged results forward and submit only the rest
+                                todo, carried = plan_incremental_run(pilot['remaining'], pilot['prompts_info'],
+                                                                     st.session_state.get('bulk_result_store', {}))
+                                st.session_state.setdefault('bulk_results', {}).update(carry_forward_results(carried, pilot['run_id']))
+                            pilot['continuation'] = start_background_submission(
+                                pilot['remaining'], pilot['prompts_info'], pilot['max_tokens'], pilot['temperature'],
+                                pilot['run_id'], todo=todo, **pilot['options']
+                            )
+                            st.rerun()
+                    else:
+                        with _background_submission_lock:
+                            submitted_rows, done, error = progress['submitted_rows'], progress['done'], progress['error']
+                            errors = list(progress['errors'])
+                        st.progress(submitted_rows / progress['total'] if progress['total'] else 1.0,
+                                    text=f"Background submission: {submitted_rows}/{progress['total']} rows")
+                        if errors:
+                            with st.expander(f"⚠️ {len(errors)} submission(s) failed"):
+                                for message in errors:
+                                    st.error(message)
+                        if error:
+                            st.error(f"Background submission stopped: {error}")
+                        elif not done:
+                            bcol1, bcol2 = st.columns(2)
+                            with bcol1:
+                                if st.button("🔄 Refresh Submission Progress"):
+                                    st.rerun()
+                            with bcol2:
+                                if st.button("⏹️ Stop Submitting"):
+                                    with _background_submission_lock:
+                                        progress['cancelled'] = True
+                                    st.rerun()
             
-            # Display results
-            if st.session_state.bulk_results:
-                # Convert to DataFrame for download (pivoted format)
-                results_list = []
-                for job_id, result_data in st.session_state.bulk_results.items():
-                    result = result_data['result']
-                    if result:
-                        # Store both rating and explanation with question number
-                        results_list.append({
-                            'question_number': result_data.get('question_number', ''),
-                            'interactionid': result_data['interactionid'],
-                            'question': result_data.get('question', result.get('question', result.get('Question', ''))),
-                            'rating': result.get('rating', result.get('Rating', result.get('Answer', ''))),
-                            'explanation': result.get('explanation', result.get('Explanation', result.get('Justification', '')))
-                        })
+            if st.session_state.get('bulk_jobs') or st.session_state.get('bulk_results'):
+                if 'bulk_jobs' not in st.session_state:
+                    st.session_state.bulk_jobs = []
+                st.write(f"**Total jobs submitted:** {len(st.session_state.bulk_jobs)}")
                 
-                if results_list:
-                    # Create original DataFrame
-                    results_df = pd.DataFrame(results_list)
-                    
-                    st.write("**Results (Original Format):**")
-                    st.dataframe(results_df, use_container_width=True)
-                    
-                    # Pivot the data: Questions as rows, InteractionIDs as columns
-                    try:
-                        # Add combined question label if question_number exists
-                        if 'question_number' in results_df.columns:
-                            results_df['question_label'] = results_df.apply(
-                                lambda row: f"Q{row['question_number']}: {row['question']}" if row['question_number'] else row['question'], 
-                                axis=1
-                            )
-                        else:
-                            results_df['question_label'] = results_df['question']
+                # Store results
+                if 'bulk_results' not in st.session_state:
+                    st.session_state.bulk_results = {}
+                
+                # Progress tracking (results carried forward from earlier runs have no job)
+                carried_count = sum(key.startswith('carried-') for key in st.session_state.bulk_results)
+                completed = len(st.session_state.bulk_results) - carried_count
+                total = len(st.session_state.bulk_jobs)
+                
+                st.metric("Progress", f"{completed}/{total} completed", f"{int(completed/total*100) if total > 0 else 0}%")
+                if carried_count:
+                    st.caption(f"♻️ {carried_count} unchanged results carried forward from earlier runs")
+                
+                # Cancel pending jobs so abandoned work stops holding workers
+                processed_ids = processed_bulk_job_ids(st.session_state.bulk_results)
+                bulk_pending = [job for job in st.session_state.bulk_jobs if job['job_id'] not in processed_ids and not job.get('cancelled')]
+                cancelled_count = sum(bool(job.get('cancelled')) for job in st.session_state.bulk_jobs)
+                if cancelled_count:
+                    st.caption(f"🚫 {cancelled_count} jobs cancelled")
+                if bulk_pending:
+                    ccol1, ccol2, ccol3 = st.columns([2, 2, 3])
+                    with ccol1:
+                        pending_runs = sorted({job.get('run_id', 'bulk') for job in bulk_pending})
+                        abort_run_id = st.selectbox("Run", pending_runs, key="bulk_abort_run", label_visibility="collapsed")
+                    with ccol2:
+                        abort_clicked = st.button("🛑 Abort Run")
+                    with ccol3:
+                        cancel_all_clicked = st.button(f"⛔ Cancel All Pending ({len(bulk_pending)})")
+                    if abort_clicked or cancel_all_clicked:
+                        to_cancel = bulk_pending if cancel_all_clicked else [job for job in bulk_pending if job.get('run_id', 'bulk') == abort_run_id]
+                        # Stop a pilot's background continuation before cancelling what it already submitted
+                        pilot = st.session_state.get('bulk_pilot')
+                        if pilot and pilot['continuation'] and (cancel_all_clicked or pilot['run_id'] == abort_run_id):
+                            with _background_submission_lock:
+                                pilot['continuation']['cancelled'] = True
+                        with st.spinner(f"Cancelling {len(to_cancel)} jobs..."):
+                            cancelled = cancel_evaluation_jobs(to_cancel)
+                        st.success(f"Cancelled {cancelled} of {len(to_cancel)} pending jobs")
+                
+                # Check status for all jobs
+                if st.button("🔄 Check All Statuses"):
+                    with st.spinner("Checking job statuses..."):
+                        def completed_bulk_jobs():
+                            for job_info in st.session_state.bulk_jobs:
+                                # Check if this job is already processed (or was cancelled)
+                                if not job_info.get('cancelled') and not is_bulk_job_processed(job_info, st.session_state.bulk_results):
+                                    status = check_evaluation_status(job_info['job_id'], job_info.get('chunked'), job_info.get('endpoint_id'))
+                                    
+                                    if status.get('status') == 'COMPLETED':
+                                        yield job_info, status
+                                    elif status.get('status') == 'IN_PROGRESS':
+                                        pass  # Don't show message for every IN_PROGRESS
+                                    elif status.get('status') == 'FAILED':
+                                        # Failed jobs still used queue and GPU time
+                                        record_job_accounting(
+                                            st.session_state.job_accounting, job_info['job_id'], status,
+                                            bulk_job_questions(job_info), 'bulk', job_info.get('run_id', 'bulk'), job_info['interactionid']
+                                        )
+                                        st.error(f"❌ {job_info['interactionid']} - Failed")
                         
-                        # Create pivoted table with ratings
-                        rating_df = results_df.pivot_table(
-                            index='question_label',
-                            columns='interactionid',
-                            values='rating',
-                            aggfunc='first'
-                        )
-                        rating_df = rating_df.fillna('').reset_index()
+                        # Completed outputs are parsed together once every job has been polled
+                        errors = process_bulk_job_statuses(completed_bulk_jobs(), st.session_state.bulk_results, st.session_state.job_accounting)
+                        for job_info, e in errors:
+                            st.error(f"Error processing {job_info['interactionid']}: {e}")
                         
-                        st.write("**Pivoted Results (Ratings by Question):**")
-                        st.dataframe(rating_df, use_container_width=True)
+                        # Remember parsed results so later runs can skip unchanged prompts
+                        if 'bulk_result_store' not in st.session_state:
+                            st.session_state.bulk_result_store = {}
+                        remember_bulk_results(st.session_state.bulk_result_store, st.session_state.bulk_results)
+                        st.session_state.bulk_result_store_revision = st.session_state.get('bulk_result_store_revision', 0) + 1
                         
-                        # Download as CSV
-                        csv = rating_df.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            label="📥 Download Ratings as CSV",
-                            data=csv,
-                            file_name=f"bulk_results_{time.strftime('%Y%m%d_%H%M%S')}.csv",
-                            mime="text/csv"
-                        )
+                    st.rerun()  # Rerun after checking all jobs
+                
+                # Display results
+                if st.session_state.bulk_results:
+                    # Append newly parsed results to the historical store
+                    archive_bulk_results(st.session_state.bulk_results, st.session_state.setdefault('archived_result_keys', set()))
+                    
+                    # Convert to DataFrame for download (pivoted format)
+                    results_df = build_bulk_results_df(st.session_state.bulk_results)
+                    
+                    if not results_df.empty:
+                        st.write("**Results (Original Format):**")
+                        st.dataframe(results_df.drop(columns=['question_label']), use_container_width=True)
+                        
+                        if 'agreement' in results_df:
+                            agreement = results_df['agreement'].dropna()
+                            st.caption(f"🗳️ Self-consistency: mean agreement {agreement.mean():.0%}, "
+                                       f"{(agreement < 1).sum()} of {len(agreement)} answers were not unanimous")
                         
-                        # Download as Excel with multiple sheets
-                        buffer = BytesIO()
-                        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                            # Pivoted ratings
-                            rating_df.to_excel(writer, sheet_name='Ratings (Pivoted)', index=False)
+                        # Pivot the data: Questions as rows, InteractionIDs as columns
+                        try:
+                            # Create pivoted table with ratings
+                            rating_df = pivot_bulk_results(results_df, 'rating')
+                            
+                            st.write("**Pivoted Results (Ratings by Question):**")
+                            st.dataframe(rating_df, use_container_width=True)
+                            
+                            # Download as CSV
+                            with stage_timer('export'):
+                                csv = rating_df.to_csv(index=False).encode('utf-8')
+                            increment_counter('exports', format='csv')
+                            st.download_button(
+                                label="📥 Download Ratings as CSV",
+                                data=csv,
+                                file_name=f"bulk_results_{time.strftime('%Y%m%d_%H%M%S')}.csv",
+                                mime="text/csv"
+                            )
+                            
+                            # Download as Excel with multiple sheets
+                            excel_data = export_bulk_results_excel(
+                                results_df,
+                                rating_df,
+                                session_frame('bulk_transcripts_df')
+                            )
                             
-                            # Create pivoted explanations
-                            explanation_df = results_df.pivot_table(
-                                index='question_label',
-                                columns='interactionid',
-                                values='explanation',
-                                aggfunc='first'
+                            st.download_button(
+                                label="📥 Download Results as Excel",
+                                data=excel_data,
+                                file_name=f"bulk_results_{time.strftime('%Y%m%d_%H%M%S')}.xlsx",
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                             )
-                            explanation_df = explanation_df.fillna('').reset_index()
-                            explanation_df.to_excel(writer, sheet_name='Explanations (Pivoted)', index=False)
+                        except Exception as e:
+                            st.warning(f"Could not pivot results: {e}")
+                            # Fall back to original format if pivot fails
+                            csv = results_df.to_csv(index=False).encode('utf-8')
+                            st.download_button(
+                                label="📥 Download Results as CSV",
+                                data=csv,
+                                file_name=f"bulk_results_{time.strftime('%Y%m%d_%H%M%S')}.csv",
+                                mime="text/csv"
+                            )
+                
+                        st.divider()
+                        render_label_agreement(results_df, st.session_state.get('bulk_test_prompts'))
+                
+                # GPU time and token usage for bulk runs
+                bulk_accounting = {
+                    job_id: record for job_id, record in st.session_state.job_accounting.items()
+                    if record['kind'] == 'bulk'
+                }
+                if bulk_accounting:
+                    with st.expander("💰 GPU Time & Token Usage"):
+                        render_accounting_panel(bulk_accounting, 'bulk')
+                render_makespan_report(st.session_state.get('bulk_jobs', []), st.session_state.job_accounting)
+                
+                # Display job list
+                with st.expander("📋 Job Details"):
+                    for job_info in st.session_state.bulk_jobs:
+                        col1, col2 = st.columns([3, 1])
+                        with col1:
+                            # Check status for multi-prompt or single-prompt jobs
+                            if job_info.get('cancelled'):
+                                status = "🚫 Cancelled"
+                            else:
+                                status = "✅ Completed" if job_info['job_id'] in processed_ids else "⏳ Pending"
+                            if 'prompts' in job_info and len(job_info['prompts']) > 0:
+                                prompt_count = f" ({len(job_info['prompts'])} prompts)"
+                            else:
+                                prompt_count = ""
                             
-                            # Original format
-                            results_df.to_excel(writer, sheet_name='Original Format', index=False)
+                            st.write(f"**{job_info['interactionid']}** - Job ID: `{job_info['job_id']}` - {status}{prompt_count}")
+                        with col2:
+                            if st.button("🗑️", key=f"bulk_remove_{job_info['job_id']}"):
+                                # Stop the job on RunPod too if it has not finished
+                                if job_info['job_id'] not in processed_ids and not job_info.get('cancelled'):
+                                    cancel_evaluation_jobs([job_info])
+                                st.session_state.bulk_jobs.remove(job_info)
+                                
+                                # Remove all related results
+                                if 'prompts' in job_info and len(job_info['prompts']) > 0:
+                                    # Remove multi-prompt results
+                                    keys_to_remove = [key for key in st.session_state.bulk_results.keys() if key.startswith(f"{job_info['job_id']}_")]
+                                    for key in keys_to_remove:
+                                        del st.session_state.bulk_results[key]
+                                else:
+                                    # Single prompt result
+                                    if job_info['job_id'] in st.session_state.bulk_results:
+                                        del st.session_state.bulk_results[job_info['job_id']]
+                                st.rerun()
+            else:
+                st.info("👆 Upload a CSV/Excel file and click 'Start Bulk Testing'")
+            
+        # A/B comparison of two prompt versions over the same transcripts
+        st.subheader("🆚 A/B Prompt Comparison")
+        with st.expander("Compare the prompts above (version A) with another version (B)", expanded='ab_run' in st.session_state):
+            prompts_a = st.session_state.get('bulk_test_prompts')
+            prompts_b = None
+            if prompts_a is None:
+                st.info("Set up version A with the prompt input above first.")
+            elif prompts_a['single']:
+                prompt_b_text = st.text_area("Version B prompt:", value=prompts_a['prompt'], height=200, key="ab_prompt_b")
+                if prompt_b_text.strip():
+                    prompts_b = {'single': True, 'prompt': prompt_b_text}
+            else:
+                prompts_b_file = st.file_uploader(
+                    "Version B prompts file (question_number, question, prompt)",
+                    type=['csv', 'xlsx'],
+                    key="ab_prompts_file"
+                )
+                if prompts_b_file is not None and tab5.open:
+                    try:
+                        prompts_b_df = pd.read_csv(prompts_b_file) if prompts_b_file.name.endswith('.csv') else pd.read_excel(prompts_b_file)
+                        if 'question' not in prompts_b_df.columns or 'prompt' not in prompts_b_df.columns:
+                            st.error("❌ File must have 'question' and 'prompt' columns")
+                        else:
+                            prompts_b = prompts_info_from_df(prompts_b_df)
+                    except Exception as e:
+                        st.error(f"Error reading file: {e}")
+            
+            # The report and the transcripts it runs on load only while the tab is selected
+            if tab5.open:
+                ab_transcripts = session_frame('bulk_transcripts_df')
+                if prompts_b is not None and ab_transcripts is not None:
+                    if st.button("🚀 Start A/B Run"):
+                        if 'bulk_result_store' not in st.session_state:
+                            st.session_state.bulk_result_store = {}
+                        with st.spinner(f"Submitting both versions for {len(ab_transcripts)} transcripts..."):
+                            st.session_state.ab_run = submit_ab_jobs(
+                                ab_transcripts, {'A': prompts_a, 'B': prompts_b}, st.session_state.bulk_result_store,
+                                max_tokens, temperature, chunking=chunking, preprocessing=preprocessing,
+                                structured=structured, adaptive=adaptive, samples=samples, longest_first=longest_first
+                            )
+                        st.success(f"✅ Submitted {len(st.session_state.ab_run['jobs'])} jobs")
+                elif prompts_b is not None:
+                    st.info("Upload a transcripts file above to run the comparison.")
+                
+                ab_run = st.session_state.get('ab_run')
+                if ab_run:
+                    processed = {variant: processed_bulk_job_ids(results) for variant, results in ab_run['results'].items()}
+                    pending = [job for job in ab_run['jobs'] if job['job_id'] not in processed[job['variant']] and not job.get('cancelled')]
+                    carried = {variant: sum(key.startswith('carried-') for key in results) for variant, results in ab_run['results'].items()}
+                    st.write(f"**Jobs:** {len(ab_run['jobs']) - len(pending)}/{len(ab_run['jobs'])} completed · "
+                             f"carried forward: A {carried['A']}, B {carried['B']}")
+                    
+                    if pending and st.button(f"⛔ Cancel A/B Jobs ({len(pending)} pending)"):
+                        with st.spinner("Cancelling jobs..."):
+                            cancelled = cancel_evaluation_jobs(pending)
+                        st.success(f"Cancelled {cancelled} of {len(pending)} pending jobs")
+                        st.rerun()
+                    
+                    if pending and st.button("🔄 Check A/B Statuses"):
+                        with st.spinner("Checking job statuses..."):
+                            def completed_ab_jobs():
+                                for job_info in pending:
+                                    status = check_evaluation_status(job_info['job_id'], job_info.get('chunked'), job_info.get('endpoint_id'))
+                                    if status.get('status') == 'COMPLETED':
+                                        yield job_info, status
+                                    elif status.get('status') == 'FAILED':
+                                        record_job_accounting(
+                                            st.session_state.job_accounting, job_info['job_id'], status,
+                                            bulk_job_questions(job_info), 'bulk', job_info['run_id'], job_info['interactionid']
+                                        )
+                                        st.error(f"❌ {job_info['interactionid']} ({job_info['variant']}) - Failed")
                             
-                            # Transcripts
-                            if 'bulk_transcripts_df' in st.session_state:
-                                st.session_state.bulk_transcripts_df.to_excel(writer, sheet_name='Transcripts', index=False)
+                            errors = process_bulk_job_statuses(completed_ab_jobs(), ab_run['results'], st.session_state.job_accounting, results_key='variant')
+                            for job_info, e in errors:
+                                st.error(f"Error processing {job_info['interactionid']}: {e}")
+                            for results in ab_run['results'].values():
+                                remember_bulk_results(st.session_state.bulk_result_store, results)
+                                archive_bulk_results(results, st.session_state.setdefault('archived_result_keys', set()), 'ab')
+                            st.session_state.bulk_result_store_revision = st.session_state.get('bulk_result_store_revision', 0) + 1
+                        st.rerun()
+                    
+                    if ab_run['shared_questions']:
+                        st.caption(f"{len(ab_run['shared_questions'])} questions have the same prompt in both versions and were evaluated once")
+                    merged, summary, confusion = compare_ab_results(ab_variant_results(ab_run, 'A'), ab_variant_results(ab_run, 'B'))
+                    if summary.empty:
+                        st.info("The agreement report appears once both versions have results for the same transcripts.")
+                    else:
+                        col1, col2, col3 = st.columns(3)
+                        col1.metric("Compared Evaluations", f"{len(merged):,}")
+                        col2.metric("Flipped Ratings", f"{int(merged['flipped'].sum()):,}")
+                        col3.metric("Agreement", f"{(1 - merged['flipped'].mean()) * 100:.1f}%")
+                        
+                        st.write("**Flip Rate by Question:**")
+                        st.dataframe(summary, use_container_width=True)
+                        
+                        confusion_question = st.selectbox("Confusion matrix for:", list(confusion.keys()), key="ab_confusion_question")
+                        st.dataframe(confusion[confusion_question], use_container_width=True)
+                        
+                        flips = merged[merged['flipped']]
+                        if not flips.empty:
+                            st.write(f"**Flipped Ratings ({len(flips)}):**")
+                            st.dataframe(
+                                flips[['interactionid', 'question_label_a', 'rating_a', 'rating_b', 'explanation_a', 'explanation_b']],
+                                use_container_width=True
+                            )
                         
                         st.download_button(
-                            label="📥 Download Results as Excel",
-                            data=buffer.getvalue(),
-                            file_name=f"bulk_results_{time.strftime('%Y%m%d_%H%M%S')}.xlsx",
+                            label="📥 Download A/B Report as Excel",
+                            data=export_ab_report_excel(merged, summary, confusion),
+                            file_name=f"ab_comparison_{time.strftime('%Y%m%d_%H%M%S')}.xlsx",
                             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                         )
-                    except Exception as e:
-                        st.warning(f"Could not pivot results: {e}")
-                        # Fall back to original format if pivot fails
-                        csv = results_df.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            label="📥 Download Results as CSV",
-                            data=csv,
-                            file_name=f"bulk_results_{time.strftime('%Y%m%d_%H%M%S')}.csv",
-                            mime="text/csv"
-                        )
-            
-            # Display job list
-            with st.expander("📋 Job Details"):
-                for job_info in st.session_state.bulk_jobs:
-                    col1, col2 = st.columns([3, 1])
-                    with col1:
-                        # Check status for multi-prompt or single-prompt jobs
-                        if 'prompts' in job_info and len(job_info['prompts']) > 0:
-                            # Multi-prompt mode: check if results exist
-                            exists = any(key.startswith(f"{job_info['job_id']}_") for key in st.session_state.bulk_results.keys())
-                            status = "✅ Completed" if exists else "⏳ Pending"
-                            prompt_count = f" ({len(job_info['prompts'])} prompts)" if 'prompts' in job_info else ""
-                        else:
-                            status = "✅ Completed" if job_info['job_id'] in st.session_state.bulk_results else "⏳ Pending"
-                            prompt_count = ""
-                        
-                        st.write(f"**{job_info['interactionid']}** - Job ID: `{job_info['job_id']}` - {status}{prompt_count}")
-                    with col2:
-                        if st.button("🗑️", key=f"bulk_remove_{job_info['job_id']}"):
-                            st.session_state.bulk_jobs.remove(job_info)
-                            
-                            # Remove all related results
-                            if 'prompts' in job_info and len(job_info['prompts']) > 0:
-                                # Remove multi-prompt results
-                                keys_to_remove = [key for key in st.session_state.bulk_results.keys() if key.startswith(f"{job_info['job_id']}_")]
-                                for key in keys_to_remove:
-                                    del st.session_state.bulk_results[key]
-                            else:
-                                # Single prompt result
-                                if job_info['job_id'] in st.session_state.bulk_results:
-                                    del st.session_state.bulk_results[job_info['job_id']]
-                            st.rerun()
-        else:
-            st.info("👆 Upload a CSV/Excel file and click 'Start Bulk Testing'")
+    
+    # Tab 6: Diagnostics, rendered only while it is the selected tab (its tables are the first thing that needs pandas)
+    if tab6.open:
+        with tab6, profile_section(profile, 'diagnostics'):
+            render_diagnostics()
+    
+    # Export metrics for dashboards
+    try:
+        write_metrics_file()
+    except OSError as e:
+        st.warning(f"Could not write metrics file: {e}")
+    
+    # Persist observed output lengths for adaptive max_tokens
+    try:
+        save_output_history()
+    except OSError as e:
+        st.warning(f"Could not write output length history: {e}")
 
 if __name__ == "__main__":
     main()
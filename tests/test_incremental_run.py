@@ -0,0 +1,85 @@
+"""Incremental re-evaluation: carrying unchanged results forward and submitting the rest"""
+
+import importlib.util
+import os
+
+import pandas as pd
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app()
+
+TRANSCRIPTS = pd.DataFrame({
+    'interactionid': ['INT-1', 'INT-2', 'INT-3'],
+    'transcript': ['Agent: Hello', 'Agent: Hi there', 'Agent: Good morning'],
+})
+
+
+def prompts_info(greeting_prompt='Was the customer greeted?', closing_prompt='Was the call closed?'):
+    return app.prompts_info_from_df(pd.DataFrame({
+        'question_number': [1, 2],
+        'question': ['Greeting', 'Closing'],
+        'prompt': [greeting_prompt, closing_prompt],
+    }))
+
+
+def stored_results(info, transcripts=TRANSCRIPTS):
+    """Result store as if every (transcript, question) of info had been evaluated"""
+    store = {}
+    for idx, row in transcripts.iterrows():
+        for question, prompt in info['prompts'].items():
+            app.remember_bulk_results(store, {f"job-{idx}-{question}": {
+                'interactionid': row['interactionid'],
+                'transcript_hash': app.transcript_digest(row['transcript']),
+                'result': {'rating': 'Yes'},
+                'index': idx,
+                'question': question,
+                'question_number': info['prompts_with_numbers'][question]['question_number'],
+                'prompt_version': app.prompt_version(prompt),
+            }})
+    return store
+
+
+def test_unchanged_results_are_carried_and_a_changed_prompt_is_redone():
+    store = stored_results(prompts_info())
+
+    todo, carried = app.plan_incremental_run(TRANSCRIPTS, prompts_info(closing_prompt='Did the agent close politely?'), store)
+
+    assert todo == {0: ['Closing'], 1: ['Closing'], 2: ['Closing']}
+    assert sorted((entry['index'], entry['question']) for entry in carried) == [(0, 'Greeting'), (1, 'Greeting'), (2, 'Greeting')]
+
+
+def test_edited_transcript_is_evaluated_again():
+    store = stored_results(prompts_info())
+    edited = TRANSCRIPTS.assign(transcript=['Agent: Hello', 'Agent: Hi there, how can I help?', 'Agent: Good morning'])
+
+    todo, carried = app.plan_incremental_run(edited, prompts_info(), store)
+
+    assert todo == {1: ['Greeting', 'Closing']}
+    assert len(carried) == 4
+
+
+def test_only_missing_questions_are_submitted_grouped_by_question_set(monkeypatch):
+    store = stored_results(prompts_info(), TRANSCRIPTS.iloc[:2])
+    submitted = []
+
+    def fake_submit_bulk_jobs(df, info, max_tokens, temperature, run_id=None, **options):
+        submitted.append((list(df.index), sorted(info['prompts'])))
+        return [{'job_id': f"job-{idx}"} for idx in df.index]
+
+    monkeypatch.setattr(app, 'submit_bulk_jobs', fake_submit_bulk_jobs)
+    info = prompts_info(closing_prompt='Did the agent close politely?')
+    jobs, carried_results = app.submit_incremental_bulk_jobs(TRANSCRIPTS, info, store, 512, 0.4, run_id='bulk-2')
+
+    assert sorted(submitted) == [([0, 1], ['Closing']), ([2], ['Closing', 'Greeting'])]
+    assert len(jobs) == 3
+    assert {entry['question'] for entry in carried_results.values()} == {'Greeting'}
+    assert all(entry['carried'] and entry['run_id'] == 'bulk-2' for entry in carried_results.values())
@@ -0,0 +1,44 @@
+"""Extracting result JSON from model outputs"""
+
+import importlib.util
+import os
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app()
+
+
+def extract(text):
+    problems = []
+    return app._extract_jsons_from_response(text, problems), problems
+
+
+def test_objects_one_after_another_after_reasoning():
+    text = '<think>\nWeighing turn 3 {not json}\n</think>\n{"rating": "Yes"}\n{"rating": "No", "notes": {"turn": 3}}'
+
+    assert extract(text) == ([{'rating': 'Yes'}, {'rating': 'No', 'notes': {'turn': 3}}], [])
+
+
+def test_fenced_array_and_json_literals():
+    text = '```json\n[{"rating": "Yes", "escalated": false}, {"rating": "No", "escalated": null}]\n```'
+
+    assert extract(text) == ([{'rating': 'Yes', 'escalated': False}, {'rating': 'No', 'escalated': None}], [])
+
+
+def test_prose_and_python_quoting_fall_back_to_lenient_parsing():
+    assert extract('Here is the answer: {"rating": "Yes"} as requested.') == ([{'rating': 'Yes'}], [])
+    assert extract("{'rating': 'No'}") == ([{'rating': 'No'}], [])
+
+
+def test_no_json_is_reported():
+    results, problems = extract("I cannot evaluate this transcript.")
+
+    assert results == [] and problems
@@ -0,0 +1,46 @@
+"""Scoring bulk results against human QA labels"""
+
+import importlib.util
+import os
+
+import pandas as pd
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app()
+
+SINGLE_PROMPT_RESULTS = pd.DataFrame({
+    'interactionid': ['INT-1', 'INT-2'],
+    'question_number': ['', ''],
+    'question': ['Single Prompt', 'Single Prompt'],
+    'rating': ['Yes', 'No'],
+    'explanation': ['', ''],
+})
+LABELS = pd.DataFrame({
+    'interactionid': ['INT-1', 'INT-2', 'INT-1', 'INT-2'],
+    'question_number': [1, 1, 2, 2],
+    'rating': ['Yes', 'No', 'No', 'Yes'],
+})
+
+
+def test_single_prompt_is_scored_against_the_chosen_question_only():
+    merged, summary, confusion = app.score_against_labels(SINGLE_PROMPT_RESULTS, LABELS, single_question_number='1')
+
+    assert len(merged) == 2 and merged['match'].all()
+    assert summary['question_number'].tolist() == ['1']
+    assert summary['unmatched_labels'].tolist() == [0]
+    assert list(confusion) == ['1']
+
+
+def test_single_prompt_without_a_question_number_matches_nothing():
+    merged, summary, _ = app.score_against_labels(SINGLE_PROMPT_RESULTS, LABELS)
+
+    assert merged.empty and summary.empty
@@ -0,0 +1,84 @@
+"""Pilot runs: the stratified sample, its priority and the background continuation"""
+
+import importlib.util
+import os
+import time
+
+import pandas as pd
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app()
+
+TRANSCRIPTS = pd.DataFrame({
+    'interactionid': [f"INT-{n}" for n in range(100)],
+    'transcript': ["Agent: hello " * (n + 1) for n in range(100)],
+    'team': ['billing'] * 80 + ['support'] * 20,
+})
+
+
+def wait_until_done(progress, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with app._background_submission_lock:
+            if progress['done']:
+                return
+        time.sleep(0.01)
+    raise AssertionError("background submission did not finish")
+
+
+def test_pilot_sample_keeps_every_stratum_and_leaves_the_rest():
+    sample = app.stratified_sample(TRANSCRIPTS, 10, 'team')
+    remaining = TRANSCRIPTS.drop(index=sample.index)
+
+    assert sample['team'].value_counts().to_dict() == {'billing': 8, 'support': 2}
+    assert len(remaining) == 90 and not set(remaining.index) & set(sample.index)
+
+
+def test_length_strata_cover_short_and_long_transcripts():
+    sample = app.stratified_sample(TRANSCRIPTS, 8)
+    quartiles = pd.qcut(TRANSCRIPTS['transcript'].str.len(), 4, labels=False)
+
+    assert sorted(quartiles.loc[sample.index].value_counts().to_dict().items()) == [(0, 2), (1, 2), (2, 2), (3, 2)]
+
+
+def test_pilot_jobs_can_skip_the_bulk_queue(monkeypatch):
+    priorities = []
+
+    def fake_submit_evaluation(transcript, prompt, max_tokens, temperature, chunking=None, structured=None,
+                               adaptive=None, samples=1, priority=app.PRIORITY_INTERACTIVE, question_prompts=None):
+        priorities.append(priority)
+        return f"job-{len(priorities)}", False
+
+    monkeypatch.setattr(app, 'submit_evaluation', fake_submit_evaluation)
+    info = {'single': True, 'prompt': 'Was the customer greeted?'}
+    app.submit_bulk_jobs(TRANSCRIPTS.iloc[:2], info, 512, 0.4, priority=app.PRIORITY_INTERACTIVE)
+    app.submit_bulk_jobs(TRANSCRIPTS.iloc[2:4], info, 512, 0.4)
+
+    assert priorities == [app.PRIORITY_INTERACTIVE] * 2 + [app.PRIORITY_BULK] * 2
+
+
+def test_incremental_continuation_submits_only_planned_questions(monkeypatch):
+    submitted = []
+
+    def fake_submit_bulk_jobs(df, info, max_tokens, temperature, run_id=None, **options):
+        submitted.append((list(df.index), sorted(info['prompts'])))
+        return [{'job_id': f"job-{idx}"} for idx in df.index]
+
+    monkeypatch.setattr(app, 'submit_bulk_jobs', fake_submit_bulk_jobs)
+    info = {'single': False, 'prompts': {'Greeting': 'Greeted?', 'Closing': 'Closed?'}, 'prompts_with_numbers': {}}
+    todo = {3: ['Closing'], 60: ['Closing'], 61: ['Greeting', 'Closing']}
+
+    progress = app.start_background_submission(TRANSCRIPTS, info, 512, 0.4, 'bulk-1', todo=todo)
+    wait_until_done(progress)
+
+    assert progress['total'] == 3 and progress['submitted_rows'] == 3
+    assert sorted(submitted) == [([3, 60], ['Closing']), ([61], ['Closing', 'Greeting'])]
@@ -0,0 +1,71 @@
+"""Gzipped /run bodies and the fallback to plain JSON for endpoints that reject them"""
+
+import importlib.util
+import os
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_module("streamlit_app")
+mock_runpod_server = load_module("mock_runpod_server")
+
+PAYLOAD = {'input': {'prompt': "Rate the greeting. Agent: Hello, thanks for calling. " * 100, 'max_tokens': 64}}
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """Start a mock endpoint with the given options and return its endpoint config, with compression on"""
+    servers = []
+    monkeypatch.setitem(app._transport_config, 'compress', True)
+
+    def start(**options):
+        server, base_url = mock_runpod_server.start_mock_server(exec_time='fixed:0', **options)
+        servers.append(server)
+        endpoint = {'id': f"ep-{uuid.uuid4().hex[:8]}", 'weight': 1.0, 'max_concurrency': None,
+                    'base_url': base_url, 'api_key': 'test-key'}
+        return server.mock, endpoint
+
+    yield start
+    for server in servers:
+        server.mock.stop()
+        server.shutdown()
+
+
+def test_large_bodies_are_sent_gzipped(serve):
+    mock, endpoint = serve()
+
+    response = app.send_job_payload(endpoint, PAYLOAD)
+
+    assert response.status_code == 200 and response.json()['id']
+    assert mock.counters['request_bytes'] * 5 < mock.counters['request_bytes_decoded']
+    assert endpoint['id'] not in app._compression_rejected
+
+
+def test_small_bodies_are_sent_plain(serve):
+    mock, endpoint = serve()
+
+    assert app.send_job_payload(endpoint, {'input': {'prompt': 'Hi'}}).status_code == 200
+    assert mock.counters['request_bytes'] == mock.counters['request_bytes_decoded']
+
+
+def test_endpoint_without_gzip_support_gets_plain_bodies_from_then_on(serve):
+    mock, endpoint = serve(accept_gzip=False)
+
+    first = app.send_job_payload(endpoint, PAYLOAD)  # 415, then resent plain
+    assert first.status_code == 200 and first.json()['id']
+    assert endpoint['id'] in app._compression_rejected
+    sent_after_first = mock.counters['request_bytes']
+
+    assert app.send_job_payload(endpoint, PAYLOAD).status_code == 200
+    plain_size = len(app.encode_payload(PAYLOAD)[0])
+    assert mock.counters['request_bytes'] - sent_after_first == plain_size  # One plain request, no gzip attempt
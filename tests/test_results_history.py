@@ -0,0 +1,58 @@
+"""Archiving parsed results to the Parquet store and querying them back"""
+
+import importlib.util
+import os
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app()
+
+BULK_RESULTS = {
+    'job-1': {'interactionid': 'INT-1', 'question_number': 1, 'question': 'Greeting', 'run_id': 'bulk-1',
+              'prompt_version': 'v1', 'result': {'rating': 'Yes', 'explanation': 'Greeted'}},
+    'job-2': {'interactionid': 'INT-2', 'question_number': 2, 'question': 'Closing', 'run_id': 'bulk-1',
+              'prompt_version': 'v1', 'result': {'rating': 'No', 'explanation': 'No closing'}},
+    'carried-INT-3-1': {'interactionid': 'INT-3', 'question_number': 1, 'question': 'Greeting', 'run_id': 'bulk-0',
+                        'prompt_version': 'v1', 'result': {'rating': 'Yes'}, 'carried': True},
+}
+
+
+def test_archived_results_are_queried_by_filter(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'RESULTS_STORE_DIR', str(tmp_path / "store"))
+    archived = set()
+
+    assert app.archive_bulk_results(BULK_RESULTS, archived) == 2
+    assert app.archive_bulk_results(BULK_RESULTS, archived) == 0  # Already archived this session
+    assert archived == {'job-1', 'job-2'}
+
+    dataset = app.results_history_dataset()
+    files = tuple(sorted(dataset.files))
+    assert len(files) == 1 and "run_id=bulk-1" in files[0]
+    assert app.results_history_values(dataset, files, 'question_number') == ['1', '2']
+
+    today = time.strftime('%Y-%m-%d')
+    rows = app.query_results_history(dataset, ['run_id', 'interactionid', 'rating'],
+                                     app.results_history_filter(today, today, ['2']))
+    assert rows.to_dict('records') == [{'run_id': 'bulk-1', 'interactionid': 'INT-2', 'rating': 'No'}]
+
+    counts = app.aggregate_results_history(dataset, files, ('question_number',), (today, today, ('1',), ('bulk',), ''))
+    assert counts.to_dict('records') == [{'question_number': '1', 'rating': 'Yes', 'count': 1}]
+
+
+def test_date_filter_excludes_other_partitions(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'RESULTS_STORE_DIR', str(tmp_path / "store"))
+    app.append_results_history([app.result_history_row({'rating': 'Yes'}, 'test')], 'test')
+
+    dataset = app.results_history_dataset()
+    files = tuple(sorted(dataset.files))
+    counts = app.aggregate_results_history(dataset, files, ('date',), ('2000-01-01', '2000-01-31'))
+    assert counts.empty
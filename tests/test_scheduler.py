@@ -0,0 +1,76 @@
+"""Priority scheduling: holding bulk jobs and dispatching them in submission order"""
+
+import importlib.util
+import os
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app()
+
+
+def wait_until_dispatched(timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with app._scheduler_lock:
+            if app._scheduler_worker['thread'] is None:
+                return
+        time.sleep(0.01)
+    raise AssertionError("held jobs were not dispatched")
+
+
+def fake_endpoint(monkeypatch, headroom):
+    """Record posted payloads and give every endpoint headroom[0] free slots"""
+    posted = []
+
+    def fake_post_job_to_endpoint(endpoint, payload, description="job"):
+        posted.append(payload['n'])
+        return f"job-{payload['n']}"
+
+    monkeypatch.setattr(app, 'post_job_to_endpoint', fake_post_job_to_endpoint)
+    monkeypatch.setattr(app, 'bulk_headroom', lambda endpoint: headroom[0])
+    monkeypatch.setattr(app, 'SCHEDULER_TICK', 0.01)
+    return posted
+
+
+def test_held_jobs_wait_for_headroom_and_keep_their_order(monkeypatch):
+    headroom = [0]
+    posted = fake_endpoint(monkeypatch, headroom)
+    monkeypatch.setitem(app._scheduler_config, 'enabled', True)
+
+    tickets = [app.post_job({'n': n}, priority=app.PRIORITY_BULK) for n in range(4)]
+    assert app.post_job({'n': 'interactive'}) == "job-interactive"  # Never held
+    assert all(ticket.startswith(app.HELD_JOB_PREFIX) for ticket in tickets)
+    assert app.release_held_job(tickets[1])
+
+    headroom[0] = 1
+    wait_until_dispatched()
+
+    assert posted == ['interactive', 0, 2, 3]
+    assert [app.scheduled_job(ticket)['job_id'] for ticket in tickets] == ["job-0", None, "job-2", "job-3"]
+    assert app.scheduled_job(tickets[1])['error'] == 'CANCELLED'
+    assert not app.release_held_job(tickets[0])  # Already dispatched
+
+
+def test_turning_scheduling_off_releases_everything_held(monkeypatch):
+    posted = fake_endpoint(monkeypatch, [0])
+    app.configure_scheduler(True, 0.5)
+    try:
+        for n in range(3):
+            app.post_job({'n': n}, priority=app.PRIORITY_BULK)
+        assert app.held_job_count() == 3
+        app.configure_scheduler(False)
+        wait_until_dispatched()
+    finally:
+        app.configure_scheduler(False)
+
+    assert posted == [0, 1, 2]
+    assert app.held_job_count() == 0
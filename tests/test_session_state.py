@@ -0,0 +1,65 @@
+"""Session state must survive Streamlit reruns"""
+
+import os
+
+import pytest
+
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    # Nothing listens here, so the background /health check fails fast instead of reaching RunPod
+    monkeypatch.setenv("RUNPOD_BASE_URL", "http://127.0.0.1:9/v2")
+    # Keep archived results, spilled session state, profiles and output lengths out of the working tree
+    monkeypatch.setenv("AQA_RESULTS_STORE", str(tmp_path / "results_store"))
+    monkeypatch.setenv("AQA_SESSION_SPILL_DIR", str(tmp_path / "spill"))
+    monkeypatch.setenv("AQA_PROFILE_DIR", str(tmp_path / "profiles"))
+    monkeypatch.setenv("AQA_OUTPUT_HISTORY_FILE", str(tmp_path / "output_length_history.json"))
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    assert not at.exception
+    return at
+
+
+ANSWER = {'question': 'Did the agent greet the customer?', 'rating': 'Yes', 'explanation': 'Greeted by name.'}
+BULK_RECORD = {
+    'interactionid': 'INT-1', 'transcript_hash': 'abc', 'result': ANSWER, 'index': 0,
+    'question': ANSWER['question'], 'question_number': 1, 'prompt': 'Single Prompt',
+    'prompt_version': 'v1', 'run_id': 'bulk-test',
+}
+
+
+def test_managed_state_survives_rerun(app):
+    app.session_state['test_results']['job-1'] = [ANSWER]
+    app.session_state['bulk_results']['job-2_0'] = BULK_RECORD
+
+    app.run()
+    app.run()
+
+    assert not app.exception
+    assert dict(app.session_state['test_results'].items()) == {'job-1': [ANSWER]}
+    assert dict(app.session_state['bulk_results'].items()) == {'job-2_0': BULK_RECORD}
+
+
+def test_plain_dict_assigned_during_rerun_is_wrapped(app):
+    app.session_state['batch_results'] = {'job-3': [ANSWER]}
+
+    app.run()
+
+    assert not app.exception
+    results = app.session_state['batch_results']
+    assert hasattr(results, 'memory_bytes')
+    assert dict(results.items()) == {'job-3': [ANSWER]}
+
+
+def test_memory_report_renders_with_unmanaged_none_values(app):
+    app.session_state['bulk_results']['job-2_0'] = BULK_RECORD
+    app.session_state['unrelated_setting'] = None
+    app.session_state['active_tab'] = '🩺 Diagnostics'
+
+    app.run()
+
+    assert not app.exception
@@ -0,0 +1,34 @@
+"""Process-wide state must be shared by every rerun, not rebuilt by each one"""
+
+import importlib.util
+import os
+import threading
+from collections import deque
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+MUTABLE_TYPES = (dict, list, set, deque, type(threading.Lock()), type(threading.RLock()))
+
+
+def load_app():
+    """Execute the script in a fresh module, as Streamlit does on every rerun"""
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_module_state_is_shared_across_reruns():
+    first, second = load_app(), load_app()
+    shared = [name for name, value in vars(first).items()
+              if name.startswith('_') and not name.startswith('__') and isinstance(value, MUTABLE_TYPES)]
+
+    assert '_counters' in shared and '_endpoint_state' in shared
+    rebuilt = [name for name in shared if getattr(second, name) is not getattr(first, name)]
+    assert rebuilt == [], f"rebuilt on rerun (build them in an st.cache_resource factory): {rebuilt}"
+
+
+def test_counters_recorded_in_one_rerun_are_seen_by_the_next():
+    first = load_app()
+    first.increment_counter('rerun_probe')
+    second = load_app()
+    assert second._counters[('rerun_probe', ())] >= 1
@@ -0,0 +1,72 @@
+"""Memory-bounded session maps: spilling cold entries to disk and reading them back"""
+
+import importlib.util
+import os
+
+import pandas as pd
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app()
+
+
+def result(n):
+    return {'interactionid': f"INT-{n}", 'result': {'rating': 'Yes', 'explanation': "Greeted by name. " * 20}}
+
+
+def spill_dict(tmp_path, monkeypatch, name='bulk_results', limit_bytes=2000):
+    monkeypatch.setattr(app, 'SESSION_SPILL_DIR', str(tmp_path))
+    store = app.SessionStore(limit_bytes)
+    return store, app.SpillDict(store, name)
+
+
+def test_cold_entries_spill_and_read_back_unchanged(tmp_path, monkeypatch):
+    store, results = spill_dict(tmp_path, monkeypatch)
+    for n in range(10):
+        results[f"job-{n}"] = result(n)
+
+    usage = results.usage()
+    assert usage['on_disk'] > 0 and usage['in_memory'] >= 1
+    assert store.hot_bytes <= store.limit_bytes
+    assert os.path.exists(os.path.join(store.directory, "spill.sqlite"))
+
+    assert len(results) == 10 and "job-0" in results
+    assert results["job-0"] == result(0)  # Paged back in
+    assert "job-0" in results._hot
+    assert dict(results.items()) == {f"job-{n}": result(n) for n in range(10)}
+
+
+def test_overwrite_and_delete_reach_spilled_entries(tmp_path, monkeypatch):
+    store, results = spill_dict(tmp_path, monkeypatch)
+    for n in range(10):
+        results[f"job-{n}"] = result(n)
+    spilled = sorted(results._spilled)
+
+    results[spilled[0]] = {'rating': 'No'}
+    del results[spilled[1]]
+
+    assert results[spilled[0]] == {'rating': 'No'}
+    assert spilled[1] not in results and len(results) == 9
+    assert spilled[1] not in dict(store.read_all('bulk_results'))
+
+    results.clear()
+    assert len(results) == 0 and list(store.read_all('bulk_results')) == []
+
+
+def test_maps_share_one_session_budget(tmp_path, monkeypatch):
+    store, results = spill_dict(tmp_path, monkeypatch, limit_bytes=50_000)
+    frames = app.SpillDict(store, 'session_frames')
+    results['job-1'] = result(1)
+    frames['upload'] = pd.DataFrame({'transcript': ["Agent: hello " * 50] * 200})
+
+    assert results.usage()['on_disk'] == 1  # Evicted by the newer, larger frame
+    assert results['job-1'] == result(1)
+    assert frames['upload'].shape == (200, 1)
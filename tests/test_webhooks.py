@@ -0,0 +1,85 @@
+"""Completion webhooks: ingesting callbacks, including ones that beat the /run response"""
+
+import importlib.util
+import os
+import uuid
+
+import pytest
+import requests
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("streamlit_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_app()
+
+
+def final_status(state='COMPLETED'):
+    return {'id': f"job-{uuid.uuid4().hex}", 'status': state, 'executionTime': 1200, 'delayTime': 300}
+
+
+def test_callback_for_an_awaited_job_is_stored_once():
+    status = final_status()
+    app.expect_webhook(status['id'])
+
+    assert app.awaiting_webhook(status['id'])
+    assert app.ingest_webhook_status(status)
+    assert not app.ingest_webhook_status(status)  # RunPod retries must not store it again
+    assert app.take_webhook_status(status['id']) == status
+    assert app.take_webhook_status(status['id']) is None
+
+
+def test_early_callback_is_picked_up_when_the_job_is_registered():
+    status = final_status('FAILED')
+
+    assert not app.ingest_webhook_status(status)  # /run has not returned yet
+    app.expect_webhook(status['id'])
+
+    assert not app.awaiting_webhook(status['id'])
+    assert app.take_webhook_status(status['id']) == status
+
+
+def test_expired_early_callback_is_not_used(monkeypatch):
+    status = final_status()
+    app.ingest_webhook_status(status)
+    monkeypatch.setattr(app, 'WEBHOOK_EARLY_TTL', -1.0)
+    app.expect_webhook(status['id'])
+
+    assert app.take_webhook_status(status['id']) is None
+    assert app.awaiting_webhook(status['id'])
+
+
+def test_unfinished_status_is_ignored():
+    status = final_status('IN_PROGRESS')
+
+    assert not app.ingest_webhook_status(status)
+    app.expect_webhook(status['id'])
+    assert app.take_webhook_status(status['id']) is None
+
+
+def test_receiver_accepts_only_its_secret_path():
+    url = app.start_webhook_receiver(port=0)
+    try:
+        status = final_status()
+        app.expect_webhook(status['id'])
+        wrong = url.rsplit('/', 1)[0] + '/' + uuid.uuid4().hex
+
+        assert requests.post(wrong, json=status, timeout=5).status_code == 404
+        assert requests.post(url, json=status, timeout=5).status_code == 200
+        assert app.take_webhook_status(status['id']) == status
+    finally:
+        app.stop_webhook_receiver()
+
+
+def test_exposed_receiver_requires_a_secret(monkeypatch):
+    monkeypatch.setattr(app, 'WEBHOOK_SECRET', '')
+    with pytest.raises(ValueError):
+        app.webhook_secret('https://qa-tools.example.com')
+    monkeypatch.setattr(app, 'WEBHOOK_SECRET', 's' * app.WEBHOOK_SECRET_MIN_LENGTH)
+    assert app.webhook_secret('https://qa-tools.example.com') == 's' * app.WEBHOOK_SECRET_MIN_LENGTH